@@ -0,0 +1,192 @@
+# Copyright (c) 2023, Xilinx
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of FINN nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as np
+import warnings
+from qonnx.custom_op.registry import getCustomOp
+
+from finn.util.fpgadataflow import decode_chrc, is_fpgadataflow_node
+
+# Token-level simulation of a dataflow graph, as a fast alternative to
+# RTL simulation for FIFO sizing and performance estimation. Each node is
+# modeled as a fixed sequence of transactions on its streams per sample (see
+# node_txn_schedule). A node performs its transactions in this order and
+# keeps at least the nominal distance between consecutive ones, but an input
+# transaction cannot happen before the token has been produced upstream.
+# FIFOs are assumed to be unbounded, so that the transaction times of the
+# whole graph follow from one max-plus scan per node in topological order,
+# and the FIFO depth for each stream is the highest occupancy it reaches.
+# Instead of backpressure, the graph inputs provide a new sample every ii
+# cycles of the slowest node, so that faster nodes cannot run ahead.
+
+
+def _stream_txns(inst, ind, is_input):
+    # number of transactions per sample on the given stream of the node
+    if is_input:
+        if ind == 0:
+            folded_shape = inst.get_folded_input_shape()
+        else:
+            folded_shape = inst.get_folded_input_shape(ind)
+    else:
+        if ind == 0:
+            folded_shape = inst.get_folded_output_shape()
+        else:
+            folded_shape = inst.get_folded_output_shape(ind)
+    return int(np.prod(folded_shape[:-1]))
+
+
+def node_txn_schedule(model, node):
+    """Return the per-sample transaction schedule of the given dataflow node,
+    assuming its inputs are always valid and its outputs always ready, as
+    (in_cycles, out_cycles, ii). in_cycles maps the index of each dynamic
+    input of the node to the cycles at which the node consumes its tokens,
+    out_cycles is the list of the cycles at which tokens are produced for each
+    output, and ii is the number of cycles after which the node starts with
+    the next sample.
+
+    The stored characteristic functions (see DeriveCharacteristic) are used if
+    available, otherwise the transactions on each stream are spread evenly
+    over the expected cycles of the node (get_exp_cycles)."""
+    inst = getCustomOp(node)
+    in_inds = [i for i, x in enumerate(node.input) if model.get_initializer(x) is None]
+    n_in = [_stream_txns(inst, i, True) for i in in_inds]
+    n_out = [_stream_txns(inst, i, False) for i in range(len(node.output))]
+    ii = max([int(inst.get_exp_cycles()), 1] + n_in + n_out)
+    period = inst.get_nodeattr("io_chrc_period")
+    if period > 0:
+        in_cycles = decode_chrc(inst.get_nodeattr("io_chrc_in"), period)
+        out_cycles = decode_chrc(inst.get_nodeattr("io_chrc_out"), period)
+        if [len(x) for x in in_cycles] == n_in and [len(x) for x in out_cycles] == n_out:
+            return (dict(zip(in_inds, in_cycles)), out_cycles, ii)
+        warnings.warn(
+            "Characteristic of %s does not match its folded shapes, using exp_cycles" % node.name
+        )
+    in_cycles = [np.arange(n) * ii // n for n in n_in]
+    out_cycles = [np.arange(1, n + 1) * ii // n - 1 for n in n_out]
+    return (dict(zip(in_inds, in_cycles)), out_cycles, ii)
+
+
+def fifo_max_occupancy(prod_cycles, cons_cycles):
+    """Return the highest occupancy of an unbounded FIFO, given the (sorted)
+    cycles at which its tokens are pushed and popped. A token pushed in cycle
+    t can be popped from cycle t+1 on."""
+    assert len(prod_cycles) == len(cons_cycles), "Mismatching number of transactions"
+    if len(prod_cycles) == 0:
+        return 0
+    # number of tokens in the FIFO right after each push
+    n_popped = np.searchsorted(cons_cycles, prod_cycles + 1, side="left")
+    return int((np.arange(1, len(prod_cycles) + 1) - n_popped).max())
+
+
+def dataflow_tokensim(model, n_samples=None):
+    """Simulate the dataflow graph at the level of stream transactions, using
+    node_txn_schedule as the cycle model of each node. Graph inputs provide a
+    new sample every ii cycles of the slowest node, graph outputs are assumed
+    to be always ready.
+
+    Preconditions:
+    - model consists of fpgadataflow nodes in topological order
+    - stream widths match between nodes (see InsertDWC)
+
+    * n_samples (int or None) number of samples to simulate. If None, uses 2
+      for graphs with ConvolutionInputGenerator nodes and the number of nodes
+      otherwise, similar to InsertAndSetFIFODepths.
+
+    Returns:
+    - fifo_depths : FIFO depth that avoids any stalls on each tensor between
+      two nodes, keyed by tensor name
+    - latency_cycles : cycles until the last output of the first sample
+    - cycles : cycles until the last output of the last sample
+    - interval_cycles : cycles between consecutive samples at the output
+    - n_samples : number of simulated samples
+    """
+    if n_samples is None:
+        swg_nodes = [x for x in model.graph.node if "ConvolutionInputGenerator" in x.op_type]
+        n_samples = 2 if len(swg_nodes) > 0 else max(2, len(model.graph.node))
+    graph_inputs = [x.name for x in model.graph.input]
+    graph_outputs = [x.name for x in model.graph.output]
+    for node in model.graph.node:
+        assert is_fpgadataflow_node(node), "Found non-fpgadataflow node " + node.name
+    schedules = [node_txn_schedule(model, node) for node in model.graph.node]
+    max_ii = max([x[2] for x in schedules])
+    sample_offsets = np.arange(n_samples, dtype=np.int64)[:, None]
+    # cycles at which each token of a tensor is produced, over all samples
+    prod_cycles = {}
+    fifo_depths = {}
+    for node, (in_cycles, out_cycles, ii) in zip(model.graph.node, schedules):
+        # all transactions of the node in nominal order: sort by nominal
+        # cycle, inputs before outputs in the same cycle
+        streams = [(node.input[i], x, True) for (i, x) in in_cycles.items()]
+        streams += [(node.output[i], x, False) for (i, x) in enumerate(out_cycles)]
+        nominal = []
+        arrival = []
+        is_output = []
+        for tensor_name, cycles, is_input in streams:
+            cycles = np.asarray(cycles, dtype=np.int64)
+            sample_start = np.zeros((n_samples, len(cycles)), dtype=np.int64) + sample_offsets
+            nominal.append((cycles + ii * sample_start).flatten())
+            if not is_input:
+                arrival.append(np.zeros(sample_start.size, dtype=np.int64))
+            elif tensor_name in graph_inputs:
+                arrival.append((max_ii * sample_start).flatten())
+            else:
+                assert tensor_name in prod_cycles, "Graph is not topologically sorted"
+                arrival.append(prod_cycles[tensor_name] + 1)
+            is_output.append(np.full(sample_start.size, not is_input))
+        offsets = np.cumsum([0] + [len(x) for x in nominal])
+        nominal = np.concatenate(nominal)
+        arrival = np.concatenate(arrival)
+        order = np.lexsort((np.concatenate(is_output), nominal))
+        # each transaction happens at its nominal distance from the previous
+        # one, or as soon as its token arrives if that is later
+        delay = np.maximum.accumulate(np.maximum(arrival[order] - nominal[order], 0))
+        actual = np.empty_like(nominal)
+        actual[order] = nominal[order] + delay
+        for (tensor_name, _, is_input), start, end in zip(streams, offsets[:-1], offsets[1:]):
+            if not is_input:
+                prod_cycles[tensor_name] = actual[start:end]
+            elif tensor_name not in graph_inputs:
+                fifo_depths[tensor_name] = fifo_max_occupancy(
+                    prod_cycles[tensor_name], actual[start:end]
+                )
+    # a sample is complete when the last token of all outputs was produced
+    sample_done = np.max(
+        [prod_cycles[x].reshape(n_samples, -1)[:, -1] for x in graph_outputs], axis=0
+    )
+    latency_cycles = int(sample_done[0]) + 1
+    if n_samples > 1:
+        interval_cycles = float(sample_done[-1] - sample_done[0]) / (n_samples - 1)
+    else:
+        interval_cycles = float(latency_cycles)
+    return {
+        "fifo_depths": fifo_depths,
+        "latency_cycles": latency_cycles,
+        "cycles": int(sample_done[-1]) + 1,
+        "interval_cycles": interval_cycles,
+        "n_samples": n_samples,
+    }
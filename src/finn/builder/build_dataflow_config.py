@@ -38,10 +38,13 @@ from finn.util.basic import alveo_default_platform, alveo_part_map, pynq_part_ma
 
 
 class AutoFIFOSizingMethod(str, Enum):
-    "Select the type of automatic FIFO sizing strategy."
+    """Select the type of automatic FIFO sizing strategy. TOKENSIM estimates
+    the FIFO depths by a token-level simulation of the dataflow graph, which
+    needs neither HLS synthesis nor RTL simulation."""
 
     CHARACTERIZE = "characterize"
     LARGEFIFO_RTLSIM = "largefifo_rtlsim"
+    TOKENSIM = "tokensim"
 
 
 class ShellFlowType(str, Enum):
@@ -102,6 +105,8 @@ class VerificationStepType(str, Enum):
     TIDY_UP_PYTHON = "initial_python"
     #: verify after step_streamline , using Python execution
     STREAMLINED_PYTHON = "streamlined_python"
+    #: verify after step_apply_folding_config, using the NumPy model of each HLS node
+    FOLDED_HLS_PYTHON = "folded_hls_python"
     #: verify after step_apply_folding_config, using C++ for each HLS node
     FOLDED_HLS_CPPSIM = "folded_hls_cppsim"
     #: verify after step_create_stitched_ip, using stitched-ip Verilog
@@ -269,10 +274,40 @@ class DataflowBuildConfig:
     #: setting the FIFO sizes.
     auto_fifo_strategy: Optional[AutoFIFOSizingMethod] = AutoFIFOSizingMethod.LARGEFIFO_RTLSIM
 
+    #: When `auto_fifo_depths = True`, only re-size the FIFOs around the nodes
+    #: whose hardware attributes (e.g. PE/SIMD) changed since a previous build,
+    #: keeping all other FIFO depths from `previous_hw_config_file`. The changed
+    #: nodes and their direct neighbours are characterized as in the
+    #: `characterize` strategy. Falls back to `auto_fifo_strategy` if there is no
+    #: previous configuration or the nodes of the network changed.
+    incremental_fifo_sizing: Optional[bool] = False
+
+    #: The final_hw_config.json of the previous build to compare against for
+    #: `incremental_fifo_sizing`. If not specified, the final_hw_config.json
+    #: in the `output_dir` of this build is used.
+    previous_hw_config_file: Optional[str] = None
+
     #: Avoid using C++ rtlsim for auto FIFO sizing and rtlsim throughput test
     #: if set to True, always using Python instead
     force_python_rtlsim: Optional[bool] = False
 
+    #: Traffic patterns of the input and output streams in the C++ rtlsim used
+    #: for FIFO sizing (`largefifo_rtlsim`) and rtlsim performance measurement,
+    #: so that FIFOs can be sized for bursty inputs or backpressure on outputs.
+    #: One of "rate:<r>" (fixed rate, fraction of cycles), "burst:<on>:<off>"
+    #: (on/off bursts in cycles) or "trace:<file>" (whitespace-separated 1/0
+    #: per cycle, replayed cyclically), see
+    #: :py:func:`finn.util.pyverilator.fifosim_traffic_pattern`.
+    #: If not specified, inputs are always valid and outputs always ready.
+    fifosim_input_traffic: Optional[str] = None
+    fifosim_output_traffic: Optional[str] = None
+
+    #: If set to True, the C++ rtlsim performance measurement is done on a
+    #: stitched IP with depth monitoring on all RTL FIFOs, and the occupancy
+    #: histogram and number of cycles at full of each FIFO are reported in
+    #: rtlsim_performance.json. Requires an extra stitched IP generation.
+    rtlsim_monitor_fifos: Optional[bool] = False
+
     #: Memory resource type for large FIFOs
     #: Only relevant when `auto_fifo_depths = True`
     large_fifo_mem_style: Optional[LargeFIFOMemStyle] = LargeFIFOMemStyle.AUTO
@@ -71,7 +71,7 @@ from finn.builder.build_dataflow_config import (
     ShellFlowType,
     VerificationStepType,
 )
-from finn.core.onnx_exec import execute_onnx
+from finn.core.onnx_exec import execute_onnx_batch
 from finn.core.rtlsim_exec import rtlsim_exec
 from finn.core.throughput_test import throughput_test_rtlsim
 from finn.transformation.fpgadataflow.annotate_cycles import AnnotateCycles
@@ -83,6 +83,9 @@ from finn.transformation.fpgadataflow.create_stitched_ip import CreateStitchedIP
 from finn.transformation.fpgadataflow.derive_characteristic import (
     DeriveCharacteristic,
     DeriveFIFOSizes,
+    DeriveFIFOSizesIncremental,
+    DeriveFIFOSizesTokenSim,
+    get_changed_nodes,
 )
 from finn.transformation.fpgadataflow.hlssynth_ip import HLSSynthIP
 from finn.transformation.fpgadataflow.insert_dwc import InsertDWC
@@ -121,8 +124,8 @@ from finn.util.basic import (
     get_rtlsim_trace_depth,
     pyverilate_get_liveness_threshold_cycles,
 )
-from finn.util.pyverilator import verilator_fifosim
-from finn.util.test import execute_parent
+from finn.util.pyverilator import get_fifo_occupancy, verilator_fifosim
+from finn.util.test import execute_parent_batch
 
 
 def verify_step(
@@ -140,76 +143,87 @@ def verify_step(
     bsize_in = in_npy_all.shape[0]
     bsize_out = exp_out_npy_all.shape[0]
     assert bsize_in == bsize_out, "Batch sizes don't match for verification IO pair"
-    all_res = True
+    if need_parent:
+        assert cfg.save_intermediate_models, "Enable save_intermediate_models for verification"
+        parent_model_fn = intermediate_models_dir + "/dataflow_parent.onnx"
+        child_model_fn = intermediate_models_dir + "/verify_%s.onnx" % step_name
+        model.save(child_model_fn)
+        parent_model = ModelWrapper(parent_model_fn)
+        inp_tensor_name = parent_model.graph.input[0].name
+        out_tensor_name = parent_model.graph.output[0].name
+        exp_ishape = parent_model.get_tensor_shape(inp_tensor_name)
+    else:
+        inp_tensor_name = model.graph.input[0].name
+        out_tensor_name = model.graph.output[0].name
+        exp_ishape = model.get_tensor_shape(inp_tensor_name)
+    in_npys = []
     for b in range(bsize_in):
         in_npy = np.expand_dims(in_npy_all[b], axis=0)
-        exp_out_npy = np.expand_dims(exp_out_npy_all[b], axis=0)
-        if need_parent:
-            assert cfg.save_intermediate_models, "Enable save_intermediate_models for verification"
-            parent_model_fn = intermediate_models_dir + "/dataflow_parent.onnx"
-            child_model_fn = intermediate_models_dir + "/verify_%s.onnx" % step_name
-            model.save(child_model_fn)
-            parent_model = ModelWrapper(parent_model_fn)
-            out_tensor_name = parent_model.graph.output[0].name
-            exp_ishape = parent_model.get_tensor_shape(parent_model.graph.input[0].name)
-            if in_npy.shape != exp_ishape:
-                print(
-                    "Verification input has shape %s while model expects %s"
-                    % (str(in_npy.shape), str(exp_ishape))
-                )
-                print("Attempting to force model shape on verification input")
-                in_npy = in_npy.reshape(exp_ishape)
-            out_dict = execute_parent(parent_model_fn, child_model_fn, in_npy, return_full_ctx=True)
-            out_npy = out_dict[out_tensor_name]
-        else:
-            inp_tensor_name = model.graph.input[0].name
-            out_tensor_name = model.graph.output[0].name
-            exp_ishape = model.get_tensor_shape(inp_tensor_name)
-            if in_npy.shape != exp_ishape:
-                print(
-                    "Verification input has shape %s while model expects %s"
-                    % (str(in_npy.shape), str(exp_ishape))
-                )
-                print("Attempting to force model shape on verification input")
-                in_npy = in_npy.reshape(exp_ishape)
-            inp_dict = {inp_tensor_name: in_npy}
-            if rtlsim_pre_hook is not None:
-                out_dict = rtlsim_exec(model, inp_dict, pre_hook=rtlsim_pre_hook)
-            else:
-                out_dict = execute_onnx(model, inp_dict, True)
-            out_npy = out_dict[out_tensor_name]
-        exp_oshape = exp_out_npy.shape
-        if out_npy.shape != exp_oshape:
+        if in_npy.shape != exp_ishape:
             print(
-                "Verification output has shape %s while model produces %s"
-                % (str(exp_oshape), str(out_npy.shape))
+                "Verification input has shape %s while model expects %s"
+                % (str(in_npy.shape), str(exp_ishape))
             )
-            print("Attempting to force model shape on verification output")
-            out_npy = out_npy.reshape(exp_oshape)
-
-        res = np.isclose(exp_out_npy, out_npy, atol=1e-3).all()
-        all_res = all_res and res
-        res_to_str = {True: "SUCCESS", False: "FAIL"}
-        res_str = res_to_str[res]
-        if cfg.verify_save_full_context:
-            verification_output_fn = verify_out_dir + "/verify_%s_%d_%s.npz" % (
-                step_name,
-                b,
-                res_str,
+            print("Attempting to force model shape on verification input")
+            in_npy = in_npy.reshape(exp_ishape)
+        in_npys.append(in_npy)
+    # execute all samples at once, so that each simulation is only started
+    # once, unless each sample needs its own waveform
+    if cfg.verify_save_rtlsim_waveforms:
+        batches = [[b] for b in range(bsize_in)]
+    else:
+        batches = [list(range(bsize_in))]
+    all_res = True
+    res_to_str = {True: "SUCCESS", False: "FAIL"}
+    for batch in batches:
+        batch_in_npys = [in_npys[b] for b in batch]
+        if need_parent:
+            out_dicts = execute_parent_batch(
+                parent_model_fn, child_model_fn, batch_in_npys, return_full_ctx=True
             )
-            np.savez(verification_output_fn, **out_dict)
+        elif rtlsim_pre_hook is not None:
+            out_dicts = [{inp_tensor_name: np.concatenate(batch_in_npys)}]
+            rtlsim_exec(model, out_dicts[0], pre_hook=rtlsim_pre_hook)
+            out_npys = np.split(out_dicts[0][out_tensor_name], len(batch))
+            out_dicts = [{out_tensor_name: x} for x in out_npys]
         else:
-            verification_output_fn = verify_out_dir + "/verify_%s_%d_%s.npy" % (
-                step_name,
-                b,
-                res_str,
+            out_dicts = execute_onnx_batch(
+                model, [{inp_tensor_name: x} for x in batch_in_npys], True
             )
-            np.save(verification_output_fn, out_npy)
-        if cfg.verify_save_rtlsim_waveforms:
-            vcd_path = model.get_metadata_prop("rtlsim_trace")
-            if vcd_path is not None and os.path.isfile(vcd_path):
-                new_vcd_path = vcd_path.replace(".vcd", "_%d.vcd" % b)
-                shutil.move(vcd_path, new_vcd_path)
+        for b, out_dict in zip(batch, out_dicts):
+            out_npy = out_dict[out_tensor_name]
+            exp_out_npy = np.expand_dims(exp_out_npy_all[b], axis=0)
+            exp_oshape = exp_out_npy.shape
+            if out_npy.shape != exp_oshape:
+                print(
+                    "Verification output has shape %s while model produces %s"
+                    % (str(exp_oshape), str(out_npy.shape))
+                )
+                print("Attempting to force model shape on verification output")
+                out_npy = out_npy.reshape(exp_oshape)
+
+            res = np.isclose(exp_out_npy, out_npy, atol=1e-3).all()
+            all_res = all_res and res
+            res_str = res_to_str[res]
+            if cfg.verify_save_full_context:
+                verification_output_fn = verify_out_dir + "/verify_%s_%d_%s.npz" % (
+                    step_name,
+                    b,
+                    res_str,
+                )
+                np.savez(verification_output_fn, **out_dict)
+            else:
+                verification_output_fn = verify_out_dir + "/verify_%s_%d_%s.npy" % (
+                    step_name,
+                    b,
+                    res_str,
+                )
+                np.save(verification_output_fn, out_npy)
+            if cfg.verify_save_rtlsim_waveforms:
+                vcd_path = model.get_metadata_prop("rtlsim_trace")
+                if vcd_path is not None and os.path.isfile(vcd_path):
+                    new_vcd_path = vcd_path.replace(".vcd", "_%d.vcd" % b)
+                    shutil.move(vcd_path, new_vcd_path)
     print("Verification for %s : %s" % (step_name, res_to_str[all_res]))
 
 
@@ -428,6 +442,11 @@ def step_apply_folding_config(model: ModelWrapper, cfg: DataflowBuildConfig):
         model = model.transform(GiveUniqueNodeNames())
         model = model.transform(ApplyConfig(cfg.folding_config_file))
 
+    if VerificationStepType.FOLDED_HLS_PYTHON in cfg._resolve_verification_steps():
+        # no code generation needed for the python exec_mode
+        model = model.transform(SetExecMode("python"))
+        verify_step(model, cfg, "folded_hls_python", need_parent=True)
+
     if VerificationStepType.FOLDED_HLS_CPPSIM in cfg._resolve_verification_steps():
         # prepare cppsim
         model = model.transform(PrepareCppSim())
@@ -508,7 +527,11 @@ def step_set_fifo_depths(model: ModelWrapper, cfg: DataflowBuildConfig):
     Depending on the auto_fifo_depths setting, do one of the following:
     * if auto_fifo_depths=True:  Run the appropriate auto-sizing transformation
     to attempt to determine the FIFO sizes that provide full throughput.
-    May take a long time.
+    May take a long time, except for the `tokensim` strategy which only
+    simulates the dataflow graph at the level of stream transactions.
+    With incremental_fifo_sizing=True, only the FIFOs around the nodes that
+    changed since the previous build are re-sized, see
+    `DeriveFIFOSizesIncremental`.
     * if auto_fifo_depths=False:  Assume the folding config file contains FIFO
     sizes as well. Runs the `InsertFIFO` transformation, then
     `ApplyConfig(cfg.folding_config_file)`, and finally `RemoveShallowFIFOs`.
@@ -516,7 +539,47 @@ def step_set_fifo_depths(model: ModelWrapper, cfg: DataflowBuildConfig):
     `GiveUniqueNodeNames`.
     """
 
-    if cfg.auto_fifo_depths:
+    ref_hw_config = None
+    if cfg.auto_fifo_depths and cfg.incremental_fifo_sizing:
+        ref_hw_config_file = cfg.previous_hw_config_file
+        if ref_hw_config_file is None:
+            ref_hw_config_file = cfg.output_dir + "/final_hw_config.json"
+        if os.path.isfile(ref_hw_config_file):
+            with open(ref_hw_config_file, "r") as f:
+                ref_hw_config = json.load(f)
+            model = model.transform(InsertDWC())
+            model = model.transform(GiveUniqueNodeNames())
+            if get_changed_nodes(model, ref_hw_config) is None:
+                warnings.warn(
+                    "Nodes do not match %s, running full FIFO sizing" % ref_hw_config_file
+                )
+                ref_hw_config = None
+        else:
+            warnings.warn("%s not found, running full FIFO sizing" % ref_hw_config_file)
+
+    if ref_hw_config is not None:
+        model = model.transform(AnnotateCycles())
+        period = model.analysis(dataflow_performance)["max_cycles"] + 10
+        # HLS synthesis and rtlsim only run for the changed nodes and their
+        # neighbours, and only if they are not in the chrc cache
+        incremental = DeriveFIFOSizesIncremental(
+            ref_hw_config,
+            period,
+            fpgapart=cfg._resolve_fpga_part(),
+            clk=cfg._resolve_hls_clk_period(),
+        )
+        model = model.transform(incremental)
+        print("Incremental FIFO sizing for changed nodes: %s" % str(incremental.changed_nodes))
+        model = model.transform(
+            InsertFIFO(
+                vivado_ram_style=cfg.large_fifo_mem_style,
+                max_qsrl_depth=256,
+                create_shallow_fifos=True,
+            )
+        )
+        model = model.transform(GiveUniqueNodeNames())
+        model = model.transform(GiveReadableTensorNames())
+    elif cfg.auto_fifo_depths:
         if cfg.auto_fifo_strategy == "characterize":
             model = model.transform(InsertDWC())
             model = model.transform(GiveUniqueNodeNames())
@@ -538,21 +601,41 @@ def step_set_fifo_depths(model: ModelWrapper, cfg: DataflowBuildConfig):
             )
             model = model.transform(GiveUniqueNodeNames())
             model = model.transform(GiveReadableTensorNames())
-        elif cfg.auto_fifo_strategy == "largefifo_rtlsim":
-            # multi-in/out streams currently not supported in our C++ verilator driver
-            model_multi_io = len(model.graph.input) > 1 or len(model.graph.output) > 1
-            force_python_sim = model_multi_io or cfg.force_python_rtlsim
-            if model_multi_io:
-                warnings.warn(
-                    "Multi-in/out streams currently not supported "
-                    + "in FINN C++ verilator driver, falling back to Python"
+        elif cfg.auto_fifo_strategy == "tokensim":
+            model = model.transform(InsertDWC())
+            model = model.transform(GiveUniqueNodeNames())
+            tokensim = DeriveFIFOSizesTokenSim()
+            model = model.transform(tokensim)
+            tokensim_perf = {k: v for (k, v) in tokensim.sim_results.items() if k != "fifo_depths"}
+            n_clock_cycles_per_sec = (10**9) / cfg.synth_clk_period_ns
+            tokensim_perf["estimated_throughput_fps"] = (
+                n_clock_cycles_per_sec / tokensim_perf["interval_cycles"]
+            )
+            tokensim_perf["estimated_latency_ns"] = (
+                tokensim_perf["latency_cycles"] * cfg.synth_clk_period_ns
+            )
+            report_dir = cfg.output_dir + "/report"
+            os.makedirs(report_dir, exist_ok=True)
+            with open(report_dir + "/tokensim_performance.json", "w") as f:
+                json.dump(tokensim_perf, f, indent=2)
+            model = model.transform(
+                InsertFIFO(
+                    vivado_ram_style=cfg.large_fifo_mem_style,
+                    max_qsrl_depth=256,
+                    create_shallow_fifos=True,
                 )
+            )
+            model = model.transform(GiveUniqueNodeNames())
+            model = model.transform(GiveReadableTensorNames())
+        elif cfg.auto_fifo_strategy == "largefifo_rtlsim":
             model = model.transform(
                 InsertAndSetFIFODepths(
                     cfg._resolve_fpga_part(),
                     cfg._resolve_hls_clk_period(),
                     vivado_ram_style=cfg.large_fifo_mem_style,
-                    force_python_sim=force_python_sim,
+                    force_python_sim=cfg.force_python_rtlsim,
+                    input_traffic=cfg.fifosim_input_traffic,
+                    output_traffic=cfg.fifosim_output_traffic,
                 )
             )
             # InsertAndSetFIFODepths internally removes any shallow FIFOs
@@ -653,14 +736,7 @@ def step_measure_rtlsim_performance(model: ModelWrapper, cfg: DataflowBuildConfi
         # prepare ip-stitched rtlsim
         rtlsim_model = deepcopy(model)
         rtlsim_model = prepare_for_stitched_ip_rtlsim(rtlsim_model, cfg)
-        # multi-in/out streams currently not supported in our C++ verilator driver
-        model_multi_io = len(rtlsim_model.graph.input) > 1 or len(rtlsim_model.graph.output) > 1
-        force_python_rtlsim = cfg.force_python_rtlsim or model_multi_io
-        if model_multi_io:
-            warnings.warn(
-                "Multi-in/out streams currently not supported "
-                + "in FINN C++ verilator driver, falling back to Python"
-            )
+        force_python_rtlsim = cfg.force_python_rtlsim
         rtlsim_bs = int(cfg.rtlsim_batch_size)
         orig_rtlsim_trace_depth = get_rtlsim_trace_depth()
         if force_python_rtlsim:
@@ -679,7 +755,27 @@ def step_measure_rtlsim_performance(model: ModelWrapper, cfg: DataflowBuildConfi
             rtlsim_perf_dict = throughput_test_rtlsim(rtlsim_model, rtlsim_bs)
             rtlsim_perf_dict["latency_cycles"] = rtlsim_latency_dict["cycles"]
         else:
-            rtlsim_perf_dict = verilator_fifosim(model, rtlsim_bs)
+            fifosim_model = model
+            if cfg.rtlsim_monitor_fifos:
+                # re-stitch with depth monitoring on all RTL FIFOs
+                fifosim_model = deepcopy(model)
+                for fifo_layer in fifosim_model.get_nodes_by_op_type("StreamingFIFO"):
+                    inst = getCustomOp(fifo_layer)
+                    if inst.get_nodeattr("impl_style") == "rtl":
+                        inst.set_nodeattr("depth_monitor", 1)
+                fifosim_model = fifosim_model.transform(
+                    CreateStitchedIP(
+                        cfg._resolve_fpga_part(),
+                        cfg.synth_clk_period_ns,
+                        vitis=False,
+                    )
+                )
+            rtlsim_perf_dict = verilator_fifosim(
+                fifosim_model,
+                rtlsim_bs,
+                input_traffic=cfg.fifosim_input_traffic,
+                output_traffic=cfg.fifosim_output_traffic,
+            )
             # keep keys consistent between the Python and C++-styles
             cycles = rtlsim_perf_dict["cycles"]
             clk_ns = float(model.get_metadata_prop("clk_ns"))
@@ -688,9 +784,9 @@ def step_measure_rtlsim_performance(model: ModelWrapper, cfg: DataflowBuildConfi
             rtlsim_perf_dict["runtime[ms]"] = runtime_s * 1000
             rtlsim_perf_dict["throughput[images/s]"] = rtlsim_bs / runtime_s
             rtlsim_perf_dict["fclk[mhz]"] = fclk_mhz
-            for key, val in rtlsim_perf_dict.items():
-                if "max_count" in key:
-                    del rtlsim_perf_dict[key]
+            fifo_occupancy = get_fifo_occupancy(fifosim_model, rtlsim_perf_dict)
+            if len(fifo_occupancy) > 0:
+                rtlsim_perf_dict["fifo_occupancy"] = fifo_occupancy
         # estimate stable-state throughput based on latency+throughput
         if rtlsim_bs == 1:
             rtlsim_perf_dict["stable_throughput[images/s]"] = rtlsim_perf_dict[
@@ -29,7 +29,14 @@
 import copy
 import numpy as np
 import qonnx.analysis.topology as ta
+from qonnx.core.onnx_exec import execute_node
 from qonnx.core.onnx_exec import execute_onnx as execute_onnx_base
+from qonnx.custom_op.registry import getCustomOp
+from qonnx.util.basic import (
+    get_sanitize_quant_tensors,
+    is_finn_op,
+    sanitize_quant_values,
+)
 
 from finn.core.rtlsim_exec import rtlsim_exec
 
@@ -109,6 +116,86 @@ def execute_onnx(model, input_dict, return_full_exec_context=False, start_node=N
         return output_dict
 
 
+def execute_onnx_batch(model, input_dicts, return_full_exec_context=False):
+    """Executes given ONNX ModelWrapper on a batch of samples, given as a list
+    of input dicts with one entry per sample (each as for execute_onnx), and
+    returns the list of output dicts (or full execution contexts).
+    Nodes that provide execute_node_batch, such as HLS custom nodes in cppsim and
+    rtlsim, execute all samples at once, while all other nodes are executed
+    sample by sample. If the model exec_mode is set to "rtlsim", all samples are
+    streamed through a single stitched IP rtlsim."""
+
+    if not model.check_all_tensor_shapes_specified():
+        raise Exception("Found unspecified tensor shapes, try infer_shapes")
+    ret = model.analysis(ta.nodes_topologically_sorted)
+    assert (
+        ret["nodes_topologically_sorted"] is True
+    ), """Nodes must be
+    topologically sorted."""
+
+    graph = model.graph
+    # one execution context per sample, filled with the provided inputs
+    contexts = []
+    for input_dict in input_dicts:
+        execution_context = model.make_empty_exec_context()
+        for inp_name in input_dict.keys():
+            if inp_name in execution_context:
+                if execution_context[inp_name].shape == input_dict[inp_name].shape:
+                    execution_context[inp_name] = input_dict[inp_name]
+                else:
+                    raise Exception(
+                        "Shape mismatch for provided input %s: found %s expected %s "
+                        % (
+                            inp_name,
+                            str(execution_context[inp_name].shape),
+                            str(input_dict[inp_name].shape),
+                        )
+                    )
+        contexts.append(execution_context)
+
+    model_exec_mode = model.get_metadata_prop("exec_mode")
+    if (model_exec_mode is None) or (model_exec_mode == ""):
+        opset_version = model.model.opset_import[0].version
+        sanitize = get_sanitize_quant_tensors() != 0
+        for node in graph.node:
+            if sanitize:
+                # round input values to match quantization annotation
+                contexts = [sanitize_quant_values(model, node.input, x) for x in contexts]
+            inst = getCustomOp(node) if is_finn_op(node.domain) else None
+            if hasattr(inst, "execute_node_batch"):
+                inst.execute_node_batch(contexts, graph)
+            else:
+                for execution_context in contexts:
+                    execute_node(
+                        node, execution_context, graph, return_full_exec_context, opset_version
+                    )
+            if sanitize:
+                # round output values to quantization annotation
+                contexts = [sanitize_quant_values(model, node.output, x) for x in contexts]
+    elif model_exec_mode == "rtlsim":
+        # use stitched IP for rtlsim, with the samples concatenated along the
+        # batch dimension
+        batch_context = dict()
+        for inp in graph.input:
+            batch_context[inp.name] = np.concatenate([x[inp.name] for x in contexts])
+        rtlsim_exec(model, batch_context)
+        for out in graph.output:
+            outputs = np.split(batch_context[out.name], len(contexts))
+            for execution_context, output in zip(contexts, outputs):
+                execution_context[out.name] = output
+    else:
+        raise Exception(
+            """Metadata property "exec_mode" is set to an unknown value. Can be left
+            unset or has to be set to "rtlsim" for execution using pyverilator!"""
+        )
+
+    if return_full_exec_context:
+        return contexts
+    else:
+        # provide outputs as dicts
+        return [{x.name: ctx[x.name] for x in graph.output} for ctx in contexts]
+
+
 def execute_onnx_and_make_model(model, input_dict):
     """Executes given ONNX ModelWrapper with given named inputs and return a new
     ModelWrapper where an initializer is provided for each tensor as taken from
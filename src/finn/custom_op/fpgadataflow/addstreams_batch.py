@@ -33,6 +33,7 @@ from qonnx.core.datatype import DataType
 
 from finn.custom_op.fpgadataflow.hlscustomop import HLSCustomOp
 from finn.util.data_packing import npy_to_rtlsim_input, rtlsim_output_to_npy
+from finn.util.pyverilator import CyclicStream
 
 
 class AddStreams_Batch(HLSCustomOp):
@@ -161,15 +162,26 @@ class AddStreams_Batch(HLSCustomOp):
         # Channels/PE * batch size * fmdim * fmdim
         return np.prod(self.get_folded_output_shape()[:-1])
 
+    def execute_node_python(self, context, graph):
+        node = self.onnx_node
+        exp_ishape = self.get_normal_input_shape()
+        inp0 = context[node.input[0]].reshape(exp_ishape)
+        inp1 = context[node.input[1]].reshape(exp_ishape)
+        out = inp0 + inp1
+        context[node.output[0]] = out.reshape(self.get_normal_output_shape()).astype(np.float32)
+
     def execute_node(self, context, graph):
         mode = self.get_nodeattr("exec_mode")
+        if mode == "python":
+            self.execute_node_python(context, graph)
+            return
         node = self.onnx_node
         exp_ishape = self.get_normal_input_shape()
         exp_oshape = self.get_normal_output_shape()
         folded_ishape = self.get_folded_input_shape()
 
         if mode == "cppsim":
-            code_gen_dir = self.get_nodeattr("code_gen_dir_cppsim")
+            code_gen_dir = self.get_cppsim_io_dir()
         elif mode == "rtlsim":
             code_gen_dir = self.get_nodeattr("code_gen_dir_ipgen")
         else:
@@ -384,8 +396,8 @@ class AddStreams_Batch(HLSCustomOp):
         n_inps = np.prod(self.get_folded_input_shape()[:-1])
         io_dict = {
             "inputs": {
-                "in0": [0 for i in range(n_inps)],
-                "in1": [0 for i in range(n_inps)],
+                "in0": CyclicStream([0], n_inps),
+                "in1": CyclicStream([0], n_inps),
             },
             "outputs": {"out": []},
         }
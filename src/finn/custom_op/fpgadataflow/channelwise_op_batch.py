@@ -35,8 +35,8 @@ from qonnx.core.datatype import DataType
 from finn.custom_op.fpgadataflow.hlscustomop import HLSCustomOp
 from finn.util.data_packing import (
     npy_to_rtlsim_input,
-    numpy_to_hls_code,
     rtlsim_output_to_npy,
+    write_numpy_to_hls_code,
 )
 
 # ONNX i/o tensor shape assumptions for channelwise ops:
@@ -320,7 +320,6 @@ class ChannelwiseOp_Batch(HLSCustomOp):
         parameter_tensor = self.get_hls_compatible_parameter_tensor(parameters)
         pdt = DataType[self.get_nodeattr("paramDataType")]
 
-        parameters_hls_code = numpy_to_hls_code(parameter_tensor, pdt, "parameters", False, True)
         # get input data type
         export_idt = self.get_input_datatype()
         if self.get_input_datatype() == DataType["BIPOLAR"]:
@@ -364,16 +363,40 @@ class ChannelwiseOp_Batch(HLSCustomOp):
                 func_str,
             )
         )
-        f_params.write(parameters_hls_code)
+        write_numpy_to_hls_code(f_params, parameter_tensor, pdt, "parameters", False, True)
         f_params.close()
 
+    def execute_node_python(self, context, graph):
+        node = self.onnx_node
+        inp = context[node.input[0]].reshape(self.get_normal_input_shape())
+        params = context[node.input[1]]
+        # the hlslib operation is applied as func(parameter, input)
+        func = self.get_nodeattr("Func")
+        if func == "cmp_le":
+            out = params <= inp
+        elif func == "cmp_ge":
+            out = params >= inp
+        elif func == "add":
+            out = params + inp
+        elif func == "mul":
+            out = params * inp
+        else:
+            raise Exception("%s is not a supported Func for ChannelwiseOp_Batch" % func)
+        out = out.astype(np.float32)
+        if self.get_output_datatype() == DataType["BIPOLAR"]:
+            out = 2 * out - 1
+        context[node.output[0]] = out.reshape(self.get_normal_output_shape())
+
     def execute_node(self, context, graph):
         mode = self.get_nodeattr("exec_mode")
+        if mode == "python":
+            self.execute_node_python(context, graph)
+            return
         node = self.onnx_node
 
         # TODO ensure codegen dir exists
         if mode == "cppsim":
-            code_gen_dir = self.get_nodeattr("code_gen_dir_cppsim")
+            code_gen_dir = self.get_cppsim_io_dir()
         elif mode == "rtlsim":
             code_gen_dir = self.get_nodeattr("code_gen_dir_ipgen")
         else:
@@ -138,7 +138,7 @@ class CheckSum(HLSCustomOp):
     def npy_to_dynamic_output(self, context):
         super().npy_to_dynamic_output(context)
         node = self.onnx_node
-        code_gen_dir = self.get_nodeattr("code_gen_dir_cppsim")
+        code_gen_dir = self.get_cppsim_io_dir()
         output_checksum = np.load("{}/output_checksum.npy".format(code_gen_dir))
         context[node.output[1]] = output_checksum
 
@@ -149,7 +149,7 @@ class CheckSum(HLSCustomOp):
 
         # TODO ensure codegen dir exists
         if mode == "cppsim":
-            code_gen_dir = self.get_nodeattr("code_gen_dir_cppsim")
+            code_gen_dir = self.get_cppsim_io_dir()
         elif mode == "rtlsim":
             code_gen_dir = self.get_nodeattr("code_gen_dir_ipgen")
         else:
@@ -168,8 +168,19 @@ class StreamingConcat(HLSCustomOp):
         f_impl.write(impl_hls_code)
         f_impl.close()
 
+    def execute_node_python(self, context, graph):
+        node = self.onnx_node
+        inps = []
+        for i, inp in enumerate(node.input):
+            inps.append(context[inp].reshape(self.get_normal_input_shape(i)))
+        out = np.concatenate(inps, axis=-1)
+        context[node.output[0]] = out.reshape(self.get_normal_output_shape()).astype(np.float32)
+
     def execute_node(self, context, graph):
         mode = self.get_nodeattr("exec_mode")
+        if mode == "python":
+            self.execute_node_python(context, graph)
+            return
         node = self.onnx_node
         n_inps = len(self.onnx_node.input)
         ishapes = [self.get_normal_input_shape(x) for x in range(n_inps)]
@@ -179,7 +190,7 @@ class StreamingConcat(HLSCustomOp):
         export_idt = self.get_input_datatype()
 
         if mode == "cppsim":
-            code_gen_dir = self.get_nodeattr("code_gen_dir_cppsim")
+            code_gen_dir = self.get_cppsim_io_dir()
         elif mode == "rtlsim":
             code_gen_dir = self.get_nodeattr("code_gen_dir_ipgen")
         else:
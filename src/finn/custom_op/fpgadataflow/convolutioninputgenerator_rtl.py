@@ -37,6 +37,7 @@ from qonnx.custom_op.general.im2col import compute_conv_output_dim
 from finn.custom_op.fpgadataflow.hlscustomop import HLSCustomOp
 from finn.util.basic import get_rtlsim_trace_depth, make_build_dir
 from finn.util.data_packing import npy_to_rtlsim_input, rtlsim_output_to_npy
+from finn.util.fpgadataflow import sliding_window_nhwc
 
 try:
     from pyverilator import PyVerilator
@@ -416,8 +417,27 @@ class ConvolutionInputGenerator_rtl(HLSCustomOp):
         else:
             return 0
 
+    def execute_node_python(self, context, graph):
+        node = self.onnx_node
+        inp = context[node.input[0]].reshape(self.get_normal_input_shape())
+        if self.get_nodeattr("depthwise") == 1:
+            depthwise_simd = self.get_nodeattr("SIMD")
+        else:
+            depthwise_simd = 0
+        out = sliding_window_nhwc(
+            inp,
+            self.get_nodeattr("ConvKernelDim"),
+            self.get_nodeattr("Stride"),
+            self.get_nodeattr("Dilation"),
+            depthwise_simd,
+        )
+        context[node.output[0]] = out.reshape(self.get_normal_output_shape()).astype(np.float32)
+
     def execute_node(self, context, graph):
         mode = self.get_nodeattr("exec_mode")
+        if mode == "python":
+            self.execute_node_python(context, graph)
+            return
         node = self.onnx_node
         exp_ishape = self.get_normal_input_shape()
         exp_oshape = self.get_normal_output_shape()
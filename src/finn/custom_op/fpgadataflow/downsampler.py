@@ -298,15 +298,30 @@ class DownSampler(HLSCustomOp):
         )
         self.code_gen_dict["$PRAGMAS$"].append("#pragma HLS INTERFACE ap_ctrl_none port=return")
 
+    def execute_node_python(self, context, graph):
+        node = self.onnx_node
+        inp = context[node.input[0]].reshape(self.get_normal_input_shape())
+        stride = self.get_nodeattr("Stride")
+        if self.get_nodeattr("is1D") == 0:
+            out = inp[:, ::stride, ::stride]
+        elif self.get_nodeattr("is1D_unitx") == 1:
+            out = inp[:, ::stride]
+        else:
+            out = inp[:, :, ::stride]
+        context[node.output[0]] = out.reshape(self.get_normal_output_shape()).astype(np.float32)
+
     def execute_node(self, context, graph):
         mode = self.get_nodeattr("exec_mode")
+        if mode == "python":
+            self.execute_node_python(context, graph)
+            return
         node = self.onnx_node
         exp_ishape = self.get_normal_input_shape()
         exp_oshape = self.get_normal_output_shape()
         folded_ishape = self.get_folded_input_shape()
 
         if mode == "cppsim":
-            code_gen_dir = self.get_nodeattr("code_gen_dir_cppsim")
+            code_gen_dir = self.get_cppsim_io_dir()
         elif mode == "rtlsim":
             code_gen_dir = self.get_nodeattr("code_gen_dir_ipgen")
         else:
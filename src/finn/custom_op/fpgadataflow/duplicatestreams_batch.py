@@ -33,6 +33,7 @@ from qonnx.core.datatype import DataType
 
 from finn.custom_op.fpgadataflow.hlscustomop import HLSCustomOp
 from finn.util.data_packing import npy_to_rtlsim_input, rtlsim_output_to_npy
+from finn.util.pyverilator import CyclicStream
 
 
 class DuplicateStreams_Batch(HLSCustomOp):
@@ -197,8 +198,18 @@ class DuplicateStreams_Batch(HLSCustomOp):
         f_impl.write(impl_hls_code)
         f_impl.close()
 
+    def execute_node_python(self, context, graph):
+        node = self.onnx_node
+        inp = context[node.input[0]]
+        exp_oshape = self.get_normal_output_shape()
+        for outp in node.output:
+            context[outp] = np.array(inp, dtype=np.float32).reshape(exp_oshape)
+
     def execute_node(self, context, graph):
         mode = self.get_nodeattr("exec_mode")
+        if mode == "python":
+            self.execute_node_python(context, graph)
+            return
         node = self.onnx_node
         exp_ishape = self.get_normal_input_shape()
         exp_oshape = self.get_normal_output_shape()
@@ -206,7 +217,7 @@ class DuplicateStreams_Batch(HLSCustomOp):
         n_outputs = self.get_num_output_streams()
 
         if mode == "cppsim":
-            code_gen_dir = self.get_nodeattr("code_gen_dir_cppsim")
+            code_gen_dir = self.get_cppsim_io_dir()
         elif mode == "rtlsim":
             code_gen_dir = self.get_nodeattr("code_gen_dir_ipgen")
         else:
@@ -422,7 +433,7 @@ class DuplicateStreams_Batch(HLSCustomOp):
         n_inps = np.prod(self.get_folded_input_shape()[:-1])
         io_dict = {
             "inputs": {
-                "in0": [0 for i in range(n_inps)],
+                "in0": CyclicStream([0], n_inps),
             },
             "outputs": {"out0": [], "out1": []},
         }
@@ -211,15 +211,34 @@ class StreamingEltwise(HLSCustomOp):
         # Channels/PE * batch size * fmdim * fmdim
         return np.prod(self.get_folded_output_shape()[:-1])
 
+    def execute_node_python(self, context, graph):
+        node = self.onnx_node
+        exp_ishape = self.get_normal_input_shape()
+        inp0 = context[node.input[0]].reshape(exp_ishape)
+        inp1 = context[node.input[1]].reshape(exp_ishape)
+        eltwiseOp = self.get_nodeattr("eltwiseOp")
+        if eltwiseOp == "Add":
+            out = inp0 + inp1
+        elif eltwiseOp == "Sub":
+            out = inp0 - inp1
+        elif eltwiseOp == "AbsDiff":
+            out = np.abs(inp0 - inp1)
+        else:
+            raise Exception("%s is not a supported eltwiseOp" % eltwiseOp)
+        context[node.output[0]] = out.reshape(self.get_normal_output_shape()).astype(np.float32)
+
     def execute_node(self, context, graph):
         mode = self.get_nodeattr("exec_mode")
+        if mode == "python":
+            self.execute_node_python(context, graph)
+            return
         node = self.onnx_node
         exp_ishape = self.get_normal_input_shape()
         exp_oshape = self.get_normal_output_shape()
         folded_ishape = self.get_folded_input_shape()
 
         if mode == "cppsim":
-            code_gen_dir = self.get_nodeattr("code_gen_dir_cppsim")
+            code_gen_dir = self.get_cppsim_io_dir()
         elif mode == "rtlsim":
             code_gen_dir = self.get_nodeattr("code_gen_dir_ipgen")
         else:
@@ -184,8 +184,18 @@ class FMPadding_rtl(HLSCustomOp):
             intf_names["axilite"] = ["s_axilite"]
         return intf_names
 
+    def execute_node_python(self, context, graph):
+        node = self.onnx_node
+        inp = context[node.input[0]].reshape(self.get_normal_input_shape())
+        (pad_h_begin, pad_w_begin, pad_h_end, pad_w_end) = self.get_nodeattr("Padding")
+        out = np.pad(inp, ((0, 0), (pad_h_begin, pad_h_end), (pad_w_begin, pad_w_end), (0, 0)))
+        context[node.output[0]] = out.reshape(self.get_normal_output_shape()).astype(np.float32)
+
     def execute_node(self, context, graph):
         mode = self.get_nodeattr("exec_mode")
+        if mode == "python":
+            self.execute_node_python(context, graph)
+            return
         node = self.onnx_node
         exp_ishape = self.get_normal_input_shape()
         exp_oshape = self.get_normal_output_shape()
@@ -31,10 +31,11 @@ import os
 import subprocess
 import warnings
 from abc import abstractmethod
+from onnx import AttributeProto, numpy_helper
 from pyverilator.util.axi_utils import _read_signal, reset_rtlsim, rtlsim_multi_io
 from qonnx.core.datatype import DataType
 from qonnx.custom_op.base import CustomOp
-from qonnx.util.basic import roundup_to_integer_multiple
+from qonnx.util.basic import get_by_name, roundup_to_integer_multiple
 
 from finn.util.basic import (
     CppBuilder,
@@ -42,8 +43,26 @@ from finn.util.basic import (
     make_build_dir,
     pyverilate_get_liveness_threshold_cycles,
 )
+from finn.util.chrc_cache import (
+    CHRC_CACHE_STORED_ATTRS,
+    chrc_cache_key,
+    get_cached_chrc,
+    store_chrc,
+)
+from finn.util.cppsim import (
+    cppsim_supports_workers,
+    cppsim_use_workers,
+    get_cppsim_worker,
+    redirect_npy_paths,
+)
+from finn.util.fpgadataflow import encode_chrc, legacy_chrc_to_txns
 from finn.util.hls import CallHLS
-from finn.util.pyverilator import make_single_source_file
+from finn.util.pyverilator import (
+    CyclicStream,
+    as_rtlsim_stream,
+    concat_rtlsim_streams,
+    make_single_source_file,
+)
 
 from . import templates
 
@@ -53,6 +72,20 @@ except ModuleNotFoundError:
     PyVerilator = None
 
 
+class _RtlsimInputsRecorded(Exception):
+    """Stops execute_node once the rtlsim input streams of a sample have been
+    recorded by execute_node_batch."""
+
+    pass
+
+
+class _CppsimInputsWritten(Exception):
+    """Stops execute_node once the cppsim input .npy files of a sample have
+    been written by execute_node_batch."""
+
+    pass
+
+
 class HLSCustomOp(CustomOp):
     """HLSCustomOp class all custom ops that correspond to a finn-hlslib
     function are based on. Contains different functions every fpgadataflow
@@ -64,6 +97,9 @@ class HLSCustomOp(CustomOp):
 
         self.code_gen_dict = {}
 
+        # state of an ongoing execute_node_batch, None otherwise
+        self.exec_batch = None
+
         # getting templates from templates.py
 
         # template for single node execution
@@ -84,8 +120,12 @@ class HLSCustomOp(CustomOp):
             "ipgen_path": ("s", False, ""),
             "ip_path": ("s", False, ""),
             "ip_vlnv": ("s", False, ""),
-            "exec_mode": ("s", False, "", {"", "rtlsim", "cppsim"}),
+            # cppsim or rtlsim of the generated code, or a NumPy model (python)
+            "exec_mode": ("s", False, "", {"", "rtlsim", "cppsim", "python"}),
+            # cycles for one sample in rtlsim, and for all samples of the last
+            # rtlsim run if several were streamed through (see execute_node_batch)
             "cycles_rtlsim": ("i", False, 0),
+            "cycles_rtlsim_batch": ("i", False, 0),
             "cycles_estimate": ("i", False, 0),
             "rtlsim_trace": ("s", False, ""),
             "res_estimate": ("s", False, ""),
@@ -113,9 +153,10 @@ class HLSCustomOp(CustomOp):
             "inFIFODepths": ("ints", False, [2]),
             "outFIFODepths": ("ints", False, [2]),
             "output_hook": ("s", False, ""),
-            # accumulated characteristic function over two periods
-            "io_chrc_in": ("t", False, np.asarray([], dtype=np.int32)),
-            "io_chrc_out": ("t", False, np.asarray([], dtype=np.int32)),
+            # run-length encoded transactions per cycle over one period for
+            # each input/output stream, see finn.util.fpgadataflow.encode_chrc
+            "io_chrc_in": ("ints", False, []),
+            "io_chrc_out": ("ints", False, []),
             # the period for which the characterization was run
             "io_chrc_period": ("i", False, 0),
             # amount of zero padding inserted during chrc.
@@ -123,6 +164,34 @@ class HLSCustomOp(CustomOp):
             "io_chrc_pads_out": ("ints", False, []),
         }
 
+    def _get_legacy_chrc_attr(self, name):
+        """Return the io_chrc_in or io_chrc_out attribute if it still holds
+        the dense tensor form written by older FINN versions, None otherwise."""
+        if name not in ("io_chrc_in", "io_chrc_out"):
+            return None
+        attr = get_by_name(self.onnx_node.attribute, name)
+        if attr is None or attr.type != AttributeProto.TENSOR:
+            return None
+        return attr
+
+    def get_nodeattr(self, name):
+        legacy_attr = self._get_legacy_chrc_attr(name)
+        if legacy_attr is not None:
+            # convert characteristic functions from older checkpoints into
+            # the run-length encoded form
+            chrc = numpy_helper.to_array(legacy_attr.t)
+            if chrc.size == 0:
+                return []
+            period = self.get_nodeattr("io_chrc_period")
+            return encode_chrc(legacy_chrc_to_txns(chrc, period))
+        return super().get_nodeattr(name)
+
+    def set_nodeattr(self, name, value):
+        legacy_attr = self._get_legacy_chrc_attr(name)
+        if legacy_attr is not None:
+            self.onnx_node.attribute.remove(legacy_attr)
+        super().set_nodeattr(name, value)
+
     def get_verilog_top_module_name(self):
         "Return the Verilog top module name for this node."
 
@@ -217,10 +286,15 @@ class HLSCustomOp(CustomOp):
         """Return a PyVerilator wrapper for the Verilator emulation library
         for this node."""
 
+        if self.exec_batch is not None and "sim" in self.exec_batch:
+            # reuse the wrapper for all samples of the batch
+            return self.exec_batch["sim"]
         rtlsim_so = self.get_nodeattr("rtlsim_so")
         assert os.path.isfile(rtlsim_so), "Cannot find rtlsim library."
         # create PyVerilator wrapper
         sim = PyVerilator(rtlsim_so)
+        if self.exec_batch is not None:
+            self.exec_batch["sim"] = sim
         return sim
 
     def node_res_estimation(self):
@@ -383,6 +457,8 @@ class HLSCustomOp(CustomOp):
             code_gen_line = "\n".join(self.code_gen_dict[key])
             template = template.replace(key, code_gen_line)
         code_gen_dir = self.get_nodeattr("code_gen_dir_cppsim")
+        # allow cppsim workers to exchange the .npy files in their I/O dir
+        template = redirect_npy_paths(template, code_gen_dir)
         f = open(os.path.join(code_gen_dir, "execute_{}.cpp".format(node.op_type)), "w")
         f.write(template)
         f.close()
@@ -415,13 +491,37 @@ class HLSCustomOp(CustomOp):
         builder.build(code_gen_dir)
         self.set_nodeattr("executable_path", builder.executable_path)
 
+    def use_cppsim_worker(self):
+        """Returns whether cppsim is executed by a worker process (see
+        finn.util.cppsim): inside execute_node_batch, or if cppsim workers are
+        enabled and the executable was generated with worker support."""
+        if self.exec_batch is not None and self.exec_batch["phase"].startswith("cppsim"):
+            return True
+        if not cppsim_use_workers() or self.get_nodeattr("executable_path") == "":
+            return False
+        return cppsim_supports_workers(self.get_nodeattr("code_gen_dir_cppsim"))
+
+    def get_cppsim_io_dir(self):
+        """Returns the directory the cppsim executable reads its input and
+        writes its output .npy files from/to. This is the I/O directory of the
+        current sample in the worker process if cppsim is executed by a worker
+        (see use_cppsim_worker), and code_gen_dir_cppsim otherwise."""
+        if self.use_cppsim_worker():
+            worker = get_cppsim_worker(self.get_nodeattr("executable_path"))
+            sample = 0 if self.exec_batch is None else self.exec_batch.get("sample", 0)
+            return worker.get_sample_io_dir(sample)
+        return self.get_nodeattr("code_gen_dir_cppsim")
+
     def dynamic_input_to_npy(self, context, count, target_dir=""):
         """Saves input (given context) into .npy files.
 
         Count indicates the number of inputs that have to be saved."""
+        if self.exec_batch is not None and self.exec_batch["phase"] == "cppsim_read":
+            # already saved before the batch was executed
+            return
         node = self.onnx_node
         if target_dir == "":
-            code_gen_dir = self.get_nodeattr("code_gen_dir_cppsim")
+            code_gen_dir = self.get_cppsim_io_dir()
             if code_gen_dir == "":
                 raise Exception(
                     """
@@ -455,7 +555,7 @@ class HLSCustomOp(CustomOp):
         """Reads the output from an output.npy file generated from cppsim and
         places its content into the context dictionary."""
         node = self.onnx_node
-        code_gen_dir = self.get_nodeattr("code_gen_dir_cppsim")
+        code_gen_dir = self.get_cppsim_io_dir()
         output = np.load("{}/output.npy".format(code_gen_dir))
         exp_shape = self.get_normal_output_shape()
         context[node.output[0]] = output.reshape(exp_shape)
@@ -466,7 +566,7 @@ class HLSCustomOp(CustomOp):
         npy_list is a list specifying which files to read, and its order must
         match the order of node outputs."""
         node = self.onnx_node
-        code_gen_dir = self.get_nodeattr("code_gen_dir_cppsim")
+        code_gen_dir = self.get_cppsim_io_dir()
         for i in range(len(npy_list)):
             output = np.load("{}/{}".format(code_gen_dir, npy_list[i]))
             if i == 0:
@@ -476,7 +576,8 @@ class HLSCustomOp(CustomOp):
             context[node.output[i]] = output.reshape(exp_shape)
 
     def exec_precompiled_singlenode_model(self):
-        """Executes precompiled executable."""
+        """Executes precompiled executable, or lets its worker process execute
+        it if cppsim workers are enabled."""
         executable_path = self.get_nodeattr("executable_path")
         if executable_path == "":
             raise Exception(
@@ -485,6 +586,15 @@ Found no executable for this node, did you run the codegen and
 compilation transformations?
             """
             )
+        if self.exec_batch is not None and self.exec_batch["phase"] == "cppsim_write":
+            # all samples of the batch are executed at once afterwards
+            raise _CppsimInputsWritten()
+        if self.exec_batch is not None and self.exec_batch["phase"] == "cppsim_read":
+            # outputs of the batch are already in the sample I/O dirs
+            return
+        if self.use_cppsim_worker():
+            get_cppsim_worker(executable_path).run()
+            return
         process_execute = subprocess.Popen(executable_path, stdout=subprocess.PIPE)
         process_execute.communicate()
 
@@ -513,6 +623,14 @@ compilation transformations?
         observation loop that can abort the simulation if no output value is produced
         after 100 cycles."""
 
+        inp = as_rtlsim_stream(inp)
+        if inp2 is not None:
+            inp2 = as_rtlsim_stream(inp2)
+        if self.exec_batch is not None and self.exec_batch["phase"] == "record":
+            self.exec_batch["inputs"].append((inp, inp2))
+            raise _RtlsimInputsRecorded()
+        if self.exec_batch is not None and self.exec_batch["phase"] == "replay":
+            return self.exec_batch["outputs"].pop(0)
         trace_file = self.get_nodeattr("rtlsim_trace")
         if trace_file != "":
             if trace_file == "default":
@@ -535,9 +653,12 @@ compilation transformations?
 
         # observe if output is completely calculated
         # observation_count will contain the number of cycles the calculation ran
-        num_out_values = self.get_number_output_values()
+        # and sample_count the number of cycles until the first sample is complete
+        sample_out_values = self.get_number_output_values()
+        num_out_values = sample_out_values * self.get_rtlsim_batch_size()
         output_observed = False
         observation_count = 0
+        sample_count = None
 
         # avoid infinite looping of simulation by aborting when there is no change in
         # output values after 100 cycles
@@ -565,8 +686,10 @@ compilation transformations?
             observation_count = observation_count + 1
             no_change_count = no_change_count + 1
 
+            if sample_count is None and len(outputs) >= sample_out_values:
+                sample_count = observation_count
             if len(outputs) == num_out_values:
-                self.set_nodeattr("cycles_rtlsim", observation_count)
+                self.set_rtlsim_cycles(sample_count, observation_count)
                 output_observed = True
 
             if no_change_count == liveness_threshold:
@@ -590,13 +713,38 @@ compilation transformations?
     def rtlsim_multi_io(self, sim, io_dict):
         "Run rtlsim for this node, supports multiple i/o streams."
 
+        for k, v in io_dict["inputs"].items():
+            io_dict["inputs"][k] = as_rtlsim_stream(v)
+        if self.exec_batch is not None and self.exec_batch["phase"] == "record":
+            # lazy weight streams stay lazy, everything else is copied since
+            # rtlsim_multi_io consumes the streams of the io_dict
+            inputs = {
+                k: v if isinstance(v, CyclicStream) else list(v)
+                for (k, v) in io_dict["inputs"].items()
+            }
+            self.exec_batch["inputs"].append((inputs, list(io_dict["outputs"])))
+            raise _RtlsimInputsRecorded()
+        if self.exec_batch is not None and self.exec_batch["phase"] == "replay":
+            io_dict["outputs"].update(self.exec_batch["outputs"].pop(0))
+            return
         # signal name
         sname = "_" + self.hls_sname() + "_"
 
         trace_file = self.get_nodeattr("rtlsim_trace")
         if trace_file == "default":
             trace_file = self.onnx_node.name + ".vcd"
-        num_out_values = self.get_number_output_values()
+        sample_out_values = self.get_number_output_values()
+        num_out_values = sample_out_values * self.get_rtlsim_batch_size()
+        # count the cycles until the outputs of the first sample are complete,
+        # the hook runs before each cycle
+        monitor = {"cycles": 0, "sample_cycles": None}
+
+        def monitor_first_sample(sim):
+            n_outputs = sum([len(x) for x in io_dict["outputs"].values()])
+            if monitor["sample_cycles"] is None and n_outputs >= sample_out_values:
+                monitor["sample_cycles"] = monitor["cycles"]
+            monitor["cycles"] += 1
+
         total_cycle_count = rtlsim_multi_io(
             sim,
             io_dict,
@@ -604,13 +752,27 @@ compilation transformations?
             trace_file=trace_file,
             sname=sname,
             liveness_threshold=pyverilate_get_liveness_threshold_cycles(),
+            hook_preclk=monitor_first_sample,
         )
-        self.set_nodeattr("cycles_rtlsim", total_cycle_count)
+        self.set_rtlsim_cycles(monitor["sample_cycles"], total_cycle_count)
+
+    def set_rtlsim_cycles(self, sample_cycles, total_cycles):
+        """Set the cycles_rtlsim attribute to the cycles until the outputs of the
+        first sample were complete, which equals those of a single-sample
+        rtlsim since the first sample is streamed in right after reset, and
+        cycles_rtlsim_batch to the cycles for all samples of the rtlsim."""
+        if sample_cycles is None:
+            # all outputs came in the last cycle
+            sample_cycles = total_cycles
+        self.set_nodeattr("cycles_rtlsim", sample_cycles)
+        self.set_nodeattr("cycles_rtlsim_batch", total_cycles)
 
     def execute_node(self, context, graph):
-        """Executes single node using cppsim or rtlsim."""
+        """Executes single node using cppsim, rtlsim or python."""
         mode = self.get_nodeattr("exec_mode")
-        if mode == "cppsim":
+        if mode == "python":
+            self.execute_node_python(context, graph)
+        elif mode == "cppsim":
             # save input(s)
             self.dynamic_input_to_npy(context, 1)
             # execute the precompiled model
@@ -628,6 +790,115 @@ compilation transformations?
                 )
             )
 
+    def get_rtlsim_batch_size(self):
+        """Returns the number of samples streamed through the ongoing rtlsim,
+        which is larger than one inside execute_node_batch."""
+        if self.exec_batch is not None and self.exec_batch["phase"] == "simulate":
+            return self.exec_batch["n"]
+        return 1
+
+    def execute_node_batch(self, contexts, graph):
+        """Executes the node on a batch of samples, given as a list of execution
+        contexts (one per sample). In cppsim, execute_node is first run on each
+        sample to write its input .npy files, then all samples are executed in
+        one run of the worker process (see finn.util.cppsim), and finally
+        execute_node is run again on each sample to read its outputs. In rtlsim, execute_node is
+        first run on each sample to record its input streams, then all samples
+        are streamed back-to-back through a single simulation after one reset,
+        and finally execute_node is run again on each sample with the rtlsim
+        calls returning the outputs of that sample. cycles_rtlsim then still
+        holds the cycle count of a single sample (that of the first one), the
+        count for the whole batch is stored in cycles_rtlsim_batch."""
+        mode = self.get_nodeattr("exec_mode")
+        if len(contexts) == 1 or mode not in ["cppsim", "rtlsim"]:
+            for context in contexts:
+                self.execute_node(context, graph)
+            return
+        if mode == "cppsim":
+            executable_path = self.get_nodeattr("executable_path")
+            code_gen_dir = self.get_nodeattr("code_gen_dir_cppsim")
+            if executable_path == "" or not cppsim_supports_workers(code_gen_dir):
+                # executable cannot be run as a worker, one run per sample
+                for context in contexts:
+                    self.execute_node(context, graph)
+                return
+            self.exec_batch = {"phase": "cppsim_write", "sample": 0}
+            try:
+                # write the inputs of all samples, execute them in one worker
+                # run, then read back the outputs of each sample
+                for i, context in enumerate(contexts):
+                    self.exec_batch["sample"] = i
+                    try:
+                        self.execute_node(context, graph)
+                    except _CppsimInputsWritten:
+                        pass
+                get_cppsim_worker(executable_path).run(len(contexts))
+                self.exec_batch["phase"] = "cppsim_read"
+                for i, context in enumerate(contexts):
+                    self.exec_batch["sample"] = i
+                    self.execute_node(context, graph)
+            finally:
+                self.exec_batch = None
+            return
+        n = len(contexts)
+        self.exec_batch = {"phase": "record", "inputs": []}
+        try:
+            for context in contexts:
+                try:
+                    self.execute_node(context, graph)
+                except _RtlsimInputsRecorded:
+                    pass
+            recorded = self.exec_batch["inputs"]
+            if len(recorded) == 0:
+                # executed without simulation
+                return
+            assert len(recorded) == n, "Not all samples went through rtlsim"
+            sim = self.get_rtlsim()
+            self.exec_batch["phase"] = "simulate"
+            self.exec_batch["n"] = n
+            self.reset_rtlsim(sim)
+            self.toggle_clk(sim)
+            if isinstance(recorded[0][0], dict):
+                io_dict = {
+                    "inputs": {
+                        k: concat_rtlsim_streams([x[0][k] for x in recorded])
+                        for k in recorded[0][0]
+                    },
+                    "outputs": {k: [] for k in recorded[0][1]},
+                }
+                self.rtlsim_multi_io(sim, io_dict)
+                sample_outputs = [dict() for i in range(n)]
+                for k, v in io_dict["outputs"].items():
+                    n_per_sample = len(v) // n
+                    for i in range(n):
+                        sample_outputs[i][k] = v[i * n_per_sample : (i + 1) * n_per_sample]
+            else:
+                inp = concat_rtlsim_streams([x[0] for x in recorded])
+                inp2 = None
+                if recorded[0][1] is not None:
+                    inp2 = concat_rtlsim_streams([x[1] for x in recorded])
+                output = self.rtlsim(sim, inp, inp2)
+                n_per_sample = len(output) // n
+                sample_outputs = [
+                    output[i * n_per_sample : (i + 1) * n_per_sample] for i in range(n)
+                ]
+            self.exec_batch["phase"] = "replay"
+            self.exec_batch["outputs"] = sample_outputs
+            for context in contexts:
+                self.execute_node(context, graph)
+        finally:
+            self.exec_batch = None
+
+    def execute_node_python(self, context, graph):
+        """Executes single node using a vectorized NumPy model of the HLS
+        implementation that produces the same outputs as cppsim, without any
+        code generation or compilation. Used for exec_mode python, has to be
+        filled by every node that supports it."""
+        raise Exception(
+            "exec_mode python is not supported for %s (%s)"
+            % (self.onnx_node.name, self.onnx_node.op_type)
+        )
+
     def generate_params(self, model, path):
         """Function to generate parameters (i.e. weights and thresholds),
         is member function of HLSCustomOp class but has to be filled
@@ -759,12 +1030,20 @@ compilation transformations?
         return ret
 
     def derive_characteristic_fxns(self, period, override_rtlsim_dict=None):
-        """Return the unconstrained characteristic functions for this node."""
-        # ensure rtlsim is ready
-        assert self.get_nodeattr("rtlsim_so") != "", "rtlsim not ready for " + self.onnx_node.name
+        """Return the unconstrained characteristic functions for this node.
+        Results are taken from and stored in the characteristic function cache
+        (see finn.util.chrc_cache) if it is enabled."""
         if self.get_nodeattr("io_chrc_period") > 0:
             warnings.warn("Skipping node %s: already has FIFO characteristic" % self.onnx_node.name)
             return
+        cache_key = chrc_cache_key(self, period)
+        cached_chrc = get_cached_chrc(cache_key)
+        if cached_chrc is not None:
+            for attr_name, value in cached_chrc.items():
+                self.set_nodeattr(attr_name, value)
+            return
+        # ensure rtlsim is ready
+        assert self.get_nodeattr("rtlsim_so") != "", "rtlsim not ready for " + self.onnx_node.name
         exp_cycles = self.get_exp_cycles()
         n_inps = np.prod(self.get_folded_input_shape()[:-1])
         n_outs = np.prod(self.get_folded_output_shape()[:-1])
@@ -786,7 +1065,7 @@ compilation transformations?
         else:
             io_dict = {
                 "inputs": {
-                    "in0": [0 for i in range(n_inps)],
+                    "in0": CyclicStream([0], n_inps),
                 },
                 "outputs": {"out": []},
             }
@@ -813,6 +1092,8 @@ compilation transformations?
                 else:
                     txns_out[outp].append(0)
 
+        for k, v in io_dict["inputs"].items():
+            io_dict["inputs"][k] = as_rtlsim_stream(v)
         reset_rtlsim(sim)
         total_cycle_count = rtlsim_multi_io(
             sim,
@@ -830,39 +1111,21 @@ compilation transformations?
         )
         self.set_nodeattr("io_chrc_period", period)
 
-        def accumulate_char_fxn(chrc):
-            p = len(chrc)
-            ret = []
-            for t in range(2 * p):
-                if t == 0:
-                    ret.append(chrc[0])
-                else:
-                    ret.append(ret[-1] + chrc[t % p])
-            return np.asarray(ret, dtype=np.int32)
-
-        all_txns_in = np.empty((len(txns_in.keys()), 2 * period), dtype=np.int32)
-        all_txns_out = np.empty((len(txns_out.keys()), 2 * period), dtype=np.int32)
+        all_txns_in = []
+        all_txns_out = []
         all_pad_in = []
         all_pad_out = []
-        for in_idx, in_strm_nm in enumerate(txns_in.keys()):
-            txn_in = txns_in[in_strm_nm]
-            if len(txn_in) < period:
-                pad_in = period - len(txn_in)
-                txn_in += [0 for x in range(pad_in)]
-            txn_in = accumulate_char_fxn(txn_in)
-            all_txns_in[in_idx, :] = txn_in
+        for txn_in in txns_in.values():
+            pad_in = max(0, period - len(txn_in))
+            all_txns_in.append(txn_in[:period] + [0 for x in range(pad_in)])
             all_pad_in.append(pad_in)
-
-        for out_idx, out_strm_nm in enumerate(txns_out.keys()):
-            txn_out = txns_out[out_strm_nm]
-            if len(txn_out) < period:
-                pad_out = period - len(txn_out)
-                txn_out += [0 for x in range(pad_out)]
-            txn_out = accumulate_char_fxn(txn_out)
-            all_txns_out[out_idx, :] = txn_out
+        for txn_out in txns_out.values():
+            pad_out = max(0, period - len(txn_out))
+            all_txns_out.append(txn_out[:period] + [0 for x in range(pad_out)])
             all_pad_out.append(pad_out)
 
-        self.set_nodeattr("io_chrc_in", all_txns_in)
-        self.set_nodeattr("io_chrc_out", all_txns_out)
+        self.set_nodeattr("io_chrc_in", encode_chrc(all_txns_in))
+        self.set_nodeattr("io_chrc_out", encode_chrc(all_txns_out))
         self.set_nodeattr("io_chrc_pads_in", all_pad_in)
         self.set_nodeattr("io_chrc_pads_out", all_pad_out)
+        store_chrc(cache_key, {x: self.get_nodeattr(x) for x in CHRC_CACHE_STORED_ATTRS})
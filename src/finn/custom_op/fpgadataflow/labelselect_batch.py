@@ -174,15 +174,26 @@ class LabelSelect_Batch(HLSCustomOp):
     def get_number_output_values(self):
         return self.get_nodeattr("K")
 
+    def execute_node_python(self, context, graph):
+        node = self.onnx_node
+        inp = context[node.input[0]].reshape(self.get_normal_input_shape())
+        # stable sort: of equal values, the one with the lower index comes
+        # first, as in the insertion sort of the hlslib implementation
+        out = np.argsort(-inp, axis=-1, kind="stable")[..., : self.get_nodeattr("K")]
+        context[node.output[0]] = out.reshape(self.get_normal_output_shape()).astype(np.int64)
+
     def execute_node(self, context, graph):
         mode = self.get_nodeattr("exec_mode")
+        if mode == "python":
+            self.execute_node_python(context, graph)
+            return
         node = self.onnx_node
         exp_ishape = self.get_normal_input_shape()
         exp_oshape = self.get_normal_output_shape()
         folded_ishape = self.get_folded_input_shape()
 
         if mode == "cppsim":
-            code_gen_dir = self.get_nodeattr("code_gen_dir_cppsim")
+            code_gen_dir = self.get_cppsim_io_dir()
         elif mode == "rtlsim":
             code_gen_dir = self.get_nodeattr("code_gen_dir_ipgen")
         else:
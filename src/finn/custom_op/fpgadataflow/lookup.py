@@ -35,9 +35,9 @@ from qonnx.core.datatype import DataType
 from finn.custom_op.fpgadataflow.hlscustomop import HLSCustomOp
 from finn.util.data_packing import (
     npy_to_rtlsim_input,
-    numpy_to_hls_code,
     pack_innermost_dim_as_hex_string,
     rtlsim_output_to_npy,
+    write_numpy_to_hls_code,
 )
 
 
@@ -334,10 +334,8 @@ class Lookup(HLSCustomOp):
             # reverse innertmost dim in embeddings to remain compatible with
             # how we normally encode the data in FINN
             embeddings_rev = np.flip(embeddings, -1)
-            embeddings_hls_code = numpy_to_hls_code(embeddings_rev, edt, "embeddings", True, False)
-            f_thresh = open(weight_filename, "w")
-            f_thresh.write(embeddings_hls_code)
-            f_thresh.close()
+            with open(weight_filename, "w") as f_thresh:
+                write_numpy_to_hls_code(f_thresh, embeddings_rev, edt, "embeddings", True, False)
         elif mem_mode == "external":
             edt = DataType[self.get_nodeattr("EmbeddingType")]
             ext_mem_width = self.get_nodeattr("ext_mem_width")
@@ -367,8 +365,18 @@ class Lookup(HLSCustomOp):
         else:
             raise Exception("Unrecognized mem_mode: " + mem_mode)
 
+    def execute_node_python(self, context, graph):
+        node = self.onnx_node
+        inp = context[node.input[0]].reshape(self.get_normal_input_shape())
+        embeddings = context[node.input[1]]
+        out = embeddings[inp.astype(np.int64)]
+        context[node.output[0]] = out.reshape(self.get_normal_output_shape()).astype(np.float32)
+
     def execute_node(self, context, graph):
         mode = self.get_nodeattr("exec_mode")
+        if mode == "python":
+            self.execute_node_python(context, graph)
+            return
         node = self.onnx_node
         exp_ishape = tuple(self.get_normal_input_shape())
         exp_oshape = tuple(self.get_normal_output_shape())
@@ -380,7 +388,7 @@ class Lookup(HLSCustomOp):
         ), "Only mem_mode=const is supported for simulation of Lookup layer"
 
         if mode == "cppsim":
-            code_gen_dir = self.get_nodeattr("code_gen_dir_cppsim")
+            code_gen_dir = self.get_cppsim_io_dir()
         elif mode == "rtlsim":
             code_gen_dir = self.get_nodeattr("code_gen_dir_ipgen")
         else:
@@ -348,8 +348,29 @@ class Pool_Batch(HLSCustomOp):
         )
         self.code_gen_dict["$PRAGMAS$"].append("#pragma HLS INTERFACE ap_ctrl_none port=return")
 
+    def execute_node_python(self, context, graph):
+        node = self.onnx_node
+        inp = context[node.input[0]].reshape(self.get_normal_input_shape())
+        ch = self.get_nodeattr("Channels")
+        pe = self.get_nodeattr("PE")
+        k_prod = int(np.prod(self.get_nodeattr("KernelSize")))
+        # channels are folded by PE, all kernel positions of a fold come in a row
+        inp = inp.reshape(inp.shape[:-1] + (ch // pe, k_prod, pe))
+        fxn = self.get_nodeattr("Function")
+        if fxn == "MaxPool":
+            out = inp.max(axis=-2)
+        elif fxn == "QuantAvgPool":
+            acc = inp.sum(axis=-2).astype(np.int64)
+            out = np.right_shift(acc, self.get_nodeattr("Size"))
+        else:
+            raise Exception("Pool_Batch doesn't currently support " + fxn)
+        context[node.output[0]] = out.reshape(self.get_normal_output_shape()).astype(np.float32)
+
     def execute_node(self, context, graph):
         mode = self.get_nodeattr("exec_mode")
+        if mode == "python":
+            self.execute_node_python(context, graph)
+            return
         node = self.onnx_node
         exp_ishape = self.get_normal_input_shape()
         folded_ishape = self.get_folded_input_shape()
@@ -357,7 +378,7 @@ class Pool_Batch(HLSCustomOp):
 
         # TODO ensure codegen dir exists
         if mode == "cppsim":
-            code_gen_dir = self.get_nodeattr("code_gen_dir_cppsim")
+            code_gen_dir = self.get_cppsim_io_dir()
         elif mode == "rtlsim":
             code_gen_dir = self.get_nodeattr("code_gen_dir_ipgen")
         else:
@@ -29,7 +29,7 @@
 from qonnx.core.modelwrapper import ModelWrapper
 from qonnx.custom_op.base import CustomOp
 
-from finn.core.onnx_exec import execute_onnx
+from finn.core.onnx_exec import execute_onnx, execute_onnx_batch
 
 # TODO move StreamingDataflowPartition to HLSCustomOp base class
 
@@ -60,9 +60,8 @@ class StreamingDataflowPartition(CustomOp):
     def infer_node_datatype(self, model):
         pass
 
-    def execute_node(self, context, graph):
-        model = ModelWrapper(self.get_nodeattr("model"))
-        return_full_exec_context = self.get_nodeattr("return_full_exec_context") == 1
+    def get_partition_inputs(self, model, context):
+        "Returns the input dict for executing the partition model."
         node = self.onnx_node
         inp_ctx = dict(filter(lambda x: x[0] in node.input, context.items()))
         # inputs may have been renamed in partition
@@ -71,7 +70,12 @@ class StreamingDataflowPartition(CustomOp):
             if old_iname != new_iname:
                 inp_ctx[new_iname] = inp_ctx[old_iname]
                 del inp_ctx[old_iname]
-        ret = execute_onnx(model, inp_ctx, return_full_exec_context)
+        return inp_ctx
+
+    def set_partition_outputs(self, model, context, ret):
+        "Places the results of executing the partition model into context."
+        return_full_exec_context = self.get_nodeattr("return_full_exec_context") == 1
+        node = self.onnx_node
         # outputs may have been renamed in partition
         for i, node_oname in enumerate(node.output):
             model_oname = model.graph.output[i].name
@@ -81,7 +85,23 @@ class StreamingDataflowPartition(CustomOp):
             for tname in ret.keys():
                 if tname not in [x.name for x in model.graph.output]:
                     context[node.name + "_" + tname] = ret[tname]
-        pass
+
+    def execute_node(self, context, graph):
+        model = ModelWrapper(self.get_nodeattr("model"))
+        return_full_exec_context = self.get_nodeattr("return_full_exec_context") == 1
+        inp_ctx = self.get_partition_inputs(model, context)
+        ret = execute_onnx(model, inp_ctx, return_full_exec_context)
+        self.set_partition_outputs(model, context, ret)
+
+    def execute_node_batch(self, contexts, graph):
+        """Executes the partition on a batch of samples, given as a list of
+        execution contexts, see finn.core.onnx_exec.execute_onnx_batch."""
+        model = ModelWrapper(self.get_nodeattr("model"))
+        return_full_exec_context = self.get_nodeattr("return_full_exec_context") == 1
+        inp_ctxs = [self.get_partition_inputs(model, context) for context in contexts]
+        rets = execute_onnx_batch(model, inp_ctxs, return_full_exec_context)
+        for context, ret in zip(contexts, rets):
+            self.set_partition_outputs(model, context, ret)
 
     def verify_node(self):
         info_messages = []
@@ -339,8 +339,17 @@ class StreamingDataWidthConverter_Batch(HLSCustomOp):
         if self.needs_lcm():
             self.code_gen_dict["$PRAGMAS$"].append("#pragma HLS DATAFLOW disable_start_propagation")
 
+    def execute_node_python(self, context, graph):
+        node = self.onnx_node
+        inp = context[node.input[0]]
+        exp_shape = self.get_normal_output_shape()
+        context[node.output[0]] = np.asarray(inp, dtype=np.float32).reshape(exp_shape)
+
     def execute_node(self, context, graph):
         mode = self.get_nodeattr("exec_mode")
+        if mode == "python":
+            self.execute_node_python(context, graph)
+            return
         impl_style = self.get_nodeattr("impl_style")
         node = self.onnx_node
         exp_shape = self.get_normal_input_shape()
@@ -349,7 +358,7 @@ class StreamingDataWidthConverter_Batch(HLSCustomOp):
         # TODO ensure codegen dir exists
         if mode == "cppsim":
             assert impl_style == "hls", "DWC cppsim only possible when impl_style==hls"
-            code_gen_dir = self.get_nodeattr("code_gen_dir_cppsim")
+            code_gen_dir = self.get_cppsim_io_dir()
         elif mode == "rtlsim":
             assert impl_style == "hls", "DWC rtlsim only possible when impl_style==hls"
             code_gen_dir = self.get_nodeattr("code_gen_dir_ipgen")
@@ -125,7 +125,7 @@ class StreamingFIFO(HLSCustomOp):
         is_rtl = self.get_nodeattr("impl_style") == "rtl"
         is_depth_monitor = self.get_nodeattr("depth_monitor") == 1
         if is_rtl and is_depth_monitor:
-            ret["ap_none"] = ["maxcount"]
+            ret["ap_none"] = ["maxcount", "count"]
         return ret
 
     def get_verilog_top_module_name(self):
@@ -261,8 +261,17 @@ class StreamingFIFO(HLSCustomOp):
     def get_output_datatype(self, ind=0):
         return DataType[self.get_nodeattr("dataType")]
 
+    def execute_node_python(self, context, graph):
+        node = self.onnx_node
+        inp = context[node.input[0]]
+        exp_shape = self.get_normal_output_shape()
+        context[node.output[0]] = np.asarray(inp, dtype=np.float32).reshape(exp_shape)
+
     def execute_node(self, context, graph):
         mode = self.get_nodeattr("exec_mode")
+        if mode == "python":
+            self.execute_node_python(context, graph)
+            return
         node = self.onnx_node
         inp = context[node.input[0]]
         exp_shape = self.get_normal_input_shape()
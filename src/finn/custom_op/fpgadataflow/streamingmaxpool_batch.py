@@ -357,8 +357,28 @@ class StreamingMaxPool_Batch(HLSCustomOp):
         )
         self.code_gen_dict["$PRAGMAS$"].append("#pragma HLS INTERFACE ap_ctrl_none port=return")
 
+    def execute_node_python(self, context, graph):
+        node = self.onnx_node
+        inp = context[node.input[0]].reshape(self.get_normal_input_shape())
+        (n, ifm_dim_h, ifm_dim_w, ch) = inp.shape
+        (k_h, k_w) = self.get_nodeattr("PoolDim")
+        (ofm_dim_h, ofm_dim_w) = self.get_normal_output_shape()[1:3]
+        # windows that extend past the input (CeilMode) only see the valid
+        # pixels, which is the same as padding with the smallest value
+        pad_h = max(ofm_dim_h * k_h - ifm_dim_h, 0)
+        pad_w = max(ofm_dim_w * k_w - ifm_dim_w, 0)
+        if pad_h > 0 or pad_w > 0:
+            pad_value = self.get_input_datatype().min()
+            inp = np.pad(inp, ((0, 0), (0, pad_h), (0, pad_w), (0, 0)), constant_values=pad_value)
+        inp = inp[:, : ofm_dim_h * k_h, : ofm_dim_w * k_w]
+        out = inp.reshape(n, ofm_dim_h, k_h, ofm_dim_w, k_w, ch).max(axis=(2, 4))
+        context[node.output[0]] = out.reshape(self.get_normal_output_shape()).astype(np.float32)
+
     def execute_node(self, context, graph):
         mode = self.get_nodeattr("exec_mode")
+        if mode == "python":
+            self.execute_node_python(context, graph)
+            return
         node = self.onnx_node
         exp_ishape = self.get_normal_input_shape()
         exp_oshape = self.get_normal_output_shape()
@@ -366,7 +386,7 @@ class StreamingMaxPool_Batch(HLSCustomOp):
 
         # TODO ensure codegen dir exists
         if mode == "cppsim":
-            code_gen_dir = self.get_nodeattr("code_gen_dir_cppsim")
+            code_gen_dir = self.get_cppsim_io_dir()
         elif mode == "rtlsim":
             code_gen_dir = self.get_nodeattr("code_gen_dir_ipgen")
         else:
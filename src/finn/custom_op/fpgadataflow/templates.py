@@ -32,6 +32,7 @@ docompute_template = """
 #define AP_INT_MAX_W $AP_INT_MAX_W$
 #include "cnpy.h"
 #include "npy2apintstream.hpp"
+#include <string>
 #include <vector>
 #include "bnn-library.h"
 
@@ -41,9 +42,21 @@ $GLOBALS$
 // defines for network parameters
 $DEFINES$
 
-int main(){
+int main(int argc, char ** argv){
 $PRAGMAS$
 
+// with --worker, execute n samples per "run <n>" line on stdin and answer
+// "done", with the .npy files of sample i in FINN_CPPSIM_IO_DIR/i
+bool worker = (argc > 1) && (std::string(argv[1]) == "--worker");
+const char * io_dir = std::getenv("FINN_CPPSIM_IO_DIR");
+std::string cmd;
+size_t n_samples = 1;
+while(!worker || ((std::cin >> cmd >> n_samples) && cmd == "run")) {
+for(size_t sample = 0; sample < n_samples; sample++) {
+if(worker) {
+  npy_io_dir() = std::string(io_dir) + "/" + std::to_string(sample);
+}
+
 $STREAMDECLARATIONS$
 
 $READNPYDATA$
@@ -54,6 +67,13 @@ $DATAOUTSTREAM$
 
 $SAVEASCNPY$
 
+}
+if(!worker) {
+  break;
+}
+std::cout << "done" << std::endl;
+}
+
 }
 
 """
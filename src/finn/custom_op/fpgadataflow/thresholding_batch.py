@@ -28,9 +28,8 @@
 
 import numpy as np
 import os
-import textwrap
 import warnings
-from math import ceil, log2
+from math import ceil
 from qonnx.core.datatype import DataType
 from qonnx.util.basic import (
     interleave_matrix_outer_dim_from_partitions,
@@ -40,10 +39,13 @@ from qonnx.util.basic import (
 from finn.custom_op.fpgadataflow.hlscustomop import HLSCustomOp
 from finn.util.data_packing import (
     npy_to_rtlsim_input,
-    numpy_to_hls_code,
-    pack_innermost_dim_as_hex_string,
+    pack_runtime_weight_words,
     rtlsim_output_to_npy,
+    write_numpy_to_hls_code,
+    write_weight_stream,
 )
+from finn.util.fpgadataflow import thresholds_activation
+from finn.util.pyverilator import CyclicStream
 
 # ONNX i/o tensor shape assumptions for Thresholding:
 # input 0 is the input tensor, shape (..., NumChannels)
@@ -351,10 +353,6 @@ class Thresholding_Batch(HLSCustomOp):
             threshold_tensor
         ).all(), "Thresholds can't be expressed with type %s" % str(tdt)
         if weight_file_mode == "hls_header":
-            # save thresholds in thresh.h
-            thresholds_hls_code = numpy_to_hls_code(
-                threshold_tensor, tdt, "thresholds", False, True
-            )
             # write thresholds into thresh.h
             f_thresh = open(weight_file_name, "w")
             tdt_hls = tdt.get_hls_datatype_str()
@@ -375,7 +373,7 @@ class Thresholding_Batch(HLSCustomOp):
                     "comp::less_equal<%s, %s>" % (tdt_hls, tdt_hls),
                 )
             )
-            f_thresh.write(thresholds_hls_code)
+            write_numpy_to_hls_code(f_thresh, threshold_tensor, tdt, "thresholds", False, True)
             f_thresh.close()
         elif "decoupled" in weight_file_mode:
             # streaming thresholds need to be organized differently
@@ -396,40 +394,20 @@ class Thresholding_Batch(HLSCustomOp):
             if weight_file_mode == "decoupled_npy":
                 # save weight stream into npy for cppsim
                 np.save(weight_file_name, decoupled_thres)
-            elif weight_file_mode == "decoupled_verilog_dat":
-                # convert weight values into hexstring
-                weight_width = self.get_weightstream_width()
-                # pad to nearest 4 bits to get hex strings
-                weight_width_padded = roundup_to_integer_multiple(weight_width, 4)
-                weight_tensor_pe_flipped = pack_innermost_dim_as_hex_string(
-                    decoupled_thres_pe_flipped, tdt, weight_width_padded, prefix=""
-                )
-                weight_stream = weight_tensor_pe_flipped.flatten()
-                weight_stream = weight_stream.copy()
-                with open(weight_file_name, "w") as f:
-                    for val in weight_stream:
-                        f.write(val + "\n")
-            elif weight_file_mode == "decoupled_runtime":
-                # memstream axi-lite interface will map each mem line to
-                # one or multiple 32-bit words
+            elif weight_file_mode in ["decoupled_verilog_dat", "decoupled_runtime"]:
+                # write packed weight stream as hex words (.dat) or 32-bit
+                # words for runtime reconfiguration
                 weight_width = self.get_weightstream_width()
-                words_per_memwidth = 2 ** ceil(log2(weight_width / 32))
-                if words_per_memwidth < 1:
-                    words_per_memwidth = 1
-                weight_width_padded = words_per_memwidth * 32
-                # first, pack and ensure padding to 32 bits
-                weight_tensor_pe_flipped = pack_innermost_dim_as_hex_string(
-                    decoupled_thres_pe_flipped, tdt, weight_width_padded, prefix=""
-                )
-                weight_stream = weight_tensor_pe_flipped.flatten()
-                weight_stream = weight_stream.copy()
                 with open(weight_file_name, "w") as f:
-                    for val in weight_stream:
-                        # split into groups of 8 hex digits (= 32 bits)
-                        words_32b = textwrap.wrap(val, 8)
-                        words_32b.reverse()
-                        for word_32b in words_32b:
-                            f.write(word_32b + "\n")
+                    write_weight_stream(
+                        f, decoupled_thres_pe_flipped, tdt, weight_width, weight_file_mode
+                    )
+                if weight_file_mode == "decoupled_runtime":
+                    # binary copy of the 32-bit words for fast loading in the driver
+                    runtime_words = pack_runtime_weight_words(
+                        decoupled_thres_pe_flipped, tdt, weight_width
+                    )
+                    np.save(os.path.splitext(weight_file_name)[0] + ".npy", runtime_words)
             else:
                 raise Exception("Decoupled weight export not yet implemented")
         else:
@@ -454,13 +432,30 @@ class Thresholding_Batch(HLSCustomOp):
         else:
             raise Exception("Unrecognized mem_mode")
 
+    def execute_node_python(self, context, graph):
+        node = self.onnx_node
+        inp = context[node.input[0]].reshape(self.get_normal_input_shape())
+        if self.get_input_datatype() == DataType["BIPOLAR"]:
+            # bipolar activations are thresholded in their binary form
+            inp = (inp + 1) / 2
+        out = thresholds_activation(
+            inp,
+            context[node.input[1]],
+            self.get_nodeattr("ActVal"),
+            self.get_output_datatype(),
+        )
+        context[node.output[0]] = out.reshape(self.get_normal_output_shape())
+
     def execute_node(self, context, graph):
         mode = self.get_nodeattr("exec_mode")
+        if mode == "python":
+            self.execute_node_python(context, graph)
+            return
         node = self.onnx_node
 
         # TODO ensure codegen dir exists
         if mode == "cppsim":
-            code_gen_dir = self.get_nodeattr("code_gen_dir_cppsim")
+            code_gen_dir = self.get_cppsim_io_dir()
         elif mode == "rtlsim":
             code_gen_dir = self.get_nodeattr("code_gen_dir_ipgen")
         else:
@@ -526,7 +521,7 @@ class Thresholding_Batch(HLSCustomOp):
                 )
                 num_w_reps = np.prod(self.get_nodeattr("numInputVectors"))
                 io_dict = {
-                    "inputs": {"in0": inp, "weights": wei * num_w_reps},
+                    "inputs": {"in0": inp, "weights": CyclicStream(wei, num_w_reps)},
                     "outputs": {"out": []},
                 }
                 self.rtlsim_multi_io(sim, io_dict)
@@ -926,7 +921,7 @@ class Thresholding_Batch(HLSCustomOp):
         n_inps = np.prod(self.get_folded_input_shape()[:-1])
         io_dict = {
             "inputs": {
-                "in0": [0 for i in range(n_inps)],
+                "in0": CyclicStream([0], n_inps),
             },
             "outputs": {"out": []},
         }
@@ -934,5 +929,5 @@ class Thresholding_Batch(HLSCustomOp):
         if mem_mode in ["decoupled", "external"]:
             n_weight_inps = self.calc_tmem()
             num_w_reps = np.prod(self.get_nodeattr("numInputVectors"))
-            io_dict["inputs"]["weights"] = [0 for i in range(num_w_reps * n_weight_inps)]
+            io_dict["inputs"]["weights"] = CyclicStream([0], num_w_reps * n_weight_inps)
         super().derive_characteristic_fxns(period, override_rtlsim_dict=io_dict)
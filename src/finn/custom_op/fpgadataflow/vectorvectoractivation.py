@@ -29,7 +29,6 @@
 import math
 import numpy as np
 import os
-import textwrap
 import warnings
 from qonnx.core.datatype import DataType
 from qonnx.util.basic import (
@@ -41,10 +40,13 @@ from qonnx.util.basic import (
 from finn.custom_op.fpgadataflow.hlscustomop import HLSCustomOp
 from finn.util.data_packing import (
     npy_to_rtlsim_input,
-    numpy_to_hls_code,
-    pack_innermost_dim_as_hex_string,
+    pack_runtime_weight_words,
     rtlsim_output_to_npy,
+    write_numpy_to_hls_code,
+    write_weight_stream,
 )
+from finn.util.fpgadataflow import thresholds_activation
+from finn.util.pyverilator import CyclicStream
 
 
 class VectorVectorActivation(HLSCustomOp):
@@ -467,7 +469,6 @@ class VectorVectorActivation(HLSCustomOp):
         if self.get_weight_datatype() == DataType["BIPOLAR"]:
             export_wdt = DataType["BINARY"]
         if weight_file_mode == "hls_header":
-            weight_hls_code = numpy_to_hls_code(weight_tensor, export_wdt, "weights", True, True)
             # write weights into C++ header file as dictated by finn-hlslib
             f_weights = open(weight_file_name, "w")
             if export_wdt.bitwidth() != 1:
@@ -487,7 +488,7 @@ class VectorVectorActivation(HLSCustomOp):
                         self.calc_wmem(),
                     )
                 )
-            f_weights.write(weight_hls_code)
+            write_numpy_to_hls_code(f_weights, weight_tensor, export_wdt, "weights", True, True)
             f_weights.close()
         elif "decoupled" in weight_file_mode:
             # create a weight stream for various flavors of decoupled mode:
@@ -509,41 +510,20 @@ class VectorVectorActivation(HLSCustomOp):
             if weight_file_mode == "decoupled_npy":
                 # save weight stream into npy for cppsim
                 np.save(weight_file_name, weight_tensor_simd_flipped)
-            elif weight_file_mode == "decoupled_verilog_dat":
-                # convert weight values into hexstring
+            elif weight_file_mode in ["decoupled_verilog_dat", "decoupled_runtime"]:
+                # write packed weight stream as hex words (.dat) or 32-bit
+                # words for runtime reconfiguration
                 weight_width = self.get_weightstream_width()
-                # pad to nearest 4 bits to get hex strings
-                weight_width_padded = roundup_to_integer_multiple(weight_width, 4)
-                weight_tensor_pe_flipped = pack_innermost_dim_as_hex_string(
-                    weight_tensor_pe_flipped, export_wdt, weight_width_padded, prefix=""
-                )
-                # add zeroes to pad out file to 1024 entries
-                weight_stream = weight_tensor_pe_flipped.flatten()
-                weight_stream = weight_stream.copy()
                 with open(weight_file_name, "w") as f:
-                    for val in weight_stream:
-                        f.write(val + "\n")
-            elif weight_file_mode == "decoupled_runtime":
-                # memstream axi-lite interface will map each mem line to
-                # one or multiple 32-bit words
-                weight_width = self.get_weightstream_width()
-                words_per_memwidth = 2 ** math.ceil(math.log2(weight_width / 32))
-                if words_per_memwidth < 1:
-                    words_per_memwidth = 1
-                weight_width_padded = words_per_memwidth * 32
-                # first, pack and ensure padding to 32 bits
-                weight_tensor_pe_flipped = pack_innermost_dim_as_hex_string(
-                    weight_tensor_pe_flipped, export_wdt, weight_width_padded, prefix=""
-                )
-                weight_stream = weight_tensor_pe_flipped.flatten()
-                weight_stream = weight_stream.copy()
-                with open(weight_file_name, "w") as f:
-                    for val in weight_stream:
-                        # split into groups of 8 hex digits (= 32 bits)
-                        words_32b = textwrap.wrap(val, 8)
-                        words_32b.reverse()
-                        for word_32b in words_32b:
-                            f.write(word_32b + "\n")
+                    write_weight_stream(
+                        f, weight_tensor_pe_flipped, export_wdt, weight_width, weight_file_mode
+                    )
+                if weight_file_mode == "decoupled_runtime":
+                    # binary copy of the 32-bit words for fast loading in the driver
+                    runtime_words = pack_runtime_weight_words(
+                        weight_tensor_pe_flipped, export_wdt, weight_width
+                    )
+                    np.save(os.path.splitext(weight_file_name)[0] + ".npy", runtime_words)
             else:
                 raise Exception("Unknown weight_file_mode")
 
@@ -597,9 +577,6 @@ class VectorVectorActivation(HLSCustomOp):
                     self.onnx_node.name,
                     str(tdt),
                 )
-                thresholds_hls_code = numpy_to_hls_code(
-                    threshold_tensor, tdt, "thresholds", False, True
-                )
                 # write thresholds into thresh.h
                 f_thresh = open("{}/thresh.h".format(code_gen_dir), "w")
                 tdt_hls = tdt.get_hls_datatype_str()
@@ -620,17 +597,57 @@ class VectorVectorActivation(HLSCustomOp):
                         "comp::less_equal<%s, %s>" % (tdt_hls, tdt_hls),
                     )
                 )
-                f_thresh.write(thresholds_hls_code)
+                write_numpy_to_hls_code(f_thresh, threshold_tensor, tdt, "thresholds", False, True)
                 f_thresh.close()
 
+    def execute_node_python(self, context, graph):
+        node = self.onnx_node
+        k_h, k_w = self.get_nodeattr("Kernel")
+        k = k_h * k_w
+        ch = self.get_nodeattr("Channels")
+        pe = self.get_nodeattr("PE")
+        idt = self.get_input_datatype()
+        wdt = self.get_weight_datatype()
+        bin_xnor_mode = self.get_nodeattr("binaryXnorMode") == 1
+        inp = context[node.input[0]].reshape(self.get_normal_input_shape())
+        # channels are folded by PE, all kernel positions of a fold come in a row
+        vecs = inp.shape[:-1]
+        inp = inp.reshape(vecs + (ch // pe, k, pe)).swapaxes(-3, -2)
+        inp = inp.reshape(vecs + (k, ch)).astype(np.float64)
+        weights = context[node.input[1]].reshape(ch, k).T.astype(np.float64)
+        # reinterpret binary inputs/weights as bipolar in xnor mode
+        if idt == DataType["BINARY"] and bin_xnor_mode:
+            inp = 2 * inp - 1
+        if wdt == DataType["BINARY"] and bin_xnor_mode:
+            weights = 2 * weights - 1
+        inp_is_bipolar = idt == DataType["BIPOLAR"] or (idt == DataType["BINARY"] and bin_xnor_mode)
+        wt_is_bipolar = wdt == DataType["BIPOLAR"] or (wdt == DataType["BINARY"] and bin_xnor_mode)
+        acc = (inp * weights).sum(axis=-2)
+        if inp_is_bipolar and wt_is_bipolar:
+            # XnorMul accumulates the number of matching bits
+            acc = (acc + k) / 2
+        if self.get_nodeattr("noActivation") == 1:
+            out = acc.astype(np.float32)
+        else:
+            out = thresholds_activation(
+                acc,
+                context[node.input[2]],
+                self.get_nodeattr("ActVal"),
+                self.get_output_datatype(),
+            )
+        context[node.output[0]] = out.reshape(self.get_normal_output_shape())
+
     def execute_node(self, context, graph):
         mode = self.get_nodeattr("exec_mode")
+        if mode == "python":
+            self.execute_node_python(context, graph)
+            return
         mem_mode = self.get_nodeattr("mem_mode")
         node = self.onnx_node
 
         # TODO ensure codegen dir exists
         if mode == "cppsim":
-            code_gen_dir = self.get_nodeattr("code_gen_dir_cppsim")
+            code_gen_dir = self.get_cppsim_io_dir()
         elif mode == "rtlsim":
             code_gen_dir = self.get_nodeattr("code_gen_dir_ipgen")
         else:
@@ -702,7 +719,7 @@ class VectorVectorActivation(HLSCustomOp):
                 num_w_reps = dim_h * dim_w
 
                 io_dict = {
-                    "inputs": {"in0": inp, "weights": wei * num_w_reps},
+                    "inputs": {"in0": inp, "weights": CyclicStream(wei, num_w_reps)},
                     "outputs": {"out": []},
                 }
                 self.rtlsim_multi_io(sim, io_dict)
@@ -1302,7 +1319,7 @@ class VectorVectorActivation(HLSCustomOp):
         n_inps = np.prod(self.get_folded_input_shape()[:-1])
         io_dict = {
             "inputs": {
-                "in0": [0 for i in range(n_inps)],
+                "in0": CyclicStream([0], n_inps),
             },
             "outputs": {"out": []},
         }
@@ -1310,5 +1327,5 @@ class VectorVectorActivation(HLSCustomOp):
         if mem_mode in ["decoupled", "external"]:
             n_weight_inps = self.calc_wmem()
             num_w_reps = np.prod(self.get_nodeattr("numInputVectors"))
-            io_dict["inputs"]["weights"] = [0 for i in range(num_w_reps * n_weight_inps)]
+            io_dict["inputs"]["weights"] = CyclicStream([0], num_w_reps * n_weight_inps)
         super().derive_characteristic_fxns(period, override_rtlsim_dict=io_dict)
@@ -3,6 +3,8 @@
 #include "hls_stream.h"
 #include "ap_int.h"
 #include <vector>
+#include <string>
+#include <cstdlib>
 #include <stdio.h>
 
 #ifdef DEBUG
@@ -13,6 +15,20 @@
 #define DEBUG_APINTSTREAM2NPY(x) ;
 #endif
 
+// I/O directory of the sample currently executed by a cppsim worker process,
+// empty if not running as a worker
+inline std::string & npy_io_dir() {
+  static std::string io_dir;
+  return io_dir;
+}
+
+// path of the .npy file npy_name, in the I/O directory of the current sample
+// if set (cppsim worker processes) and in default_dir otherwise
+inline std::string npy_io_path(const char * default_dir, const char * npy_name) {
+  const std::string & io_dir = npy_io_dir();
+  return (io_dir.empty() ? std::string(default_dir) : io_dir) + "/" + npy_name;
+}
+
 template <typename PackedT, typename ElemT, int ElemBits, typename NpyT>
 void npy2apintstream(const char * npy_path, hls::stream<PackedT> & out_stream, bool reverse_inner = true, size_t numReps = 1) {
   for(size_t rep = 0; rep < numReps; rep++) {
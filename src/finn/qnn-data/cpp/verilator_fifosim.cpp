@@ -30,6 +30,9 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE. */
 #include <fstream>
 #include <cstddef>
 #include <chrono>
+#include <algorithm>
+#include <vector>
+#include <string>
 #include "verilated.h"
 #include "verilated_vcd_c.h"
 #include "Vfinn_design_wrapper.h"
@@ -119,73 +122,236 @@ void reset() {
     top->ap_rst_n = 1;
 }
 
+// Traffic pattern of the streams: whether the source makes a new word
+// available (input streams) or the sink accepts a word (output streams) in a
+// given clock cycle. Words made available by a source are queued until they
+// are accepted, so input TVALID is never withdrawn before a handshake.
+struct TrafficPattern {
+    enum Kind { ALWAYS, FIXED_RATE, BURST, TRACE } kind;
+    // FIXED_RATE: fraction of cycles that are active, spread evenly
+    double rate;
+    // BURST: on_cycles active cycles followed by off_cycles inactive ones
+    unsigned long on_cycles, off_cycles;
+    // TRACE: active (non-zero) or inactive (zero) cycles read from a file,
+    // whitespace-separated and replayed cyclically
+    vector<char> trace;
+
+    TrafficPattern(Kind kind, double rate, unsigned long on_cycles, unsigned long off_cycles, const char * trace_file) :
+        kind(kind), rate(rate), on_cycles(on_cycles), off_cycles(off_cycles) {
+        if(kind == TRACE) {
+            ifstream f(trace_file);
+            int val;
+            while(f >> val) {
+                trace.push_back(val != 0);
+            }
+            if(trace.empty()) {
+                cout << "Empty or missing traffic trace file " << trace_file << endl;
+                exit(1);
+            }
+        }
+    }
+
+    bool active(unsigned long t) const {
+        switch(kind) {
+            case FIXED_RATE:
+                return (unsigned long)((t + 1) * rate) > (unsigned long)(t * rate);
+            case BURST:
+                return (t % (on_cycles + off_cycles)) < on_cycles;
+            case TRACE:
+                return trace[t % trace.size()];
+            default:
+                return true;
+        }
+    }
+};
+
+// Occupancy statistics of a FIFO with depth monitoring: histogram of its
+// count over all cycles in n_occ_bins bins of equal width covering [0, depth]
+// and the number of cycles it was full.
+const unsigned n_occ_bins = @N_OCC_BINS@;
+
+struct FifoMonitor {
+    unsigned long long depth;
+    unsigned long long hist[n_occ_bins];
+    unsigned long long cycles_full;
+
+    FifoMonitor(unsigned long long depth) : depth(depth), cycles_full(0) {
+        for(unsigned b = 0; b < n_occ_bins; b++) {
+            hist[b] = 0;
+        }
+    }
+
+    inline void sample(unsigned long long count) {
+        hist[min(count * n_occ_bins / (depth + 1), (unsigned long long) n_occ_bins - 1)]++;
+        if(count >= depth) {
+            cycles_full++;
+        }
+    }
+
+    void log(ofstream & results_file, const string & suffix) const {
+        results_file << "fullcycles" << suffix << "\t" << cycles_full << endl;
+        for(unsigned b = 0; b < n_occ_bins; b++) {
+            results_file << "occupancy" << suffix << "_bin" << b << "\t" << hist[b] << endl;
+        }
+    }
+};
+
 int main(int argc, char *argv[]) {
     top = construct();
     TRACE(tfp = start_vcd_trace(top, "trace.vcd"));
-    unsigned n_iters_per_input = @ITERS_PER_INPUT@;
-    unsigned n_iters_per_output = @ITERS_PER_OUTPUT@;
+    const unsigned n_in_streams = @N_IN_STREAMS@;
+    const unsigned n_out_streams = @N_OUT_STREAMS@;
+    // number of stream transactions per input sample, for each AXI stream
+    unsigned n_iters_per_input[n_in_streams] = {@ITERS_PER_INPUT@};
+    unsigned n_iters_per_output[n_out_streams] = {@ITERS_PER_OUTPUT@};
     unsigned n_inputs = @N_INPUTS@;
     unsigned max_iters = @MAX_ITERS@;
 
-    reset();
+    // handshake signals of the s_axis_* and m_axis_* streams
+    CData * s_axis_tvalid[n_in_streams];
+    CData * s_axis_tready[n_in_streams];
+    CData * m_axis_tvalid[n_out_streams];
+    CData * m_axis_tready[n_out_streams];
+@STREAM_SIGNALS@
 
-    top->m_axis_0_tready = 1;
-    top->s_axis_0_tvalid = 1;
+    TrafficPattern input_pattern(@INPUT_TRAFFIC@);
+    TrafficPattern output_pattern(@OUTPUT_TRAFFIC@);
+
+    // occupancy monitors of the FIFOs with depth monitoring
+    vector<FifoMonitor> fifo_monitors;
+@FIFO_MONITORS@
+
+    reset();
 
-    unsigned n_in_txns = 0, n_out_txns = 0, iters = 0, last_output_at = 0;
-    unsigned latency = 0;
+    // per-stream bookkeeping: number of transactions, cycle at which all
+    // inputs were written / the first sample was output (latency), and cycle
+    // of the last output (throughput)
+    // n_in_avail counts the input words made available by the source so far
+    unsigned n_in_txns[n_in_streams], n_in_avail[n_in_streams], in_done_at[n_in_streams];
+    unsigned n_out_txns[n_out_streams], latency[n_out_streams], last_output_at[n_out_streams];
+    for(unsigned i = 0; i < n_in_streams; i++) {
+        n_in_txns[i] = 0;
+        n_in_avail[i] = 0;
+        in_done_at[i] = 0;
+    }
+    for(unsigned o = 0; o < n_out_streams; o++) {
+        n_out_txns[o] = 0;
+        latency[o] = 0;
+        last_output_at[o] = 0;
+    }
+    unsigned iters = 0, any_output_at = 0;
 
     bool exit_criterion = false;
 
     cout << "Simulation starting" << endl;
-    cout << "Number of inputs to write " << n_iters_per_input * n_inputs << endl;
-    cout << "Number of outputs to expect " << n_iters_per_output * n_inputs << endl;
+    for(unsigned i = 0; i < n_in_streams; i++) {
+        cout << "Number of inputs to write on s_axis_" << i << " " << n_iters_per_input[i] * n_inputs << endl;
+    }
+    for(unsigned o = 0; o < n_out_streams; o++) {
+        cout << "Number of outputs to expect on m_axis_" << o << " " << n_iters_per_output[o] * n_inputs << endl;
+    }
     cout << "No-output timeout clock cycles " << max_iters << endl;
 
     chrono::steady_clock::time_point begin = chrono::steady_clock::now();
 
     while(!exit_criterion) {
-        toggle_clk();
         iters++;
-        if(iters % 1000 == 0) {
-            cout << "Elapsed iters " << iters << " inps " << n_in_txns << " outs " << n_out_txns << endl;
-            chrono::steady_clock::time_point end = chrono::steady_clock::now();
-            cout << "Elapsed since last report = " << chrono::duration_cast<chrono::seconds>(end - begin).count() << "[s]" << endl;
-            begin = end;
+        // drive the TVALID of the inputs and TREADY of the outputs for the
+        // next clock edge
+        bool input_active = input_pattern.active(iters);
+        for(unsigned i = 0; i < n_in_streams; i++) {
+            unsigned n_in_total = n_iters_per_input[i] * n_inputs;
+            if(input_active && n_in_avail[i] < n_in_total) {
+                n_in_avail[i]++;
+            }
+            *s_axis_tvalid[i] = n_in_avail[i] > n_in_txns[i];
+        }
+        bool output_active = output_pattern.active(iters);
+        for(unsigned o = 0; o < n_out_streams; o++) {
+            *m_axis_tready[o] = output_active;
+        }
+        // settle the design on the new inputs, so that the handshake signals
+        // seen below are those at the next clock edge
+        top->eval();
+        // count the transactions that happen at the next clock edge
+        bool all_done = true;
+        for(unsigned i = 0; i < n_in_streams; i++) {
+            unsigned n_in_total = n_iters_per_input[i] * n_inputs;
+            if(*s_axis_tready[i] == 1 && *s_axis_tvalid[i] == 1) {
+                n_in_txns[i]++;
+                if(n_in_txns[i] == n_in_total) {
+                    in_done_at[i] = iters;
+                    cout << "All inputs written on s_axis_" << i << " at cycle " << iters << endl;
+                }
+            }
+            all_done = all_done && (n_in_txns[i] >= n_in_total);
         }
-        if(top->s_axis_0_tready == 1 && top->s_axis_0_tvalid == 1) {
-            n_in_txns++;
-            if(n_in_txns == n_iters_per_input * n_inputs) {
-                top->s_axis_0_tvalid = 0;
-                cout << "All inputs written at cycle " << iters << endl;
+        for(unsigned o = 0; o < n_out_streams; o++) {
+            if(*m_axis_tvalid[o] == 1 && *m_axis_tready[o] == 1) {
+                n_out_txns[o]++;
+                last_output_at[o] = iters;
+                any_output_at = iters;
+                if(n_out_txns[o] == n_iters_per_output[o]) {
+                    latency[o] = iters;
+                }
             }
+            all_done = all_done && (n_out_txns[o] >= n_iters_per_output[o] * n_inputs);
         }
-        if(top->m_axis_0_tvalid == 1) {
-            n_out_txns++;
-            last_output_at = iters;
-            if(n_out_txns == n_iters_per_output) {
-                latency = iters;
+        toggle_clk();
+        // settle the design after the clock edge before sampling the counts
+        top->eval();
+@FIFO_MONITOR_SAMPLES@
+        if(iters % 1000 == 0) {
+            cout << "Elapsed iters " << iters << " inps";
+            for(unsigned i = 0; i < n_in_streams; i++) {
+                cout << " " << n_in_txns[i];
             }
+            cout << " outs";
+            for(unsigned o = 0; o < n_out_streams; o++) {
+                cout << " " << n_out_txns[o];
+            }
+            cout << endl;
+            chrono::steady_clock::time_point end = chrono::steady_clock::now();
+            cout << "Elapsed since last report = " << chrono::duration_cast<chrono::seconds>(end - begin).count() << "[s]" << endl;
+            begin = end;
         }
 
-        exit_criterion = ((n_in_txns >= n_iters_per_input * n_inputs) && (n_out_txns >= n_iters_per_output * n_inputs)) || ((iters-last_output_at) > max_iters);
+        exit_criterion = all_done || ((iters-any_output_at) > max_iters);
     }
 
     TRACE(flush_vcd_trace(tfp));
     TRACE(stop_vcd_trace(tfp));
 
+    unsigned total_in_txns = 0, total_out_txns = 0, max_latency = 0;
+    for(unsigned i = 0; i < n_in_streams; i++) {
+        total_in_txns += n_in_txns[i];
+    }
+    for(unsigned o = 0; o < n_out_streams; o++) {
+        total_out_txns += n_out_txns[o];
+        max_latency = max(max_latency, latency[o]);
+    }
+
     cout << "Simulation finished" << endl;
-    cout << "Number of inputs consumed " << n_in_txns << endl;
-    cout << "Number of outputs produced " << n_out_txns << endl;
+    cout << "Number of inputs consumed " << total_in_txns << endl;
+    cout << "Number of outputs produced " << total_out_txns << endl;
     cout << "Number of clock cycles " << iters << endl;
 
     ofstream results_file;
     results_file.open("results.txt", ios::out | ios::trunc);
-    results_file << "N_IN_TXNS" << "\t" << n_in_txns << endl;
-    results_file << "N_OUT_TXNS" << "\t" << n_out_txns << endl;
+    results_file << "N_IN_TXNS" << "\t" << total_in_txns << endl;
+    results_file << "N_OUT_TXNS" << "\t" << total_out_txns << endl;
     results_file << "cycles" << "\t" << iters << endl;
     results_file << "N" << "\t" << n_inputs << endl;
-    results_file << "latency_cycles" << "\t" << latency << endl;
+    results_file << "latency_cycles" << "\t" << max_latency << endl;
+    for(unsigned i = 0; i < n_in_streams; i++) {
+        results_file << "N_IN_TXNS_s_axis_" << i << "\t" << n_in_txns[i] << endl;
+        results_file << "input_done_cycles_s_axis_" << i << "\t" << in_done_at[i] << endl;
+    }
+    for(unsigned o = 0; o < n_out_streams; o++) {
+        results_file << "N_OUT_TXNS_m_axis_" << o << "\t" << n_out_txns[o] << endl;
+        results_file << "latency_cycles_m_axis_" << o << "\t" << latency[o] << endl;
+        results_file << "cycles_m_axis_" << o << "\t" << last_output_at[o] << endl;
+    }
 @FIFO_DEPTH_LOGGING@
     results_file.close();
 
@@ -29,8 +29,8 @@
 import numpy as np
 import os
 import time
-from pynq import Overlay, allocate
-from pynq.ps import Clocks
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from qonnx.core.datatype import DataType
 from qonnx.util.basic import gen_finn_dt_tensor
 
@@ -39,6 +39,13 @@ from finn.util.data_packing import (
     packed_bytearray_to_finnpy,
 )
 
+if os.environ.get("FINN_DRIVER_EMULATION", "0") == "1":
+    # host-side software emulation of the accelerator, see driver_emulation.py
+    from driver_emulation import Clocks, Overlay, allocate
+else:
+    from pynq import Overlay, allocate
+    from pynq.ps import Clocks
+
 # Driver base class for FINN-generated dataflow accelerators.
 # The particulars of the generated accelerator are specified via the
 # io_shape_dict (generated by the MakePYNQDriver transformation).
@@ -55,6 +62,8 @@ class FINNExampleOverlay(Overlay):
         device=None,
         download=True,
         runtime_weight_dir="runtime_weights/",
+        num_threads=1,
+        parallel_batch_threshold=64,
     ):
         """Initialize the FINN accelerator.
 
@@ -76,9 +85,17 @@ class FINNExampleOverlay(Overlay):
             Whether to flash the bitstream.
         runtime_weight_dir: str
             Path to runtime weights folder.
+        num_threads: int
+            Number of threads to split packing and unpacking over along the
+            batch dimension, 1 to always pack and unpack serially.
+        parallel_batch_threshold: int
+            Batches smaller than this are packed and unpacked serially.
         """
         super().__init__(bitfile_name, download=download, device=device)
         self.runtime_weight_dir = runtime_weight_dir
+        self.thread_pool = None
+        self.num_threads = num_threads
+        self.parallel_batch_threshold = parallel_batch_threshold
         self._io_shape_dict = io_shape_dict
         self.ibuf_packed_device = None
         self.obuf_packed_device = None
@@ -128,12 +145,13 @@ class FINNExampleOverlay(Overlay):
         tmp_weight_dict = {}
 
         for w_filename in w_filenames:
-            if w_filename.endswith(".npy"):
+            idma_name = w_filename.split(".")[0]
+            # skip other .npy files, such as binary runtime-writable weights
+            if w_filename.endswith(".npy") and idma_name in self.ip_dict.keys():
                 weight_tensor = np.load(self.runtime_weight_dir + "/" + w_filename)
             else:
                 continue
 
-            idma_name = w_filename.split(".")[0]
             tmp_weight_dict[idma_name] = weight_tensor
 
         for idma_name in tmp_weight_dict.keys():
@@ -160,7 +178,9 @@ class FINNExampleOverlay(Overlay):
         appropriate layer of the accelerator. Note that this must be enabled
         during the accelerator build process. The runtime weights directory
         is specified as the class member ``runtime_weight_dir``. Runtime-writable
-        weights are provided as one .dat file per layer.
+        weights are provided as one .dat file per layer, optionally accompanied
+        by a binary .npy file of uint32 words with the same name, which is
+        memory-mapped and preferred over the .dat file.
 
         Parameters
         ----------
@@ -177,14 +197,30 @@ class FINNExampleOverlay(Overlay):
             w_filenames.extend(filenames)
         rt_weight_dict = {}
         for w_filename in w_filenames:
-            if w_filename.endswith(".dat"):
+            w_name, w_ext = os.path.splitext(w_filename)
+            w_name_parts = w_name.split("_")
+            # runtime weight files are named <sdp_ind>_<layer_ind>_<node name>
+            if len(w_name_parts) < 3 or not (
+                w_name_parts[0].isdigit() and w_name_parts[1].isdigit()
+            ):
+                continue
+            if w_ext == ".npy":
+                layer_w = np.load(self.runtime_weight_dir + "/" + w_filename, mmap_mode="r")
+            elif w_ext == ".dat" and w_name + ".npy" not in w_filenames:
                 with open(self.runtime_weight_dir + "/" + w_filename, "r") as f:
                     dat = f.read()
+                hex_words = dat.strip().split()
+                hex_str = "".join(hex_words)
+                if len(hex_str) == 8 * len(hex_words):
+                    # all words are 8 hex digits: convert in one go
+                    layer_w = np.frombuffer(bytes.fromhex(hex_str), dtype=">u4")
+                    layer_w = layer_w.astype(np.uint32)
+                else:
+                    layer_w = np.fromiter([int(x, 16) for x in hex_words], dtype=np.uint32)
             else:
                 continue
-            layer_w = np.fromiter([int(x, 16) for x in dat.strip().split()], dtype=np.uint32)
-            sdp_ind = int(w_filename.split("_")[0])
-            layer_ind = int(w_filename.split("_")[1])
+            sdp_ind = int(w_name_parts[0])
+            layer_ind = int(w_name_parts[1])
             rt_weight_dict[(sdp_ind, layer_ind)] = layer_w
         for sdp_ind, layer_ind in rt_weight_dict.keys():
             cand_if_name = "StreamingDataflowPartition_%d" % sdp_ind
@@ -193,17 +229,17 @@ class FINNExampleOverlay(Overlay):
                 layer_w = rt_weight_dict[(sdp_ind, layer_ind)]
                 layer_mmio.write_mm(0, layer_w.tobytes())
                 if verify:
-                    if self.platform == "alveo":
-                        # Pynq for Alveo uses tinynumpy under the hood. There is a bug when going
-                        # from a tinynumpy.ndarray to numpy.ndarray. To work around this, we first
-                        # convert the tinynumpy.ndarray to a list and then copy the list to a
-                        # numpy.ndarray.
-                        new_w = np.copy(
-                            list(layer_mmio.array[: layer_w.shape[0]]), dtype=layer_w.dtype
-                        )
+                    if isinstance(layer_mmio.array, np.ndarray):
+                        new_w = layer_mmio.array[: layer_w.shape[0]]
                     else:
-                        new_w = np.copy(layer_mmio.array[: layer_w.shape[0]])
-                    assert (layer_w == new_w).all()
+                        # Pynq for Alveo uses tinynumpy under the hood, which does not
+                        # convert to numpy.ndarray properly, so read all registers back
+                        # from the device in one go instead
+                        new_w = np.frombuffer(
+                            layer_mmio.device.read_registers(layer_mmio.base_addr, layer_w.nbytes),
+                            dtype=layer_w.dtype,
+                        )
+                    assert np.array_equal(layer_w, new_w)
         if flush_accel:
             # run accelerator to flush any stale weights from weight streamer FIFOs
             self.execute_on_buffers()
@@ -214,34 +250,34 @@ class FINNExampleOverlay(Overlay):
     def odt(self, ind=0):
         return self._io_shape_dict["odt"][ind]
 
-    def ishape_normal(self, ind=0):
+    def ishape_normal(self, ind=0, batch_size=None):
         ret = list(self._io_shape_dict["ishape_normal"][ind])
-        ret[0] = self.batch_size
+        ret[0] = self.batch_size if batch_size is None else batch_size
         return tuple(ret)
 
-    def oshape_normal(self, ind=0):
+    def oshape_normal(self, ind=0, batch_size=None):
         ret = list(self._io_shape_dict["oshape_normal"][ind])
-        ret[0] = self.batch_size
+        ret[0] = self.batch_size if batch_size is None else batch_size
         return tuple(ret)
 
-    def ishape_folded(self, ind=0):
+    def ishape_folded(self, ind=0, batch_size=None):
         ret = list(self._io_shape_dict["ishape_folded"][ind])
-        ret[0] = self.batch_size
+        ret[0] = self.batch_size if batch_size is None else batch_size
         return tuple(ret)
 
-    def oshape_folded(self, ind=0):
+    def oshape_folded(self, ind=0, batch_size=None):
         ret = list(self._io_shape_dict["oshape_folded"][ind])
-        ret[0] = self.batch_size
+        ret[0] = self.batch_size if batch_size is None else batch_size
         return tuple(ret)
 
-    def ishape_packed(self, ind=0):
+    def ishape_packed(self, ind=0, batch_size=None):
         ret = list(self._io_shape_dict["ishape_packed"][ind])
-        ret[0] = self.batch_size
+        ret[0] = self.batch_size if batch_size is None else batch_size
         return tuple(ret)
 
-    def oshape_packed(self, ind=0):
+    def oshape_packed(self, ind=0, batch_size=None):
         ret = list(self._io_shape_dict["oshape_packed"][ind])
-        ret[0] = self.batch_size
+        ret[0] = self.batch_size if batch_size is None else batch_size
         return tuple(ret)
 
     @property
@@ -256,6 +292,37 @@ class FINNExampleOverlay(Overlay):
     def batch_size(self):
         return self._batch_size
 
+    @property
+    def num_threads(self):
+        return self._num_threads
+
+    @num_threads.setter
+    def num_threads(self, value):
+        assert value >= 1, "Need at least one thread."
+        self._num_threads = value
+        if self.thread_pool is not None:
+            self.thread_pool.shutdown()
+            self.thread_pool = None
+        if value > 1:
+            self.thread_pool = ThreadPoolExecutor(max_workers=value)
+
+    def use_thread_pool(self, batch_size):
+        """Whether to split work on a batch of given size over the thread pool."""
+        return self.thread_pool is not None and batch_size >= self.parallel_batch_threshold
+
+    def run_on_batch_slices(self, fxn, batch_size):
+        """Calls fxn(start, end) for disjoint slices of the batch dimension
+        that together cover the whole batch, one per thread of the thread pool,
+        and waits for all of them to finish. NumPy releases the GIL for most
+        of the (un)packing work, so the slices are processed in parallel."""
+        n_slices = min(self.num_threads, batch_size)
+        bounds = [(batch_size * k) // n_slices for k in range(n_slices + 1)]
+        futures = [
+            self.thread_pool.submit(fxn, start, end) for start, end in zip(bounds, bounds[1:])
+        ]
+        for future in futures:
+            future.result()
+
     @batch_size.setter
     def batch_size(self, value):
         self._batch_size = value
@@ -265,66 +332,120 @@ class FINNExampleOverlay(Overlay):
             self.ibuf_packed_device = None
         if self.obuf_packed_device is not None:
             self.obuf_packed_device = None
-        cacheable = {"alveo": False, "zynq-iodma": True}[self.platform]
-        self.ibuf_packed_device = []
-        self.obuf_packed_device = []
+        # additional buffer sets for pipelined execution are allocated on demand
+        self.pipeline_buffers = []
+        self.ibuf_packed_device, self.obuf_packed_device = self.allocate_device_buffers()
         self.obuf_packed = []
+        for o in range(self.num_outputs):
+            self.obuf_packed.append(np.empty_like(self.obuf_packed_device[o]))
+
+    def allocate_device_buffers(self):
+        """Allocates one set of packed input and output PYNQ buffers for the
+        current batch size. Returns a tuple of (input buffers, output buffers)."""
+        cacheable = {"alveo": False, "zynq-iodma": True}[self.platform]
+        ibufs = []
+        obufs = []
         for i in range(self.num_inputs):
             new_packed_ibuf = allocate(
                 shape=self.ishape_packed(i), dtype=np.uint8, cacheable=cacheable, target=self.device
             )
-            self.ibuf_packed_device.append(new_packed_ibuf)
+            ibufs.append(new_packed_ibuf)
         for o in range(self.num_outputs):
             new_packed_obuf = allocate(
                 shape=self.oshape_packed(o), dtype=np.uint8, cacheable=cacheable, target=self.device
             )
-            self.obuf_packed_device.append(new_packed_obuf)
-            self.obuf_packed.append(np.empty_like(new_packed_obuf))
+            obufs.append(new_packed_obuf)
+        return ibufs, obufs
 
-    def fold_input(self, ibuf_normal, ind=0):
+    def fold_input(self, ibuf_normal, ind=0, batch_size=None):
         """Reshapes input in desired shape.
         Gets input data (ibuf_normal), checks if data is in expected normal shape.
-        Returns folded input."""
+        Returns folded input. The optional batch_size parameter can be used
+        for a smaller batch than ``self.batch_size``."""
         # ensure that shape is as expected
-        assert ibuf_normal.shape == self.ishape_normal(ind)
+        assert ibuf_normal.shape == self.ishape_normal(ind, batch_size)
         # convert to folded form
-        ibuf_folded = ibuf_normal.reshape(self.ishape_folded(ind))
+        ibuf_folded = ibuf_normal.reshape(self.ishape_folded(ind, batch_size))
         return ibuf_folded
 
-    def pack_input(self, ibuf_folded, ind=0):
+    def pack_input(self, ibuf_folded, ind=0, out=None):
         """Packs folded input and reverses both SIMD dim and endianness.
-        Gets input data in folded shape and returns packed input data."""
-        ibuf_packed = finnpy_to_packed_bytearray(
-            ibuf_folded,
-            self.idt(ind),
-            reverse_endian=True,
-            reverse_inner=True,
-            fast_mode=True,
-        )
-        return ibuf_packed
-
-    def unpack_output(self, obuf_packed, ind=0):
+        Gets input data in folded shape and returns packed input data.
+        If out is specified (e.g. a PYNQ buffer), the packed data is written
+        into it directly. Large batches are split over the thread pool."""
+        batch_size = ibuf_folded.shape[0]
+        if not self.use_thread_pool(batch_size):
+            ibuf_packed = finnpy_to_packed_bytearray(
+                ibuf_folded,
+                self.idt(ind),
+                reverse_endian=True,
+                reverse_inner=True,
+                fast_mode=True,
+                out=out,
+            )
+            return ibuf_packed
+        if out is None:
+            out = np.empty(self.ishape_packed(ind, batch_size), dtype=np.uint8)
+
+        def pack_slice(start, end):
+            finnpy_to_packed_bytearray(
+                ibuf_folded[start:end],
+                self.idt(ind),
+                reverse_endian=True,
+                reverse_inner=True,
+                fast_mode=True,
+                out=out[start:end],
+            )
+
+        self.run_on_batch_slices(pack_slice, batch_size)
+        return out
+
+    def unpack_output(self, obuf_packed, ind=0, out=None, batch_size=None):
         """Unpacks the packed output buffer from accelerator.
-        Gets packed output and returns output data in folded shape."""
-        obuf_folded = packed_bytearray_to_finnpy(
-            obuf_packed,
-            self.odt(ind),
-            self.oshape_folded(ind),
-            reverse_endian=True,
-            reverse_inner=True,
-            fast_mode=True,
-        )
-        return obuf_folded
-
-    def unfold_output(self, obuf_folded, ind=0):
+        Gets packed output and returns output data in folded shape.
+        If out is specified, the unpacked data is written into it directly.
+        The optional batch_size parameter can be used for a smaller batch than
+        ``self.batch_size``. Large batches are split over the thread pool."""
+        oshape_folded = self.oshape_folded(ind, batch_size)
+        if not self.use_thread_pool(oshape_folded[0]):
+            obuf_folded = packed_bytearray_to_finnpy(
+                obuf_packed,
+                self.odt(ind),
+                oshape_folded,
+                reverse_endian=True,
+                reverse_inner=True,
+                fast_mode=True,
+                out=out,
+            )
+            return obuf_folded
+        if out is None:
+            out = np.empty(oshape_folded, dtype=np.float32)
+
+        def unpack_slice(start, end):
+            packed_bytearray_to_finnpy(
+                obuf_packed[start:end],
+                self.odt(ind),
+                (end - start,) + oshape_folded[1:],
+                reverse_endian=True,
+                reverse_inner=True,
+                fast_mode=True,
+                out=out[start:end],
+            )
+
+        self.run_on_batch_slices(unpack_slice, oshape_folded[0])
+        return out
+
+    def unfold_output(self, obuf_folded, ind=0, batch_size=None):
         """Unfolds output data to normal shape.
         Gets folded output data and returns output data in normal shape."""
-        obuf_normal = obuf_folded.reshape(self.oshape_normal(ind))
+        obuf_normal = obuf_folded.reshape(self.oshape_normal(ind, batch_size))
         return obuf_normal
 
     def copy_input_data_to_device(self, data, ind=0):
-        """Copies given input data to PYNQ buffer."""
-        np.copyto(self.ibuf_packed_device[ind], data)
+        """Copies given input data to PYNQ buffer. The copy is skipped if data
+        already is the PYNQ buffer, e.g. after packing into it directly."""
+        if data is not self.ibuf_packed_device[ind]:
+            np.copyto(self.ibuf_packed_device[ind], data)
         self.ibuf_packed_device[ind].flush()
 
     def copy_output_data_from_device(self, data, ind=0):
@@ -332,7 +453,7 @@ class FINNExampleOverlay(Overlay):
         self.obuf_packed_device[ind].invalidate()
         np.copyto(data, self.obuf_packed_device[ind])
 
-    def execute_on_buffers(self, asynch=False, batch_size=None):
+    def execute_on_buffers(self, asynch=False, batch_size=None, ibufs=None, obufs=None):
         """Executes accelerator by setting up the DMA(s) on pre-allocated buffers.
         Blocking behavior depends on the asynch parameter:
         * ``asynch=True`` will block until all transfers are complete.
@@ -341,9 +462,17 @@ class FINNExampleOverlay(Overlay):
 
         The optional batch_size parameter can be used to execute on a smaller
         batch than the initialized ``self.batch_size``.
+
+        The optional ibufs and obufs parameters can be used to execute on
+        another set of buffers from ``allocate_device_buffers()`` than
+        ``self.ibuf_packed_device`` and ``self.obuf_packed_device``.
         """
         if batch_size is None:
             batch_size = self.batch_size
+        if ibufs is None:
+            ibufs = self.ibuf_packed_device
+        if obufs is None:
+            obufs = self.obuf_packed_device
         assert batch_size <= self.batch_size, "Specified batch_size is too large."
         if self.platform == "zynq-iodma":
             for o in range(self.num_outputs):
@@ -354,22 +483,22 @@ class FINNExampleOverlay(Overlay):
                 iwdma.write(0x1C, batch_size)
                 iwdma.write(0x00, 1)
             for o in range(self.num_outputs):
-                self.odma[o].write(0x10, self.obuf_packed_device[o].device_address)
+                self.odma[o].write(0x10, obufs[o].device_address)
                 self.odma[o].write(0x1C, batch_size)
                 self.odma[o].write(0x00, 1)
             for i in range(self.num_inputs):
-                self.idma[i].write(0x10, self.ibuf_packed_device[i].device_address)
+                self.idma[i].write(0x10, ibufs[i].device_address)
                 self.idma[i].write(0x1C, batch_size)
                 self.idma[i].write(0x00, 1)
         elif self.platform == "alveo":
             for o in range(self.num_outputs):
                 assert self.odma_handle[o] is None, "Output DMA %d is already running" % o
             for i in range(self.num_inputs):
-                self.idma[i].start(self.ibuf_packed_device[i], batch_size)
+                self.idma[i].start(ibufs[i], batch_size)
             for iwdma, iwbuf, iwdma_name in self.external_weights:
                 iwdma.start(iwbuf, batch_size)
             for o in range(self.num_outputs):
-                self.odma_handle[o] = self.odma[o].start(self.obuf_packed_device[o], batch_size)
+                self.odma_handle[o] = self.odma[o].start(obufs[o], batch_size)
         else:
             raise Exception("Unrecognized platform: %s" % self.platform)
         # blocking behavior depends on asynch parameter
@@ -395,37 +524,213 @@ class FINNExampleOverlay(Overlay):
     def execute(self, input_npy):
         """Given a single or a list of input numpy array, first perform necessary
         packing and copying to device buffers, execute on accelerator, then unpack
-        output and return output numpy array from accelerator."""
+        output and return output numpy array from accelerator. The inputs may
+        hold a smaller batch than ``self.batch_size``."""
         # if single input, convert to list to normalize how we process the input
         if not type(input_npy) is list:
             input_npy = [input_npy]
         assert self.num_inputs == len(input_npy), "Not all accelerator inputs are specified."
+        batch_size = self.input_to_device_buffers(input_npy, self.ibuf_packed_device)
+        self.execute_on_buffers(batch_size=batch_size)
+        return self.output_from_device_buffers(self.obuf_packed_device, batch_size)
+
+    def input_to_device_buffers(self, input_npy, ibufs):
+        """Folds and packs the given list of input numpy arrays straight into
+        the given PYNQ input buffers, avoiding intermediate copies. The inputs
+        may hold a smaller batch than ``self.batch_size``, which only fills the
+        start of the buffers. Returns the batch size of the inputs."""
+        batch_size = input_npy[0].shape[0]
+        assert batch_size <= self.batch_size, "Input batch is larger than batch_size."
         for i in range(self.num_inputs):
-            ibuf_folded = self.fold_input(input_npy[i], ind=i)
-            ibuf_packed = self.pack_input(ibuf_folded, ind=i)
-            self.copy_input_data_to_device(ibuf_packed, ind=i)
-        self.execute_on_buffers()
+            ibuf_folded = self.fold_input(input_npy[i], ind=i, batch_size=batch_size)
+            self.pack_input(ibuf_folded, ind=i, out=ibufs[i][:batch_size])
+            ibufs[i].flush()
+        return batch_size
+
+    def output_from_device_buffers(self, obufs, batch_size=None):
+        """Unpacks and unfolds the outputs straight from the given PYNQ output
+        buffers, avoiding intermediate copies. The optional batch_size parameter
+        can be used to only unpack a smaller batch than ``self.batch_size``.
+        Returns a single output numpy array, or a list of them for accelerators
+        with multiple outputs."""
+        if batch_size is None:
+            batch_size = self.batch_size
         outputs = []
         for o in range(self.num_outputs):
-            self.copy_output_data_from_device(self.obuf_packed[o], ind=o)
-            obuf_folded = self.unpack_output(self.obuf_packed[o], ind=o)
-            obuf_normal = self.unfold_output(obuf_folded, ind=o)
+            obufs[o].invalidate()
+            obuf_folded = self.unpack_output(obufs[o][:batch_size], ind=o, batch_size=batch_size)
+            obuf_normal = self.unfold_output(obuf_folded, ind=o, batch_size=batch_size)
             outputs.append(obuf_normal)
         if self.num_outputs == 1:
             return outputs[0]
         else:
             return outputs
 
-    def throughput_test(self):
+    def execute_pipelined(self, iterable_of_batches, num_buffers=2):
+        """Executes the accelerator on a sequence of batches, overlapping host
+        and accelerator work: while batch i runs on the accelerator, batch i+1
+        is packed into and batch i-1 is unpacked from their own set of device
+        buffers. This is a generator which yields the outputs in order.
+
+        Parameters
+        ----------
+        iterable_of_batches: iterable
+            Yields a single or a list of input numpy arrays per batch, each in
+            the shape expected by ``execute()``. Batches may be smaller than
+            ``self.batch_size``, which runs them without reallocating buffers.
+        num_buffers: int
+            Number of input/output device buffer sets to rotate through, at
+            least 2. The first set is ``ibuf_packed_device/obuf_packed_device``,
+            further sets are allocated on first use and kept until the batch
+            size changes.
+        """
+        assert num_buffers >= 2, "Pipelined execution needs at least two buffer sets."
+        while len(self.pipeline_buffers) < num_buffers - 1:
+            self.pipeline_buffers.append(self.allocate_device_buffers())
+        buffer_sets = [(self.ibuf_packed_device, self.obuf_packed_device)]
+        buffer_sets += self.pipeline_buffers[: num_buffers - 1]
+
+        def next_batch(batches):
+            input_npy = next(batches, None)
+            if input_npy is not None and not type(input_npy) is list:
+                input_npy = [input_npy]
+            return input_npy
+
+        batches = iter(iterable_of_batches)
+        input_npy = next_batch(batches)
+        if input_npy is None:
+            return
+        batch_size = self.input_to_device_buffers(input_npy, buffer_sets[0][0])
+        running = False
+        done_obufs = None
+        done_batch_size = None
+        try:
+            i = 0
+            while input_npy is not None:
+                ibufs, obufs = buffer_sets[i % num_buffers]
+                self.execute_on_buffers(
+                    asynch=True, batch_size=batch_size, ibufs=ibufs, obufs=obufs
+                )
+                running = True
+                # host work for the neighbouring batches overlaps with batch i
+                input_npy = next_batch(batches)
+                if input_npy is not None:
+                    next_ibufs = buffer_sets[(i + 1) % num_buffers][0]
+                    next_batch_size = self.input_to_device_buffers(input_npy, next_ibufs)
+                if done_obufs is not None:
+                    yield self.output_from_device_buffers(done_obufs, done_batch_size)
+                self.wait_until_finished()
+                running = False
+                done_obufs = obufs
+                done_batch_size = batch_size
+                if input_npy is not None:
+                    batch_size = next_batch_size
+                i += 1
+            yield self.output_from_device_buffers(done_obufs, done_batch_size)
+        finally:
+            # don't leave DMAs in flight if the consumer stops early
+            if running:
+                self.wait_until_finished()
+
+    def infer_stream(self, iterator, max_batch=None, num_buffers=2):
+        """Runs inference on a stream of inputs of arbitrary size. The inputs
+        are coalesced into hardware batches of up to max_batch samples and run
+        through ``execute_pipelined()``, a partial final batch runs without
+        reallocating buffers. This is a generator which yields the outputs for
+        each item of the stream in order.
+
+        Parameters
+        ----------
+        iterator: iterable
+            Yields a single or a list of input numpy arrays per item, each
+            holding any number of samples in normal shape (with or without the
+            leading batch dimension for a single sample).
+        max_batch: int
+            Maximum number of samples per hardware batch, at most (and by
+            default equal to) ``self.batch_size``.
+        num_buffers: int
+            Number of device buffer sets for ``execute_pipelined()``.
+        """
+        if max_batch is None:
+            max_batch = self.batch_size
+        assert 0 < max_batch <= self.batch_size, "max_batch must be in [1, batch_size]."
+        # number of samples in each input item, in order
+        item_sizes = deque()
+
+        def hw_batches():
+            pending = None
+            for item in iterator:
+                if not type(item) is list:
+                    item = [item]
+                assert self.num_inputs == len(item), "Not all accelerator inputs are specified."
+                item = [
+                    np.asarray(x).reshape(self.ishape_normal(i, -1)) for i, x in enumerate(item)
+                ]
+                item_sizes.append(item[0].shape[0])
+                if pending is None:
+                    pending = item
+                else:
+                    pending = [np.concatenate([p, x]) for p, x in zip(pending, item)]
+                while pending[0].shape[0] >= max_batch:
+                    yield [p[:max_batch] for p in pending]
+                    pending = [p[max_batch:] for p in pending]
+            if pending is not None and pending[0].shape[0] > 0:
+                yield pending
+
+        done = None
+        for outputs in self.execute_pipelined(hw_batches(), num_buffers):
+            if not type(outputs) is list:
+                outputs = [outputs]
+            if done is None:
+                done = outputs
+            else:
+                done = [np.concatenate([d, x]) for d, x in zip(done, outputs)]
+            # hand out the outputs of all items that are complete
+            while len(item_sizes) > 0 and item_sizes[0] <= done[0].shape[0]:
+                n = item_sizes.popleft()
+                item_outputs = [d[:n] for d in done]
+                done = [d[n:] for d in done]
+                yield item_outputs[0] if self.num_outputs == 1 else item_outputs
+        # items without any samples at the end of the stream
+        while len(item_sizes) > 0:
+            assert item_sizes.popleft() == 0
+            empty = [
+                np.zeros(self.oshape_normal(o, 0), np.float32) for o in range(self.num_outputs)
+            ]
+            yield empty[0] if self.num_outputs == 1 else empty
+
+    def throughput_test(self, warmup=0, repetitions=1):
         """Run accelerator with empty inputs to measure throughput and other metrics.
-        Returns dictionary with various metrics."""
+        Each measurement is taken ``repetitions`` times after ``warmup`` untimed
+        runs. Reported times are medians, along with latency percentiles for the
+        accelerator and end-to-end (``execute()``) runs and the CPU time of each
+        host-side stage. Returns dictionary with various metrics, using the keys
+        of the rtlsim performance report where applicable."""
+        assert repetitions > 0, "Need at least one repetition."
+
+        def measure(fxn):
+            # wall and CPU times in ms for each repetition
+            for i in range(warmup):
+                fxn()
+            wall = []
+            cpu = []
+            for i in range(repetitions):
+                cpu_start = time.process_time_ns()
+                start = time.perf_counter_ns()
+                fxn()
+                end = time.perf_counter_ns()
+                cpu_end = time.process_time_ns()
+                wall.append((end - start) * 1e-6)
+                cpu.append((cpu_end - cpu_start) * 1e-6)
+            return np.asarray(wall), np.asarray(cpu)
+
         # dictionary for results of throughput test
         res = {}
-        start = time.time()
-        self.execute_on_buffers()
-        end = time.time()
-        runtime = end - start
+        runtimes, _ = measure(self.execute_on_buffers)
+        runtime = np.median(runtimes) * 0.001
         res["runtime[ms]"] = runtime * 1000
+        for p in [50, 95, 99]:
+            res["runtime_p%d[ms]" % p] = np.percentile(runtimes, p)
         res["throughput[images/s]"] = self.batch_size / runtime
         total_in = 0
         for i in range(self.num_inputs):
@@ -443,47 +748,192 @@ class FINNExampleOverlay(Overlay):
             res["fclk[mhz]"] = Clocks.fclk0_mhz
         elif self.platform == "alveo":
             res["fclk[mhz]"] = self.clock_dict["clock0"]["frequency"]
+        res["cycles"] = int(runtime * res["fclk[mhz]"] * 1000000)
         res["batch_size"] = self.batch_size
+        res["N"] = self.batch_size
+        res["warmup"] = warmup
+        res["repetitions"] = repetitions
         # also benchmark driver-related overheads
-        input_npy = gen_finn_dt_tensor(self.idt(), self.ishape_normal())
-        # provide as int8/uint8 to support fast packing path where possible
-        if self.idt() == DataType["UINT8"]:
-            input_npy = input_npy.astype(np.uint8)
-        elif self.idt() == DataType["INT8"]:
-            input_npy = input_npy.astype(np.int8)
-        start = time.time()
+        inputs = []
+        for i in range(self.num_inputs):
+            input_npy = gen_finn_dt_tensor(self.idt(i), self.ishape_normal(i))
+            # provide as int8/uint8 to support fast packing path where possible
+            if self.idt(i) == DataType["UINT8"]:
+                input_npy = input_npy.astype(np.uint8)
+            elif self.idt(i) == DataType["INT8"]:
+                input_npy = input_npy.astype(np.int8)
+            inputs.append(input_npy)
+        input_npy = inputs[0]
         ibuf_folded = self.fold_input(input_npy)
-        end = time.time()
-        runtime = end - start
-        res["fold_input[ms]"] = runtime * 1000
-
-        start = time.time()
         ibuf_packed = self.pack_input(ibuf_folded)
-        end = time.time()
-        runtime = end - start
-        res["pack_input[ms]"] = runtime * 1000
-
-        start = time.time()
-        self.copy_input_data_to_device(ibuf_packed)
-        end = time.time()
-        runtime = end - start
-        res["copy_input_data_to_device[ms]"] = runtime * 1000
-
-        start = time.time()
-        self.copy_output_data_from_device(self.obuf_packed[0])
-        end = time.time()
-        runtime = end - start
-        res["copy_output_data_from_device[ms]"] = runtime * 1000
-
-        start = time.time()
         obuf_folded = self.unpack_output(self.obuf_packed[0])
-        end = time.time()
-        runtime = end - start
-        res["unpack_output[ms]"] = runtime * 1000
-
-        start = time.time()
-        self.unfold_output(obuf_folded)
-        end = time.time()
-        runtime = end - start
-        res["unfold_output[ms]"] = runtime * 1000
+        stages = [
+            ("fold_input", lambda: self.fold_input(input_npy)),
+            ("pack_input", lambda: self.pack_input(ibuf_folded)),
+            ("copy_input_data_to_device", lambda: self.copy_input_data_to_device(ibuf_packed)),
+            (
+                "copy_output_data_from_device",
+                lambda: self.copy_output_data_from_device(self.obuf_packed[0]),
+            ),
+            ("unpack_output", lambda: self.unpack_output(self.obuf_packed[0])),
+            ("unfold_output", lambda: self.unfold_output(obuf_folded)),
+        ]
+        for stage_name, stage_fxn in stages:
+            wall, cpu = measure(stage_fxn)
+            res["%s[ms]" % stage_name] = np.median(wall)
+            res["%s_cpu[ms]" % stage_name] = np.median(cpu)
+        # end-to-end including packing and unpacking
+        e2e_runtimes, _ = measure(lambda: self.execute(inputs))
+        e2e_runtime = np.median(e2e_runtimes) * 0.001
+        res["e2e_runtime[ms]"] = e2e_runtime * 1000
+        for p in [50, 95, 99]:
+            res["e2e_runtime_p%d[ms]" % p] = np.percentile(e2e_runtimes, p)
+        res["e2e_throughput[images/s]"] = self.batch_size / e2e_runtime
+        return res
+
+    def throughput_sweep(self, batch_sizes, warmup=0, repetitions=1, saturation=0.95):
+        """Run throughput_test for each of the given batch sizes, reallocating
+        the buffers for each, and restore the original batch size afterwards.
+        Returns a dictionary with the list of individual results under "sweep",
+        the smallest batch size that reaches the given fraction of the highest
+        accelerator throughput under "saturating_batch_size", and the
+        stable-state throughput and fixed latency from a linear fit of
+        runtime over batch size, as in the rtlsim performance report."""
+        orig_batch_size = self.batch_size
+        sweep = []
+        try:
+            for batch_size in batch_sizes:
+                self.batch_size = batch_size
+                sweep.append(self.throughput_test(warmup=warmup, repetitions=repetitions))
+        finally:
+            self.batch_size = orig_batch_size
+        res = {"sweep": sweep}
+        max_throughput = max([x["throughput[images/s]"] for x in sweep])
+        for x in sweep:
+            if x["throughput[images/s]"] >= saturation * max_throughput:
+                res["saturating_batch_size"] = x["batch_size"]
+                break
+        if len(set(batch_sizes)) > 1:
+            # runtime = fixed latency + batch_size / stable-state throughput
+            slope, intercept = np.polyfit(
+                [x["batch_size"] for x in sweep], [x["runtime[ms]"] * 0.001 for x in sweep], 1
+            )
+            res["stable_throughput[images/s]"] = 1 / slope if slope > 0 else max_throughput
+            res["latency_cycles"] = int(max(intercept, 0) * sweep[0]["fclk[mhz]"] * 1000000)
         return res
+
+
+class FINNShardedAccelerator:
+    """Front end that shards batches over several FINN accelerators, such as
+    one FINNExampleOverlay per device on a multi-card host, or one per
+    replicated kernel on the same card (each with its own DMA names in its
+    io_shape_dict, downloading the bitfile only once). The shards run
+    concurrently via the asynchronous execute_on_buffers, and the outputs are
+    reassembled in order. Per-accelerator throughput is tracked in
+    ``self.stats``."""
+
+    def __init__(self, accels):
+        """Initialize the sharded accelerator.
+
+        Parameters
+        ----------
+        accels: list of FINNExampleOverlay
+            Accelerators with identical I/O to shard batches over. The
+            batch_size of each determines the size of its shards.
+        """
+        assert len(accels) > 0, "Need at least one accelerator."
+        self.accels = accels
+        self.reset_stats()
+
+    @classmethod
+    def from_devices(cls, bitfile_name, platform, io_shape_dict, devices, **kwargs):
+        """Create one FINNExampleOverlay for each of the given PYNQ devices,
+        passing on all other arguments, and shard over them."""
+        accels = [
+            FINNExampleOverlay(bitfile_name, platform, io_shape_dict, device=device, **kwargs)
+            for device in devices
+        ]
+        return cls(accels)
+
+    @property
+    def num_inputs(self):
+        return self.accels[0].num_inputs
+
+    @property
+    def num_outputs(self):
+        return self.accels[0].num_outputs
+
+    @property
+    def batch_size(self):
+        """Number of samples processed by one round over all accelerators."""
+        return sum([accel.batch_size for accel in self.accels])
+
+    def reset_stats(self):
+        """Reset the per-accelerator throughput accounting."""
+        self.stats = [{"images": 0, "runtime[ms]": 0.0} for accel in self.accels]
+
+    def throughput_report(self):
+        """Returns per-accelerator and total images and images/s from the
+        accounting since the last ``reset_stats()``. The runtime of each
+        accelerator counts from launching its shard until its completion was
+        observed."""
+        res = {"accelerators": []}
+        for stats in self.stats:
+            runtime = stats["runtime[ms]"] * 0.001
+            accel_res = dict(stats)
+            accel_res["throughput[images/s]"] = stats["images"] / runtime if runtime > 0 else 0
+            res["accelerators"].append(accel_res)
+        res["images"] = sum([x["images"] for x in self.stats])
+        res["throughput[images/s]"] = sum([x["throughput[images/s]"] for x in res["accelerators"]])
+        return res
+
+    def execute(self, input_npy):
+        """Given a single or a list of input numpy arrays with any number of
+        samples, shard them over the accelerators in rounds of up to
+        ``self.batch_size`` samples and return the output(s) in order."""
+        if not type(input_npy) is list:
+            input_npy = [input_npy]
+        assert self.num_inputs == len(input_npy), "Not all accelerator inputs are specified."
+        n_samples = input_npy[0].shape[0]
+        outputs = []
+        for round_start in range(0, n_samples, self.batch_size):
+            # assign consecutive shards, filling accelerators in order
+            shards = []
+            shard_start = round_start
+            for a, accel in enumerate(self.accels):
+                shard_end = min(shard_start + accel.batch_size, n_samples)
+                if shard_end > shard_start:
+                    shards.append((a, shard_start, shard_end))
+                shard_start = shard_end
+            # pack and launch each shard as soon as it is ready
+            launch_times = []
+            for a, start, end in shards:
+                accel = self.accels[a]
+                shard_inputs = [x[start:end] for x in input_npy]
+                accel.input_to_device_buffers(shard_inputs, accel.ibuf_packed_device)
+                launch_times.append(time.perf_counter_ns())
+                accel.execute_on_buffers(asynch=True, batch_size=end - start)
+            for (a, start, end), launch_time in zip(shards, launch_times):
+                accel = self.accels[a]
+                accel.wait_until_finished()
+                runtime_ns = time.perf_counter_ns() - launch_time
+                self.stats[a]["images"] += end - start
+                self.stats[a]["runtime[ms]"] += runtime_ns * 1e-6
+                shard_outputs = accel.output_from_device_buffers(
+                    accel.obuf_packed_device, end - start
+                )
+                if not type(shard_outputs) is list:
+                    shard_outputs = [shard_outputs]
+                outputs.append(shard_outputs)
+        if n_samples == 0:
+            # no shards were launched, nothing to concatenate
+            outputs = [
+                np.zeros(self.accels[0].oshape_normal(o, batch_size=0), dtype=np.float32)
+                for o in range(self.num_outputs)
+            ]
+        else:
+            outputs = [np.concatenate([x[o] for x in outputs]) for o in range(self.num_outputs)]
+        if self.num_outputs == 1:
+            return outputs[0]
+        else:
+            return outputs
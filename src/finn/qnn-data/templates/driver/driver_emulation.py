@@ -0,0 +1,257 @@
+# Copyright (c) 2020 Xilinx, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of Xilinx nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import itertools
+import numpy as np
+import weakref
+
+from finn.util.data_packing import (
+    finnpy_to_packed_bytearray,
+    packed_bytearray_to_finnpy,
+)
+
+# Host-side software emulation of the parts of PYNQ used by driver_base.py:
+# Overlay, allocate, Clocks and the register/start interfaces of the IODMAs.
+# Selected by setting the environment variable FINN_DRIVER_EMULATION=1, which
+# allows profiling and testing the host path of the driver without a board.
+# If the bitfile_name passed to the overlay is an .onnx file, the outputs are
+# computed by running this model through execute_onnx (this needs the full
+# FINN compiler installed), otherwise the accelerator produces all zeros.
+
+# IP names for which the emulated overlay provides an emulated IP
+EMULATED_IP_PREFIXES = ("idma", "odma", "StreamingDataflowPartition_")
+
+# device addresses of all live emulated buffers
+_buffers_by_address = weakref.WeakValueDictionary()
+_next_address = itertools.count(0x10000000, 0x1000)
+
+
+class Clocks:
+    """Emulated pynq.ps.Clocks."""
+
+    fclk0_mhz = 100.0
+
+
+class EmulatedBuffer(np.ndarray):
+    """Emulated PYNQ buffer: a numpy array with a unique device address. Cache
+    maintenance calls are accepted but have no effect."""
+
+    def __array_finalize__(self, obj):
+        self.device_address = getattr(obj, "device_address", 0)
+
+    def flush(self):
+        pass
+
+    def invalidate(self):
+        pass
+
+    def sync_to_device(self):
+        pass
+
+    def sync_from_device(self):
+        pass
+
+    def freebuffer(self):
+        pass
+
+    @property
+    def physical_address(self):
+        return self.device_address
+
+
+def allocate(shape, dtype=np.uint32, cacheable=True, target=None, **kwargs):
+    """Emulated pynq.allocate, returns a zero-initialized EmulatedBuffer."""
+    buf = np.zeros(shape, dtype=dtype).view(EmulatedBuffer)
+    buf.device_address = next(_next_address)
+    _buffers_by_address[buf.device_address] = buf
+    return buf
+
+
+class EmulatedMMIO:
+    """Emulated AXI-lite memory map, as used for runtime-writable weights."""
+
+    def __init__(self):
+        self.array = np.zeros(0, dtype=np.uint32)
+
+    def write_mm(self, offset, data):
+        data = np.frombuffer(bytes(data), dtype=np.uint32)
+        start = offset // 4
+        if start + data.shape[0] > self.array.shape[0]:
+            self.array = np.concatenate(
+                [self.array, np.zeros(start + data.shape[0] - self.array.shape[0], np.uint32)]
+            )
+        self.array[start : start + data.shape[0]] = data
+
+    def read(self, offset=0):
+        return int(self.array[offset // 4])
+
+    def write(self, offset, value):
+        self.write_mm(offset, np.uint32(value).tobytes())
+
+
+class EmulatedHandle:
+    """Emulated wait handle as returned by starting a kernel on Alveo."""
+
+    def __init__(self, overlay):
+        self.overlay = overlay
+
+    def wait(self):
+        self.overlay.finish_emulated_run()
+
+
+class EmulatedIP:
+    """Emulated IODMA or dataflow partition IP. Provides the ap_ctrl register
+    interface used on zynq-iodma (buffer address at 0x10, batch size at 0x1C,
+    control/status at 0x00) and the start() interface used on Alveo."""
+
+    def __init__(self, overlay, name):
+        self.overlay = overlay
+        self.name = name
+        self.mmio = EmulatedMMIO()
+        self.regs = {}
+        self.launched = None
+
+    def read(self, offset):
+        if offset != 0x00:
+            return self.regs.get(offset, 0)
+        if self.launched is not None:
+            # the emulated run completes as soon as somebody looks at it
+            self.overlay.finish_emulated_run()
+        if self.launched is not None:
+            # not all DMAs of the run launched yet: report ap_start
+            return 0x1
+        # ap_idle | ap_done
+        return 0x6
+
+    def write(self, offset, value):
+        if offset == 0x00:
+            if value & 0x1:
+                buf = _buffers_by_address[self.regs[0x10]]
+                self.launched = (buf, self.regs[0x1C])
+        else:
+            self.regs[offset] = value
+
+    def start(self, buf, batch_size):
+        self.launched = (buf, batch_size)
+        return EmulatedHandle(self.overlay)
+
+
+class EmulatedIPDict(dict):
+    """Emulated ip_dict that reports all IPs the emulation provides as
+    present, since there is no .hwh to read them from."""
+
+    def __contains__(self, name):
+        return name.startswith(EMULATED_IP_PREFIXES)
+
+    def keys(self):
+        return self
+
+
+class Overlay:
+    """Emulated pynq.Overlay for FINNExampleOverlay. The (un)packing conventions
+    and shapes of the accelerator are taken from the io_shape_dict of the
+    FINNExampleOverlay that derives from this class."""
+
+    def __init__(self, bitfile_name, download=True, device=None):
+        self.bitfile_name = bitfile_name
+        self.device = device
+        self.ip_dict = EmulatedIPDict()
+        self.clock_dict = {"clock0": {"frequency": Clocks.fclk0_mhz}}
+        self.emulated_ips = {}
+        self.emulated_model = None
+        if str(bitfile_name).endswith(".onnx"):
+            from qonnx.core.modelwrapper import ModelWrapper
+
+            self.emulated_model = ModelWrapper(bitfile_name)
+
+    def __getattr__(self, name):
+        # only called if regular attribute lookup fails, provide emulated IPs
+        if not name.startswith(EMULATED_IP_PREFIXES):
+            raise AttributeError(name)
+        ips = self.__dict__.setdefault("emulated_ips", {})
+        if name not in ips:
+            ips[name] = EmulatedIP(self, name)
+        return ips[name]
+
+    def finish_emulated_run(self):
+        """Computes the outputs of the current run once all input and output
+        DMAs have been launched, and marks all DMAs as finished."""
+        if not all([dma.launched is not None for dma in self.idma + self.odma]):
+            return
+        batch_size = self.odma[0].launched[1]
+        inputs = []
+        for i, dma in enumerate(self.idma):
+            ishape_folded = (batch_size,) + tuple(self._io_shape_dict["ishape_folded"][i][1:])
+            ishape_normal = (batch_size,) + tuple(self._io_shape_dict["ishape_normal"][i][1:])
+            ibuf_folded = packed_bytearray_to_finnpy(
+                dma.launched[0][:batch_size],
+                self._io_shape_dict["idt"][i],
+                ishape_folded,
+                reverse_endian=True,
+                reverse_inner=True,
+            )
+            inputs.append(ibuf_folded.reshape(ishape_normal))
+        outputs = self.emulate_accelerator(inputs, batch_size)
+        for o, dma in enumerate(self.odma):
+            oshape_folded = (batch_size,) + tuple(self._io_shape_dict["oshape_folded"][o][1:])
+            finnpy_to_packed_bytearray(
+                outputs[o].reshape(oshape_folded),
+                self._io_shape_dict["odt"][o],
+                reverse_endian=True,
+                reverse_inner=True,
+                out=dma.launched[0][:batch_size],
+            )
+        for ip in self.emulated_ips.values():
+            ip.launched = None
+
+    def emulate_accelerator(self, inputs, batch_size):
+        """Returns the list of outputs in normal shape for the given list of
+        inputs in normal shape, either from the ONNX model or all zeros."""
+        outputs = []
+        if self.emulated_model is None:
+            for o in range(len(self.odma)):
+                oshape_normal = (batch_size,) + tuple(self._io_shape_dict["oshape_normal"][o][1:])
+                outputs.append(np.zeros(oshape_normal, dtype=np.float32))
+            return outputs
+        from finn.core.onnx_exec import execute_onnx
+
+        model = self.emulated_model
+        sample_outputs = []
+        # execute sample by sample, the model has the hardware batch size of 1
+        for b in range(batch_size):
+            input_dict = {}
+            for i, graph_in in enumerate(model.graph.input):
+                ishape = model.get_tensor_shape(graph_in.name)
+                input_dict[graph_in.name] = inputs[i][b].reshape(ishape)
+            output_dict = execute_onnx(model, input_dict)
+            sample_outputs.append([output_dict[x.name] for x in model.graph.output])
+        for o in range(len(model.graph.output)):
+            oshape_normal = (batch_size,) + tuple(self._io_shape_dict["oshape_normal"][o][1:])
+            output = np.stack([x[o] for x in sample_outputs])
+            outputs.append(output.reshape(oshape_normal))
+        return outputs
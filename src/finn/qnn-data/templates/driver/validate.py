@@ -28,9 +28,28 @@
 
 import argparse
 import numpy as np
+import queue
+import threading
+import time
 from driver import io_shape_dict
 from driver_base import FINNExampleOverlay
 
+
+def prefetch_batches(driver, test_imgs, bsize, buffer_sets, free_sets, ready_sets):
+    """Producer: folds and packs each batch straight into a free set of device
+    buffers while the accelerator works on the previous one."""
+    try:
+        for start in range(0, test_imgs.shape[0], bsize):
+            imgs = test_imgs[start : start + bsize]
+            set_ind = free_sets.get()
+            ibuf_normal = imgs.reshape(driver.ishape_normal(batch_size=imgs.shape[0]))
+            driver.input_to_device_buffers([ibuf_normal], buffer_sets[set_ind][0])
+            ready_sets.put((start, imgs.shape[0], set_ind))
+    finally:
+        # signal the end of the dataset (or a failure) to the consumer
+        ready_sets.put(None)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Validate top-1 accuracy for FINN-generated accelerator"
@@ -48,6 +67,9 @@ if __name__ == "__main__":
     parser.add_argument(
         "--dataset_root", help="dataset root dir for download/reuse", default="/tmp"
     )
+    parser.add_argument(
+        "--num_buffers", help="number of device buffer sets to prefetch into", type=int, default=2
+    )
     # parse arguments
     args = parser.parse_args()
     bsize = args.batchsize
@@ -55,6 +77,7 @@ if __name__ == "__main__":
     bitfile = args.bitfile
     platform = args.platform
     dataset_root = args.dataset_root
+    num_buffers = args.num_buffers
 
     if dataset == "mnist":
         from dataset_loading import mnist
@@ -86,22 +109,41 @@ if __name__ == "__main__":
         runtime_weight_dir="runtime_weights/",
     )
 
-    n_batches = int(total / bsize)
-
-    test_imgs = test_imgs.reshape(n_batches, bsize, -1)
-    test_labels = test_labels.reshape(n_batches, bsize)
+    n_batches = (total + bsize - 1) // bsize
+    buffer_sets = [(driver.ibuf_packed_device, driver.obuf_packed_device)]
+    buffer_sets += [driver.allocate_device_buffers() for i in range(num_buffers - 1)]
+    free_sets = queue.Queue()
+    for set_ind in range(num_buffers):
+        free_sets.put(set_ind)
+    ready_sets = queue.Queue()
+    producer = threading.Thread(
+        target=prefetch_batches,
+        args=(driver, test_imgs, bsize, buffer_sets, free_sets, ready_sets),
+        daemon=True,
+    )
 
-    for i in range(n_batches):
-        ibuf_normal = test_imgs[i].reshape(driver.ibuf_packed_device[0].shape)
-        exp = test_labels[i]
-        driver.copy_input_data_to_device(ibuf_normal)
-        driver.execute_on_buffers()
-        obuf_normal = np.empty_like(driver.obuf_packed_device[0])
-        driver.copy_output_data_from_device(obuf_normal)
-        ret = np.bincount(obuf_normal.flatten() == exp.flatten())
-        nok += ret[0]
-        ok += ret[1]
-        print("batch %d / %d : total OK %d NOK %d" % (i + 1, n_batches, ok, nok))
+    start_time = time.perf_counter()
+    producer.start()
+    batch = 0
+    while True:
+        ready = ready_sets.get()
+        if ready is None:
+            break
+        start, n_imgs, set_ind = ready
+        ibufs, obufs = buffer_sets[set_ind]
+        driver.execute_on_buffers(batch_size=n_imgs, ibufs=ibufs, obufs=obufs)
+        obuf_normal = driver.output_from_device_buffers(obufs, n_imgs)
+        free_sets.put(set_ind)
+        exp = test_labels[start : start + n_imgs]
+        n_ok = np.count_nonzero(obuf_normal.flatten() == exp.flatten())
+        ok += n_ok
+        nok += n_imgs - n_ok
+        batch += 1
+        print("batch %d / %d : total OK %d NOK %d" % (batch, n_batches, ok, nok))
+    producer.join()
+    runtime = time.perf_counter() - start_time
+    assert ok + nok == total, "Not all batches were processed."
 
     acc = 100.0 * ok / (total)
     print("Final accuracy: %f" % acc)
+    print("Throughput: %f images/s" % (total / runtime))
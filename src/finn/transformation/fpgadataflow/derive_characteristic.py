@@ -27,12 +27,57 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
+import json
+import numpy as np
+import os
 import qonnx.custom_op.registry as registry
 import warnings
 from qonnx.core.modelwrapper import ModelWrapper
-from qonnx.transformation.base import NodeLocalTransformation
+from qonnx.transformation.base import NodeLocalTransformation, Transformation
 
-from finn.util.fpgadataflow import is_fpgadataflow_node
+from finn.analysis.fpgadataflow.dataflow_tokensim import dataflow_tokensim
+from finn.transformation.fpgadataflow.prepare_ip import _codegen_single_node
+from finn.transformation.fpgadataflow.replace_verilog_relpaths import (
+    ReplaceVerilogRelPaths,
+)
+from finn.util.chrc_cache import chrc_cache_key, get_cached_chrc
+from finn.util.fpgadataflow import decode_chrc, is_fpgadataflow_node
+
+
+def min_phase_shift(prod_txns, cons_txns, period):
+    """Return the minimum phase shift (in cycles) between the transactions of
+    a producer and its consumer over one period, given as the cycles at which
+    they happen (see decode_chrc), such that the consumer never consumes more
+    than was produced: prod_chrc[pshift + i] >= cons_chrc[i] for all
+    0 <= i < period - pshift, for the cumulative characteristic functions
+    prod_chrc and cons_chrc. Returns period - 1 if there is no such shift."""
+    n_cons = len(cons_txns)
+    if n_cons == 0:
+        return 0
+    # the k-th consumer transaction at cycle cons_txns[k] needs a shift of at
+    # least prod_txns[k] - cons_txns[k], unless it is shifted out of the
+    # period, which happens for shifts >= period - cons_txns[k]
+    prod_k = np.full(n_cons, period, dtype=np.int64)
+    n_prod = min(n_cons, len(prod_txns))
+    prod_k[:n_prod] = prod_txns[:n_prod]
+    pshift = max(0, int((prod_k - cons_txns).max()))
+    return min(pshift, period - 1)
+
+
+def chrc_fifo_depth(prod_txns, cons_txns, period, pshift):
+    """Return the FIFO depth between a producer and its consumer, given the
+    cycles of their transactions over one period (see decode_chrc) and the
+    phase shift between them (see min_phase_shift): the maximum of
+    prod_chrc[pshift + i] - cons_chrc[i] for 0 <= i < period, where the
+    cumulative producer characteristic prod_chrc spans two periods."""
+    prod_txns = np.concatenate([prod_txns, np.asarray(prod_txns) + period])
+    # the difference can only be maximal at the start of the window or right
+    # after a producer transaction
+    in_window = (prod_txns >= pshift) & (prod_txns < pshift + period)
+    cycles = np.concatenate([[0], prod_txns[in_window] - pshift])
+    n_produced = np.searchsorted(prod_txns, cycles + pshift, side="right")
+    n_consumed = np.searchsorted(cons_txns, cycles, side="right")
+    return int((n_produced - n_consumed).max())
 
 
 class DeriveCharacteristic(NodeLocalTransformation):
@@ -100,15 +145,21 @@ class DeriveCharacteristic(NodeLocalTransformation):
             comp_branch_first = registry.getCustomOp(comp_branch_first)
             # for DuplicateStreams, use comp_branch_first's input characterization
             # for AddStreams, use comp_branch_last's output characterization
+            # (the compact characteristic of a single stream can be repeated
+            # as is for all streams of a node)
             period = comp_branch_first.get_nodeattr("io_chrc_period")
-            comp_branch_first_f = comp_branch_first.get_nodeattr("io_characteristic")[: 2 * period]
-            comp_branch_last_f = comp_branch_last.get_nodeattr("io_characteristic")[2 * period :]
+            comp_branch_first_in = comp_branch_first.get_nodeattr("io_chrc_in")
+            comp_branch_first_f = comp_branch_first_in[: comp_branch_first_in[0] + 1]
+            comp_branch_last_out = comp_branch_last.get_nodeattr("io_chrc_out")
+            comp_branch_last_f = comp_branch_last_out[: comp_branch_last_out[0] + 1]
             ds_node_inst = registry.getCustomOp(ds_node)
             addstrm_node_inst = registry.getCustomOp(addstrm_node)
             ds_node_inst.set_nodeattr("io_chrc_period", period)
-            ds_node_inst.set_nodeattr("io_characteristic", comp_branch_first_f * 2)
+            ds_node_inst.set_nodeattr("io_chrc_in", comp_branch_first_f)
+            ds_node_inst.set_nodeattr("io_chrc_out", comp_branch_first_f * len(ds_node.output))
             addstrm_node_inst.set_nodeattr("io_chrc_period", period)
-            addstrm_node_inst.set_nodeattr("io_characteristic", comp_branch_last_f * 2)
+            addstrm_node_inst.set_nodeattr("io_chrc_in", comp_branch_last_f * 2)
+            addstrm_node_inst.set_nodeattr("io_chrc_out", comp_branch_last_f)
             warnings.warn(f"Set {ds_node.name} chrc. from {comp_branch_first.onnx_node.name}")
             warnings.warn(f"Set {addstrm_node.name} chrc. from {comp_branch_last.onnx_node.name}")
         return (model, run_again)
@@ -136,8 +187,7 @@ class DeriveFIFOSizes(NodeLocalTransformation):
                 prod = registry.getCustomOp(node)
                 assert op_type != "StreamingFIFO", "Found existing FIFOs"
                 period = prod.get_nodeattr("io_chrc_period")
-                prod_chrc = prod.get_nodeattr("io_chrc_out")[0]
-                assert len(prod_chrc) == 2 * period, "Found unexpected characterization attribute"
+                prod_chrc = decode_chrc(prod.get_nodeattr("io_chrc_out"), period)[0]
                 if any([x > 2 for x in prod.get_nodeattr("outFIFODepths")]):
                     # FIFO depth already set, can skip this node
                     return (node, False)
@@ -153,18 +203,9 @@ class DeriveFIFOSizes(NodeLocalTransformation):
                         out_fifo_depths.append(self.io_fifo_depth)
                         continue
                     cons = registry.getCustomOp(cons_node)
-                    cons_chrc = cons.get_nodeattr("io_chrc_in")[0]
-                    # find minimum phase shift satisfying the constraint
-                    pshift_min = period - 1
-                    for pshift_cand in range(period):
-                        prod_chrc_part = prod_chrc[pshift_cand:period]
-                        cons_chrc_part = cons_chrc[: period - pshift_cand]
-                        if (prod_chrc_part >= cons_chrc_part).all():
-                            pshift_min = pshift_cand
-                            break
-                    prod_chrc_part = prod_chrc[pshift_min : (pshift_min + period)]
-                    cons_chrc_part = cons_chrc[:period]
-                    fifo_depth = int((prod_chrc_part - cons_chrc_part).max())
+                    cons_chrc = decode_chrc(cons.get_nodeattr("io_chrc_in"), period)[0]
+                    pshift_min = min_phase_shift(prod_chrc, cons_chrc, period)
+                    fifo_depth = chrc_fifo_depth(prod_chrc, cons_chrc, period, pshift_min)
                     out_fifo_depths.append(fifo_depth)
                 # set output FIFO depth for this (producing) node
                 # InsertFIFO looks at the max of (outFIFODepths, inFIFODepths)
@@ -183,3 +224,212 @@ class DeriveFIFOSizes(NodeLocalTransformation):
                 # exception if op_type is not supported
                 raise Exception("Custom op_type %s is currently not supported." % op_type)
         return (node, False)
+
+
+class DeriveFIFOSizesTokenSim(Transformation):
+    """Perform FIFO sizing by a token-level simulation of the dataflow graph
+    (see finn.analysis.fpgadataflow.dataflow_tokensim), setting the
+    in/outFIFODepths attributes of HLSCustomOp nodes like DeriveFIFOSizes.
+    No HLS synthesis or RTL simulation is needed: the nodes are modeled from
+    their expected cycles and folded shapes, or from their characteristic
+    functions if DeriveCharacteristic was already called on them. The
+    simulation results, including the latency and throughput estimates, are
+    available as the sim_results member after the transformation was applied.
+
+    * n_samples (int or None) number of samples to simulate, see
+      dataflow_tokensim.
+
+    * io_fifo_depth (int) minimum depth of the FIFOs on top-level inputs and
+      outputs.
+    """
+
+    def __init__(self, n_samples=None, io_fifo_depth=32):
+        super().__init__()
+        self.n_samples = n_samples
+        self.io_fifo_depth = io_fifo_depth
+        self.sim_results = None
+
+    def apply(self, model):
+        for node in model.graph.node:
+            assert node.op_type != "StreamingFIFO", "Found existing FIFOs"
+        self.sim_results = dataflow_tokensim(model, self.n_samples)
+        fifo_depths = self.sim_results["fifo_depths"]
+        graph_inputs = [x.name for x in model.graph.input]
+        for node in model.graph.node:
+            inst = registry.getCustomOp(node)
+            if any([x > 2 for x in inst.get_nodeattr("outFIFODepths")]):
+                # FIFO depth already set, can skip this node
+                continue
+            # tensors without an entry are graph outputs
+            out_fifo_depths = [fifo_depths.get(x, self.io_fifo_depth) for x in node.output]
+            inst.set_nodeattr("outFIFODepths", out_fifo_depths)
+            in_fifo_depths = inst.get_nodeattr("inFIFODepths")
+            for i, input_name in enumerate(node.input):
+                if input_name in graph_inputs:
+                    in_fifo_depths[i] = max(self.io_fifo_depth, in_fifo_depths[i])
+            inst.set_nodeattr("inFIFODepths", in_fifo_depths)
+        return (model, False)
+
+
+def get_changed_nodes(model, ref_config):
+    """Return the names of the nodes of the model whose hardware attributes
+    differ from the given reference configuration, the dict of a
+    final_hw_config.json written by step_set_fifo_depths for a previous build
+    of the same network. The in/outFIFODepths attributes are not compared.
+    Nodes are matched by name and StreamingFIFO nodes of the reference are
+    ignored, so the model must not contain any FIFOs. Returns None if the
+    nodes of the model do not match the nodes of the reference."""
+    ref_names = set(ref_config.keys()) - {"Defaults"}
+    ref_names = {x for x in ref_names if not x.startswith("StreamingFIFO")}
+    if set([x.name for x in model.graph.node]) != ref_names:
+        return None
+    changed = []
+    for node in model.graph.node:
+        assert node.op_type != "StreamingFIFO", "Found existing FIFOs"
+        inst = registry.getCustomOp(node)
+        for attr_name, ref_value in ref_config[node.name].items():
+            if attr_name in ["inFIFODepths", "outFIFODepths"]:
+                continue
+            try:
+                # compare in the form written to the json file
+                value = json.loads(json.dumps(inst.get_nodeattr(attr_name)))
+            except AttributeError:
+                value = None
+            if value != ref_value:
+                changed.append(node.name)
+                break
+    return changed
+
+
+class DeriveFIFOSizesIncremental(Transformation):
+    """Perform FIFO sizing incrementally with respect to the final hardware
+    configuration of a previous build (see get_changed_nodes), e.g. after the
+    folding of a few layers was changed by hand. The characteristic functions
+    are only derived for the changed nodes and their direct predecessors and
+    successors, and only the FIFOs on the streams of the changed nodes are
+    sized from them like in DeriveFIFOSizes. All other FIFOs keep the depth
+    they had in the reference configuration. Sets the in/outFIFODepths
+    attributes of HLSCustomOp nodes. If fpgapart and clk are given, the code
+    for the nodes to characterize is generated as needed and HLS synthesis
+    only runs for those that are not in the characteristic function cache,
+    otherwise PrepareIP and HLSSynthIP must already have been called on them.
+    No IP is generated for any other node. rtlsim is prepared as needed.
+
+    * ref_config (dict) reference configuration, as loaded from the
+      final_hw_config.json of the previous build.
+
+    * period (int) period over which the characteristic functions are derived,
+      see DeriveCharacteristic.
+
+    * fpgapart (str or None) FPGA part to generate IP for, see PrepareIP.
+
+    * clk (float or None) clock period in ns to generate IP for, see PrepareIP.
+
+    * io_fifo_depth (int) depth of the FIFOs on top-level inputs and outputs of
+      changed nodes.
+    """
+
+    def __init__(self, ref_config, period, fpgapart=None, clk=None, io_fifo_depth=32):
+        super().__init__()
+        self.ref_config = ref_config
+        self.period = period
+        self.fpgapart = fpgapart
+        self.clk = clk
+        self.io_fifo_depth = io_fifo_depth
+        self.changed_nodes = None
+
+    def ref_fifo_depth(self, node_name, attr_name, ind):
+        ref_depths = self.ref_config[node_name].get(attr_name, [])
+        return ref_depths[ind] if ind < len(ref_depths) else 0
+
+    def apply(self, model):
+        changed = get_changed_nodes(model, self.ref_config)
+        assert changed is not None, "Nodes do not match the reference configuration"
+        self.changed_nodes = changed
+        to_characterize = set(changed)
+        for node in model.graph.node:
+            if node.name in changed:
+                neighbours = model.find_direct_predecessors(node) or []
+                neighbours += model.find_direct_successors(node) or []
+                to_characterize.update([x.name for x in neighbours])
+        # nodes that are not in the characteristic function cache need IP
+        # and rtlsim
+        needs_rtlsim = []
+        for node in model.graph.node:
+            if node.name not in to_characterize:
+                continue
+            inst = registry.getCustomOp(node)
+            if inst.get_nodeattr("io_chrc_period") > 0 or inst.get_nodeattr("rtlsim_so") != "":
+                continue
+            if self.fpgapart is not None:
+                # the cache key covers the FPGA part and clock of the code
+                _codegen_single_node(node, model, self.fpgapart, self.clk)
+            if get_cached_chrc(chrc_cache_key(inst, self.period)) is not None:
+                continue
+            needs_rtlsim.append(node.name)
+            if self.fpgapart is not None and not os.path.isdir(inst.get_nodeattr("ipgen_path")):
+                inst.ipgen_singlenode_code()
+        if len(needs_rtlsim) > 0:
+            model = model.transform(ReplaceVerilogRelPaths())
+        for node in model.graph.node:
+            if node.name not in to_characterize:
+                continue
+            inst = registry.getCustomOp(node)
+            if node.name in needs_rtlsim:
+                inst.prepare_rtlsim()
+            inst.derive_characteristic_fxns(period=self.period)
+            assert inst.get_nodeattr("io_chrc_period") == self.period, (
+                "Characteristic of %s has a different period" % node.name
+            )
+
+        # size the FIFOs, keyed by tensor name
+        fifo_depths = {}
+        for node in model.graph.node:
+            for i, output_name in enumerate(node.output):
+                cons_node = model.find_consumer(output_name)
+                if cons_node is None:
+                    # top-level output
+                    continue
+                j = list(cons_node.input).index(output_name)
+                if node.name in changed or cons_node.name in changed:
+                    prod = registry.getCustomOp(node)
+                    cons = registry.getCustomOp(cons_node)
+                    prod_chrc = decode_chrc(prod.get_nodeattr("io_chrc_out"), self.period)[i]
+                    cons_chrc = decode_chrc(cons.get_nodeattr("io_chrc_in"), self.period)[j]
+                    pshift_min = min_phase_shift(prod_chrc, cons_chrc, self.period)
+                    fifo_depth = chrc_fifo_depth(prod_chrc, cons_chrc, self.period, pshift_min)
+                else:
+                    # InsertFIFO looks at the max of (outFIFODepths, inFIFODepths)
+                    fifo_depth = max(
+                        self.ref_fifo_depth(node.name, "outFIFODepths", i),
+                        self.ref_fifo_depth(cons_node.name, "inFIFODepths", j),
+                    )
+                fifo_depths[output_name] = fifo_depth
+
+        # set the same depth on both ends of each stream, so that InsertFIFO
+        # does not pick up any depth set earlier
+        graph_inputs = [x.name for x in model.graph.input]
+        for node in model.graph.node:
+            inst = registry.getCustomOp(node)
+            out_fifo_depths = []
+            for i, output_name in enumerate(node.output):
+                if output_name in fifo_depths:
+                    out_fifo_depths.append(fifo_depths[output_name])
+                elif node.name in changed:
+                    out_fifo_depths.append(self.io_fifo_depth)
+                else:
+                    out_fifo_depths.append(self.ref_fifo_depth(node.name, "outFIFODepths", i))
+            inst.set_nodeattr("outFIFODepths", out_fifo_depths)
+            in_fifo_depths = []
+            for j, input_name in enumerate(node.input):
+                if input_name in fifo_depths:
+                    in_fifo_depths.append(fifo_depths[input_name])
+                elif input_name not in graph_inputs:
+                    # no stream, e.g. weights
+                    continue
+                elif node.name in changed:
+                    in_fifo_depths.append(self.io_fifo_depth)
+                else:
+                    in_fifo_depths.append(self.ref_fifo_depth(node.name, "inFIFODepths", j))
+            inst.set_nodeattr("inFIFODepths", in_fifo_depths)
+        return (model, False)
@@ -73,7 +73,8 @@ class MakePYNQDriver(Transformation):
     Outcome if successful: sets the pynq_driver_dir attribute in the ONNX
     ModelProto's metadata_props field, with the created driver dir as the
     value. If any layers use runtime-writable parameters, those will be gathered
-    under the runtime_weights/ subfolder of the pynq_driver_dir.
+    under the runtime_weights/ subfolder of the pynq_driver_dir, as .dat text
+    files and as binary .npy files of the same 32-bit words.
     """
 
     def __init__(self, platform):
@@ -91,6 +92,11 @@ class MakePYNQDriver(Transformation):
         )
         driver_base_py = pynq_driver_dir + "/driver_base.py"
         shutil.copy(driver_base_template, driver_base_py)
+        # software emulation of the accelerator for host-side profiling
+        driver_emulation_template = (
+            os.environ["FINN_ROOT"] + "/src/finn/qnn-data/templates/driver/driver_emulation.py"
+        )
+        shutil.copy(driver_emulation_template, pynq_driver_dir + "/driver_emulation.py")
         # driver depends on qonnx and finn packages
         # extract individual source files and copy to driver folder
         qonnx_target_path = pynq_driver_dir + "/qonnx"
@@ -34,7 +34,10 @@ from finn.util.fpgadataflow import is_fpgadataflow_node
 
 class SetExecMode(Transformation):
     """Set attribute exec_mode in all fpgadataflow nodes to specify which
-    kind of execution should be used ("cppsim" or "rtlsim")"""
+    kind of execution should be used ("cppsim", "rtlsim" or "python").
+    The "python" mode uses a NumPy model of each node that needs neither code
+    generation nor compilation, nodes without such a model raise an exception
+    on execution."""
 
     def __init__(self, mode):
         super().__init__()
@@ -232,6 +232,10 @@ class InsertAndSetFIFODepths(Transformation):
     - when sim finished, update each FIFO depth to maximum observed occupancy
       and set inFIFODepths/outFIFODepths attrs to that depth as well
 
+    With the C++ simulation, input_traffic and output_traffic can specify a
+    traffic pattern for the inputs and backpressure on the outputs, see
+    finn.util.pyverilator.fifosim_traffic_pattern.
+
     """
 
     def __init__(
@@ -243,6 +247,8 @@ class InsertAndSetFIFODepths(Transformation):
         swg_exception=True,
         vivado_ram_style="auto",
         force_python_sim=False,
+        input_traffic=None,
+        output_traffic=None,
     ):
         super().__init__()
         self.fpgapart = fpgapart
@@ -252,6 +258,8 @@ class InsertAndSetFIFODepths(Transformation):
         self.swg_exception = swg_exception
         self.vivado_ram_style = vivado_ram_style
         self.force_python_sim = force_python_sim
+        self.input_traffic = input_traffic
+        self.output_traffic = output_traffic
 
     def apply(self, model):
         # these optypes may potentially use external weights
@@ -382,7 +390,12 @@ class InsertAndSetFIFODepths(Transformation):
                 # convnet, two inputs are typically enough to fill entire
                 # layer pipeline due to overlaps
                 n_inputs = 2
-            sim = verilator_fifosim(model, n_inputs)
+            sim = verilator_fifosim(
+                model,
+                n_inputs,
+                input_traffic=self.input_traffic,
+                output_traffic=self.output_traffic,
+            )
 
         for ind, node in enumerate(fifo_nodes):
             maxcount_name = "maxcount_%d" % ind
@@ -58,11 +58,11 @@ pynq_driver_template = """
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import argparse
+import json
 import numpy as np
 import os
 from qonnx.core.datatype import DataType
 from driver_base import FINNExampleOverlay
-from pynq.pl_server.device import Device
 
 # dictionary describing the I/O of the FINN-generated accelerator
 io_shape_dict = {
@@ -96,6 +96,10 @@ if __name__ == "__main__":
     parser.add_argument('--inputfile', help='name(s) of input npy file(s) (i.e. "input.npy")', nargs="*", type=str, default=["input.npy"])
     parser.add_argument('--outputfile', help='name(s) of output npy file(s) (i.e. "output.npy")', nargs="*", type=str, default=["output.npy"])
     parser.add_argument('--runtime_weight_dir', help='path to folder containing runtime-writable .dat weights', default="runtime_weights/")
+    parser.add_argument('--num_threads', help='number of threads for packing and unpacking large batches', type=int, default=1)
+    parser.add_argument('--warmup', help='number of untimed warmup runs for throughput test', type=int, default=0)
+    parser.add_argument('--repetitions', help='number of timed runs for throughput test', type=int, default=1)
+    parser.add_argument('--sweep_batchsizes', help='batch sizes to sweep in throughput test', nargs="*", type=int, default=[])
     # parse arguments
     args = parser.parse_args()
     exec_mode = args.exec_mode
@@ -106,13 +110,19 @@ if __name__ == "__main__":
     outputfile = args.outputfile
     runtime_weight_dir = args.runtime_weight_dir
     devID = args.device
-    device = Device.devices[devID]
+    if os.environ.get("FINN_DRIVER_EMULATION", "0") == "1":
+        # emulated accelerator, see driver_emulation.py
+        device = None
+    else:
+        from pynq.pl_server.device import Device
+        device = Device.devices[devID]
 
     # instantiate FINN accelerator driver and pass batchsize and bitfile
     accel = FINNExampleOverlay(
         bitfile_name = bitfile, platform = platform,
         io_shape_dict = io_shape_dict, batch_size = batch_size,
-        runtime_weight_dir = runtime_weight_dir, device=device
+        runtime_weight_dir = runtime_weight_dir, device=device,
+        num_threads = args.num_threads
     )
 
     # for the remote execution the data from the input npy file has to be loaded,
@@ -129,15 +139,22 @@ if __name__ == "__main__":
             np.save(outputfile[o], obuf)
     elif exec_mode == "throughput_test":
         # remove old metrics file
-        try:
-            os.remove("nw_metrics.txt")
-        except FileNotFoundError:
-            pass
-        res = accel.throughput_test()
+        for metrics_file in ["nw_metrics.txt", "nw_metrics.json"]:
+            try:
+                os.remove(metrics_file)
+            except FileNotFoundError:
+                pass
+        res = accel.throughput_test(warmup=args.warmup, repetitions=args.repetitions)
         file = open("nw_metrics.txt", "w")
         file.write(str(res))
         file.close()
-        print("Results written to nw_metrics.txt")
+        if len(args.sweep_batchsizes) > 0:
+            res["batch_size_sweep"] = accel.throughput_sweep(
+                args.sweep_batchsizes, warmup=args.warmup, repetitions=args.repetitions
+            )
+        with open("nw_metrics.json", "w") as f:
+            json.dump(res, f, indent=2, default=float)
+        print("Results written to nw_metrics.txt and nw_metrics.json")
     else:
         raise Exception("Exec mode has to be set to execute or throughput_test")
 """
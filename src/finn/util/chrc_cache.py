@@ -0,0 +1,215 @@
+# Copyright (c) 2023, Xilinx
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of FINN nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import hashlib
+import json
+import numpy as np
+import os
+import re
+import tempfile
+
+# On-disk cache of the characteristic functions derived by
+# HLSCustomOp.derive_characteristic_fxns, so that identical layers are not
+# simulated again across builds. An entry is keyed by the op type and the
+# hardware-relevant node attributes (everything but the build products,
+# estimates and placement info listed in CHRC_CACHE_IGNORED_ATTRS) together
+# with the characterization period, the FPGA part and clock period the node's
+# HLS IP was generated for and the HLS installation (HLS_PATH, which includes
+# the tool version). The cache directory is set by the FINN_CHRC_CACHE_DIR
+# environment variable and bounded in size by FINN_CHRC_CACHE_SIZE_MB,
+# evicting the least recently used entries.
+
+# node attributes which do not influence the characteristic functions
+CHRC_CACHE_IGNORED_ATTRS = {
+    "code_gen_dir_cppsim",
+    "code_gen_dir_ipgen",
+    "executable_path",
+    "ipgen_path",
+    "ip_path",
+    "ip_vlnv",
+    "exec_mode",
+    "cycles_rtlsim",
+    "cycles_rtlsim_batch",
+    "cycles_estimate",
+    "rtlsim_trace",
+    "res_estimate",
+    "res_hls",
+    "res_synth",
+    "rtlsim_so",
+    "slr",
+    "mem_port",
+    "partition_id",
+    "device_id",
+    "inFIFODepths",
+    "outFIFODepths",
+    "output_hook",
+    "io_chrc_in",
+    "io_chrc_out",
+    "io_chrc_period",
+    "io_chrc_pads_in",
+    "io_chrc_pads_out",
+}
+
+# node attributes stored in a cache entry
+CHRC_CACHE_STORED_ATTRS = [
+    "io_chrc_in",
+    "io_chrc_out",
+    "io_chrc_period",
+    "io_chrc_pads_in",
+    "io_chrc_pads_out",
+]
+
+
+def get_chrc_cache_dir():
+    """Return the directory of the characteristic function cache, as set by
+    the FINN_CHRC_CACHE_DIR environment variable. If the env.var. is
+    undefined, a directory under FINN_BUILD_DIR is used."""
+
+    default_dir = os.path.join(os.getenv("FINN_BUILD_DIR", tempfile.gettempdir()), "chrc_cache")
+    return os.getenv("FINN_CHRC_CACHE_DIR", default_dir)
+
+
+def get_chrc_cache_size_mb():
+    """Return the maximum size of the characteristic function cache in MB, as
+    set by the FINN_CHRC_CACHE_SIZE_MB environment variable (default 256). A
+    size of 0 disables the cache."""
+
+    return int(os.getenv("FINN_CHRC_CACHE_SIZE_MB", 256))
+
+
+def get_hls_ipgen_config(inst):
+    """Return the FPGA part and clock period the HLS IP of the given
+    HLSCustomOp instance was generated for, as read from the HLS synthesis
+    script in its code_gen_dir_ipgen. Values that are unavailable, e.g. if no
+    IP was generated yet, are returned as empty strings."""
+
+    fpgapart = ""
+    clk = ""
+    code_gen_dir = inst.get_nodeattr("code_gen_dir_ipgen")
+    tcl_fname = os.path.join(code_gen_dir, "hls_syn_%s.tcl" % inst.onnx_node.name)
+    if code_gen_dir != "" and os.path.isfile(tcl_fname):
+        with open(tcl_fname, "r") as f:
+            tcl = f.read()
+        m = re.search(r'^set config_proj_part "(.*)"$', tcl, re.MULTILINE)
+        if m is not None:
+            fpgapart = m.group(1)
+        m = re.search(r"^set config_clkperiod (\S+)$", tcl, re.MULTILINE)
+        if m is not None:
+            clk = m.group(1)
+    return (fpgapart, clk)
+
+
+def chrc_cache_key(inst, period):
+    """Return the cache key for the characteristic functions of the given
+    HLSCustomOp instance over the given period, a hash of its op type and
+    hardware-relevant node attributes (including the defaults of unset
+    ones) in a canonical form, the FPGA part and clock period of its HLS IP
+    and the HLS installation."""
+
+    attrs = {}
+    for attr_name in inst.get_nodeattr_types().keys():
+        if attr_name in CHRC_CACHE_IGNORED_ATTRS:
+            continue
+        value = inst.get_nodeattr(attr_name)
+        if isinstance(value, np.ndarray):
+            value = value.tolist()
+        attrs[attr_name] = value
+    desc = {
+        "domain": inst.onnx_node.domain,
+        "op_type": inst.onnx_node.op_type,
+        "period": int(period),
+        "attrs": attrs,
+        "hls_ipgen": get_hls_ipgen_config(inst),
+        "hls_path": os.getenv("HLS_PATH", ""),
+    }
+    desc = json.dumps(desc, sort_keys=True, default=str)
+    return hashlib.sha256(desc.encode()).hexdigest()
+
+
+def get_cached_chrc(key):
+    """Return the dict of characteristic function node attributes cached
+    under the given key, or None if the key is not cached."""
+
+    if get_chrc_cache_size_mb() <= 0:
+        return None
+    entry_fname = os.path.join(get_chrc_cache_dir(), key + ".json")
+    try:
+        with open(entry_fname, "r") as f:
+            ret = json.load(f)
+        # mark as recently used for eviction
+        os.utime(entry_fname)
+    except (OSError, ValueError):
+        # not cached, evicted meanwhile or incomplete
+        return None
+    return ret
+
+
+def store_chrc(key, chrc_attrs):
+    """Store the given dict of characteristic function node attributes in the
+    cache under the given key, then evict the least recently used entries
+    until the cache fits into its size limit."""
+
+    max_size = get_chrc_cache_size_mb() * 2**20
+    if max_size <= 0:
+        return
+    cache_dir = get_chrc_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    # write a temporary file and rename it, so that an entry is either
+    # complete or absent for concurrent builds
+    (tmp_fd, tmp_fname) = tempfile.mkstemp(prefix=".tmp_", dir=cache_dir)
+    with os.fdopen(tmp_fd, "w") as f:
+        json.dump(chrc_attrs, f)
+    os.replace(tmp_fname, os.path.join(cache_dir, key + ".json"))
+    evict_chrc_cache(max_size)
+
+
+def evict_chrc_cache(max_size):
+    """Remove the least recently used entries of the characteristic function
+    cache until its total size is at most max_size bytes."""
+
+    cache_dir = get_chrc_cache_dir()
+    entries = []
+    total_size = 0
+    for fname in os.listdir(cache_dir):
+        if fname.startswith(".") or not fname.endswith(".json"):
+            continue
+        entry_fname = os.path.join(cache_dir, fname)
+        try:
+            stat = os.stat(entry_fname)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry_fname))
+        total_size += stat.st_size
+    for mtime, size, entry_fname in sorted(entries):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(entry_fname)
+        except OSError:
+            pass
+        total_size -= size
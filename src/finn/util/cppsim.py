@@ -0,0 +1,170 @@
+# Copyright (c) 2023, Xilinx
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of FINN nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import atexit
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+# Persistent cppsim worker processes. The generated cppsim executables accept
+# a --worker argument, in which case they execute the node for a batch of n
+# samples on every "run <n>" line on stdin and answer each with a "done"
+# line. The .npy files for the inputs and outputs of sample i are then
+# exchanged through the subdirectory i of the directory given by the
+# FINN_CPPSIM_IO_DIR environment variable of the worker, which is placed in
+# shared memory (/dev/shm) if available. This avoids launching a process and
+# going through the disk for every execution of a node. Static parameter
+# files such as weights.npy are still read from the code generation dir.
+
+# live workers by executable path
+_workers = {}
+
+
+def cppsim_use_workers():
+    """Return whether cppsim nodes are executed by persistent worker processes,
+    as set by the FINN_CPPSIM_WORKERS environment variable. If the env.var. is
+    undefined, the executables are launched once per execution."""
+
+    return int(os.getenv("FINN_CPPSIM_WORKERS", 0)) != 0
+
+
+def redirect_npy_paths(code, code_gen_dir):
+    """Replaces the paths of the input_*.npy and output*.npy files in
+    code_gen_dir in the given generated C++ code by calls to npy_io_path, so
+    that workers read and write them in the I/O directory of the sample
+    instead. Paths of other .npy files, e.g. weights.npy, are left unchanged."""
+
+    pattern = '"%s/((input_[0-9]+|output[^"/]*)\\.npy)"' % re.escape(code_gen_dir)
+    replacement = 'npy_io_path("%s", "\\1").c_str()' % code_gen_dir.replace("\\", "\\\\")
+    return re.sub(pattern, replacement, code)
+
+
+def cppsim_supports_workers(code_gen_dir):
+    """Return whether the cppsim code in code_gen_dir was generated with
+    worker support (see redirect_npy_paths), i.e. whether the executable can
+    be run as a worker process."""
+
+    for fname in os.listdir(code_gen_dir):
+        if fname.startswith("execute_") and fname.endswith(".cpp"):
+            with open(os.path.join(code_gen_dir, fname), "r") as f:
+                return "npy_io_dir()" in f.read()
+    return False
+
+
+class CppSimWorker:
+    """A cppsim executable running as a persistent worker process."""
+
+    def __init__(self, executable_path):
+        self.executable_path = executable_path
+        self.mtime = os.path.getmtime(executable_path)
+        shm_dir = "/dev/shm" if os.access("/dev/shm", os.W_OK) else None
+        self.io_dir = tempfile.mkdtemp(prefix="cppsim_io_", dir=shm_dir)
+        proc_env = os.environ.copy()
+        proc_env["FINN_CPPSIM_IO_DIR"] = self.io_dir
+        self.proc = subprocess.Popen(
+            [executable_path, "--worker"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=proc_env,
+            universal_newlines=True,
+            bufsize=1,
+        )
+
+    def is_current(self):
+        """Return whether the worker is still running and its executable has
+        not been rebuilt since it was started."""
+        if self.proc.poll() is not None:
+            return False
+        try:
+            return os.path.getmtime(self.executable_path) == self.mtime
+        except OSError:
+            return False
+
+    def get_sample_io_dir(self, sample=0):
+        """Return the directory in io_dir that the .npy files of the given
+        sample of a batch are exchanged through."""
+        sample_io_dir = os.path.join(self.io_dir, str(sample))
+        os.makedirs(sample_io_dir, exist_ok=True)
+        return sample_io_dir
+
+    def run(self, n_samples=1):
+        """Executes the node on the .npy inputs of n_samples samples in their
+        sample I/O directories and returns once all outputs have been written
+        there."""
+        try:
+            self.proc.stdin.write("run %d\n" % n_samples)
+            self.proc.stdin.flush()
+        except BrokenPipeError:
+            pass
+        else:
+            # anything else the executable prints is discarded, like in
+            # exec_precompiled_singlenode_model
+            for line in self.proc.stdout:
+                if line.strip() == "done":
+                    return
+        returncode = self.proc.wait()
+        raise Exception("cppsim worker %s exited with code %d" % (self.executable_path, returncode))
+
+    def close(self):
+        """Stops the worker process and removes its I/O directory."""
+        if self.proc.poll() is None:
+            try:
+                self.proc.stdin.close()
+                self.proc.wait(timeout=5)
+            except (BrokenPipeError, subprocess.TimeoutExpired):
+                self.proc.kill()
+                self.proc.wait()
+        self.proc.stdout.close()
+        shutil.rmtree(self.io_dir, ignore_errors=True)
+
+
+def get_cppsim_worker(executable_path):
+    """Return the worker for the given cppsim executable, (re)starting it if
+    it is not running or the executable has been rebuilt."""
+
+    worker = _workers.get(executable_path)
+    if worker is not None and not worker.is_current():
+        worker.close()
+        worker = None
+    if worker is None:
+        worker = CppSimWorker(executable_path)
+        _workers[executable_path] = worker
+    return worker
+
+
+def close_cppsim_workers():
+    """Stops all running cppsim workers."""
+
+    for worker in _workers.values():
+        worker.close()
+    _workers.clear()
+
+
+atexit.register(close_cppsim_workers)
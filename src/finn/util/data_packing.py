@@ -27,9 +27,10 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import binascii
+import io
+import math
 import numpy as np
 import os
-import sys
 from bitstring import BitArray
 from qonnx.core.datatype import DataType
 from qonnx.util.basic import roundup_to_integer_multiple
@@ -189,8 +190,7 @@ def unpack_innermost_dim_from_hex_string(
         conv_dtype = dtype
     for outer_elem in range(outer_dim_elems):
         ar_list = []
-        ar_elem = data[0]
-        data.pop(0)
+        ar_elem = data[outer_elem]
         ar_elem = ar_elem.split("x")
         ar_elem_bin = bin(int(ar_elem[1], 16))[2:].zfill(packedBits)
         ar_elem_bin = [int(x) for x in ar_elem_bin]
@@ -236,7 +236,51 @@ def numpy_to_hls_code(ndarray, dtype, hls_var_name, pack_innermost_dim=True, no_
     pack_innermost_dim is specified, the innermost dimension of the ndarray
     will be packed into a hex string using array2hexstring. If no_decl is
     set to True, no variable name and type will be generated as part of the
-    emitted string.
+    emitted string. See write_numpy_to_hls_code for writing the code
+    directly into a file.
+    """
+    ret = io.StringIO()
+    write_numpy_to_hls_code(ret, ndarray, dtype, hls_var_name, pack_innermost_dim, no_decl)
+    return ret.getvalue()
+
+
+# number of array elements to format at once when writing text files
+_WRITE_CHUNK_ELEMS = 1 << 16
+
+_HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+
+
+def _pack_innermost_dim_as_hex_digits(ndarray, dtype, pad_to_nbits):
+    """Pack the innermost dimension of a two-dimensional ndarray like
+    pack_innermost_dim_as_hex_string without prefix, but return the lowercase
+    hex digits as a uint8 ndarray of ASCII characters with pad_to_nbits // 4
+    columns, one row per packed word."""
+    n_digits = pad_to_nbits // 4
+    if dtype.bitwidth() > 64:
+        # too wide for the vectorized path, go through hex strings
+        digits = pack_innermost_dim_as_hex_string(ndarray, dtype, pad_to_nbits, prefix="")
+        digits = digits.astype("S%d" % n_digits).view(np.uint8)
+        return digits.reshape(len(ndarray), n_digits)
+    packed = _pack_uint_innermost_dim(
+        _finnpy_to_uint(ndarray, dtype),
+        dtype.bitwidth(),
+        roundup_to_integer_multiple(pad_to_nbits, 8),
+    )
+    digits = np.empty(packed.shape + (2,), dtype=np.uint8)
+    digits[..., 0] = _HEX_DIGITS[packed >> 4]
+    digits[..., 1] = _HEX_DIGITS[packed & 0xF]
+    return digits.reshape(len(ndarray), -1)[:, digits.shape[-2] * 2 - n_digits :]
+
+
+def write_numpy_to_hls_code(
+    f, ndarray, dtype, hls_var_name, pack_innermost_dim=True, no_decl=False
+):
+    """Write the C++ code representation of a numpy ndarray with FINN DataType
+    dtype into the file-like object f. The emitted text is identical to what
+    numpy_to_hls_code returns, i.e. laid out the same way as np.array2string
+    with the current linewidth print option, but elements are formatted with
+    vectorized NumPy operations and written out in chunks, so that the peak
+    memory usage does not depend on the size of ndarray.
     """
     hls_dtype = dtype.get_hls_datatype_str()
     if type(ndarray) != np.ndarray or ndarray.dtype != np.float32:
@@ -246,39 +290,229 @@ def numpy_to_hls_code(ndarray, dtype, hls_var_name, pack_innermost_dim=True, no_
         idimlen = ndarray.shape[-1]
         idimbits = idimlen * dtype.bitwidth()
         idimbits = roundup_to_integer_multiple(idimbits, 4)
-        ndarray = pack_innermost_dim_as_hex_string(ndarray, dtype, idimbits)
         hls_dtype = "ap_uint<%d>" % idimbits
-    ndims = ndarray.ndim
-    # add type string and variable name
-    # e.g. "const ap_uint<64>" "weightMem0"
-    ret = "%s %s" % (hls_dtype, hls_var_name)
-    # add dimensions
-    for d in range(ndims):
-        ret += "[%d]" % ndarray.shape[d]
-    orig_printops = np.get_printoptions()
-    np.set_printoptions(threshold=sys.maxsize)
-
-    # define a function to convert a single element into a C++ init string
-    # a single element can be a hex string if we are using packing
-    def elem2str(x):
-        if type(x) == str or type(x) == np.str_:
-            return '%s("%s", 16)' % (hls_dtype, x)
-        elif type(x) == np.float32:
+        # each element is a hex string packing one innermost row of ndarray
+        shape = ndarray.shape[:-1]
+        rows = ndarray.reshape(-1, shape[-1] if len(shape) > 0 else 1, idimlen)
+        word_prefix = np.frombuffer(('%s("0x' % hls_dtype).encode(), dtype=np.uint8)
+        word_suffix = np.frombuffer(b'", 16)', dtype=np.uint8)
+        n_digits = idimbits // 4
+        word_len = len(word_prefix) + n_digits + len(word_suffix)
+
+        def get_words(row, start, stop):
+            elems = rows[row, start:stop]
+            digits = _pack_innermost_dim_as_hex_digits(elems, dtype, idimbits)
+            words = np.empty((len(elems), word_len), dtype=np.uint8)
+            words[:, : len(word_prefix)] = word_prefix
+            words[:, len(word_prefix) : len(word_prefix) + n_digits] = digits
+            words[:, len(word_prefix) + n_digits :] = word_suffix
+            return words
+
+    else:
+        shape = ndarray.shape
+        rows = ndarray.reshape(-1, shape[-1] if len(shape) > 0 else 1)
+
+        def get_words(row_start, row_stop):
+            elems = rows[row_start:row_stop]
+            # match str(int(x)) / str(x) on each np.float32 element
             if dtype.is_integer():
-                return str(int(x))
+                if np.isfinite(elems).all() and (np.abs(elems) < 2**62).all():
+                    return elems.astype(np.int64).astype(str).tolist()
+                return [[str(int(x)) for x in row] for row in elems]
             else:
-                return str(x)
+                return elems.astype(str).tolist()
+
+    if not no_decl:
+        # add type string, variable name and dimensions
+        # e.g. "const ap_uint<64>" "weightMem0" "[2][4]"
+        dims = "".join(["[%d]" % d for d in shape])
+        f.write("%s %s%s = \n" % (hls_dtype, hls_var_name, dims))
+    ndims = len(shape)
+    # numpy.core.arrayprint._formatArray: the innermost rows are wrapped
+    # before width, with a hanging indent of one space per dimension
+    indent = ndims
+    width = np.get_printoptions()["linewidth"] - ndims
+    if rows.size == 0:
+        f.write("{}")
+    elif ndims == 0:
+        if pack_innermost_dim:
+            f.write(get_words(0, 0, 1).tobytes().decode("ascii"))
         else:
-            raise Exception("Unsupported type for numpy_to_hls_code")
+            f.write(get_words(0, 1)[0][0])
+    elif pack_innermost_dim:
+        # all packed elements have the same length, write each row in chunks
+        per_line = 1 + max(0, (width - indent - word_len) // (word_len + 2))
+        chunk_elems = per_line * max(1, _WRITE_CHUNK_ELEMS // per_line)
+
+        def write_row(row):
+            _write_hls_uniform_row(
+                f,
+                lambda start, stop: get_words(row, start, stop),
+                shape[-1],
+                word_len,
+                per_line,
+                indent,
+                chunk_elems,
+            )
+
+        _write_hls_array(f, shape, write_row, rows.shape[0])
+    else:
+        chunk_rows = max(1, _WRITE_CHUNK_ELEMS // shape[-1])
+        row_words = []
+
+        def write_row(row):
+            # format a chunk of rows at a time
+            if row % chunk_rows == 0:
+                row_words[:] = get_words(row, row + chunk_rows)
+            _write_hls_ragged_row(f, row_words[row % chunk_rows], indent, width)
+
+        _write_hls_array(f, shape, write_row, rows.shape[0])
+    f.write(";")
+
+
+def _write_hls_array(f, shape, write_row, n_rows):
+    """Write the brackets and separators of a numpy_to_hls_code array with
+    given shape into f, calling write_row with the flattened index of each
+    innermost row, in order."""
+    ndims = len(shape)
+    # iterate over all rows, tracking the outer index as a counter
+    outer_index = [0] * (ndims - 1)
+    f.write("{" * (ndims - 1))
+    for row_index in range(n_rows):
+        if row_index > 0:
+            # find the outermost dimension whose index changed
+            axis = ndims - 2
+            outer_index[axis] += 1
+            while outer_index[axis] == shape[axis]:
+                outer_index[axis] = 0
+                axis -= 1
+                outer_index[axis] += 1
+            # close and reopen the subarrays below that dimension
+            n_nested = ndims - 2 - axis
+            f.write("}" * n_nested + "," + "\n" * (n_nested + 1) + " " * (axis + 1))
+            f.write("{" * n_nested)
+        write_row(row_index)
+    f.write("}" * (ndims - 1))
+
+
+def _write_hls_uniform_row(f, get_words, n_words, word_len, per_line, indent, chunk_words):
+    """Write one innermost row of equal-length words into f, with per_line
+    words per line. get_words(start, stop) must return the words of the
+    given range as a uint8 ndarray of ASCII characters, one word per row."""
+    line_end = np.frombuffer(b",\n" + b" " * indent, dtype=np.uint8)
+    line_len = per_line * (word_len + 2) - 2
+    f.write("{")
+    for start in range(0, n_words, chunk_words):
+        stop = min(n_words, start + chunk_words)
+        n_chunk_words = stop - start
+        n_lines = -(-n_chunk_words // per_line)
+        # lay out words with ", " separators into full lines, the unused
+        # slots of a partial last line are cut off below
+        text = np.zeros((n_lines * per_line, word_len + 2), dtype=np.uint8)
+        text[:n_chunk_words, :word_len] = get_words(start, stop)
+        text[:, word_len:] = np.frombuffer(b", ", dtype=np.uint8)
+        lines = np.empty((n_lines, line_len + len(line_end)), dtype=np.uint8)
+        lines[:, :line_len] = text.reshape(n_lines, -1)[:, :line_len]
+        lines[:, line_len:] = line_end
+        lines = lines.reshape(-1)
+        if stop == n_words:
+            # no line break after the last word of the row
+            n_unused = n_lines * per_line - n_chunk_words
+            lines = lines[: len(lines) - n_unused * (word_len + 2) - len(line_end)]
+        f.write(lines.tobytes().decode("ascii"))
+    f.write("}")
+
+
+def _write_hls_ragged_row(f, words, indent, width):
+    """Write one innermost row of words (a list of strings) into f, breaking
+    lines before a word would exceed width."""
+    line_len = indent
+    parts = ["{"]
+    for i, word in enumerate(words):
+        if i > 0:
+            line_len += 2
+            if line_len + len(word) > width:
+                parts.append(",\n" + " " * indent)
+                line_len = indent
+            else:
+                parts.append(", ")
+        parts.append(word)
+        line_len += len(word)
+    parts.append("}")
+    f.write("".join(parts))
+
 
-    strarr = np.array2string(ndarray, separator=", ", formatter={"all": elem2str})
-    np.set_printoptions(**orig_printops)
-    strarr = strarr.replace("[", "{").replace("]", "}")
-    if no_decl:
-        ret = strarr + ";"
+def _weight_stream_hex_lines(ndarray, dtype, weight_width, weight_file_mode):
+    """Generator for the lines of a decoupled weight stream as in
+    write_weight_stream, yielding chunks of lines as uint8 matrices of ASCII
+    hex digits (without line breaks)."""
+    if type(ndarray) != np.ndarray or ndarray.dtype != np.float32:
+        # try to convert to a float numpy array (container dtype is float)
+        ndarray = np.asarray(ndarray, dtype=np.float32)
+    if weight_file_mode == "decoupled_verilog_dat":
+        # pad to nearest 4 bits to get hex strings
+        weight_width_padded = roundup_to_integer_multiple(weight_width, 4)
+        digits_per_line = weight_width_padded // 4
+    elif weight_file_mode == "decoupled_runtime":
+        # memstream axi-lite interface will map each mem line to
+        # one or multiple 32-bit words
+        words_per_memwidth = 2 ** math.ceil(math.log2(weight_width / 32))
+        if words_per_memwidth < 1:
+            words_per_memwidth = 1
+        weight_width_padded = words_per_memwidth * 32
+        digits_per_line = 8
     else:
-        ret = ret + " = \n" + strarr + ";"
-    return ret
+        raise Exception("Unknown weight_file_mode")
+    rows = ndarray.reshape(-1, ndarray.shape[-1])
+    chunk_rows = max(1, _WRITE_CHUNK_ELEMS // rows.shape[-1])
+    for start in range(0, rows.shape[0], chunk_rows):
+        digits = _pack_innermost_dim_as_hex_digits(
+            rows[start : start + chunk_rows], dtype, weight_width_padded
+        )
+        # split into lines, least significant 32-bit word first for runtime
+        digits = digits.reshape(len(digits), -1, digits_per_line)
+        if weight_file_mode == "decoupled_runtime":
+            digits = np.flip(digits, axis=1)
+        yield digits.reshape(-1, digits_per_line)
+
+
+def write_weight_stream(f, ndarray, dtype, weight_width, weight_file_mode):
+    """Write a decoupled weight stream into the file-like object f. Each
+    innermost row of ndarray with FINN DataType dtype is packed into one
+    weight_width-bit stream word, and the words are written in order, in the
+    format given by weight_file_mode:
+
+    * decoupled_verilog_dat : one hex word per line, padded to the nearest
+      4 bits, as used for initializing memstream memories with $readmemh
+    * decoupled_runtime : each word padded to a power-of-two number of 32-bit
+      words, which are written least significant first with one 32-bit hex word
+      per line, matching how the memstream AXI-lite interface maps memory lines
+
+    Packing and formatting are vectorized and done in chunks of rows.
+    """
+    for digits in _weight_stream_hex_lines(ndarray, dtype, weight_width, weight_file_mode):
+        lines = np.empty((len(digits), digits.shape[1] + 1), dtype=np.uint8)
+        lines[:, :-1] = digits
+        lines[:, -1] = ord("\n")
+        f.write(lines.tobytes().decode("ascii"))
+
+
+def pack_runtime_weight_words(ndarray, dtype, weight_width):
+    """Return the decoupled_runtime weight stream of write_weight_stream as a
+    uint32 ndarray with one element per line, i.e. the 32-bit words in the
+    order they are written into the memstream AXI-lite address space. Used
+    for the binary runtime weight files loaded by the PYNQ driver."""
+    # value of each ASCII hex digit
+    hex_values = np.zeros(256, dtype=np.uint32)
+    hex_values[_HEX_DIGITS] = np.arange(16, dtype=np.uint32)
+    shifts = np.arange(28, -1, -4, dtype=np.uint32)
+    words = [
+        np.bitwise_or.reduce(hex_values[digits] << shifts, axis=-1)
+        for digits in _weight_stream_hex_lines(ndarray, dtype, weight_width, "decoupled_runtime")
+    ]
+    if len(words) == 0:
+        return np.zeros(0, dtype=np.uint32)
+    return np.concatenate(words).astype(np.uint32)
 
 
 def npy_to_rtlsim_input(input_file, input_dtype, pad_to_nbits, reverse_inner=True):
@@ -298,12 +532,18 @@ def npy_to_rtlsim_input(input_file, input_dtype, pad_to_nbits, reverse_inner=Tru
     if inp.shape[-1] == 1 and input_dtype.is_integer():
         packed_data = inp.flatten().astype(input_dtype.to_numpy_dt())
         packed_data = [int(x) for x in packed_data]
-    else:
+    elif input_dtype.bitwidth() > 64:
+        # too wide for the vectorized path, go through hex strings
         packed_data = pack_innermost_dim_as_hex_string(
             inp, input_dtype, pad_to_nbits, reverse_inner=reverse_inner
         )
         packed_data = packed_data.flatten()
         packed_data = [int(x[2:], 16) for x in packed_data]
+    else:
+        packed_data = pack_innermost_dim_as_limbs(
+            inp, input_dtype, pad_to_nbits, reverse_inner=reverse_inner
+        )
+        packed_data = limbs_to_ints(packed_data)
     return packed_data
 
 
@@ -315,10 +555,19 @@ def rtlsim_output_to_npy(output, path, dtype, shape, packedBits, targetBits, rev
     not None it will also be saved as a npy file."""
 
     # TODO should have its own testbench?
-    output = np.asarray([hex(int(x)) for x in output])
-    out_array = unpack_innermost_dim_from_hex_string(
-        output, dtype, shape, packedBits=packedBits, reverse_inner=reverse_inner
-    )
+    if dtype.bitwidth() > 64:
+        # too wide for the vectorized path, go through hex strings
+        output = np.asarray([hex(int(x)) for x in output])
+        out_array = unpack_innermost_dim_from_hex_string(
+            output, dtype, shape, packedBits=packedBits, reverse_inner=reverse_inner
+        )
+    else:
+        n_outer = int(np.prod(shape[:-1]))
+        n_limbs = max(1, roundup_to_integer_multiple(packedBits, 64) // 64)
+        output = ints_to_limbs(output[:n_outer], n_limbs)
+        out_array = unpack_innermost_dim_from_limbs(
+            output, dtype, shape, reverse_inner=reverse_inner
+        )
     # make copy before saving the array
     out_array = out_array.copy()
     if path is not None:
@@ -326,8 +575,278 @@ def rtlsim_output_to_npy(output, path, dtype, shape, packedBits, targetBits, rev
     return out_array
 
 
+def _packing_container_bits(bitwidth):
+    """Return the width of the smallest NumPy unsigned integer type that can
+    hold a single element of given bitwidth."""
+    for container_bits in [8, 16, 32, 64]:
+        if bitwidth <= container_bits:
+            return container_bits
+    raise Exception("No NumPy container type for %d-bit elements" % bitwidth)
+
+
+def _finnpy_to_uint(ndarray, dtype):
+    """Convert a NumPy array of values of FINN DataType dtype (stored as floats)
+    into a uint64 array holding the bit pattern of each element, as
+    array2hexstring would pack it: two's complement for signed integers, the
+    unscaled integer for fixed point, 0 for -1 in BIPOLAR and the IEEE 754
+    encoding for FLOAT32."""
+    bw = dtype.bitwidth()
+    mask = np.uint64((1 << bw) - 1)
+    is_int_container = issubclass(type(ndarray), np.ndarray) and ndarray.dtype.kind in "iu"
+    if is_int_container and dtype.is_integer() and dtype != DataType["BIPOLAR"] and bw <= 24:
+        # skip the float conversion for integer containers, the float32
+        # round trip is exact for integers of up to 24 bits anyway
+        if ndarray.size > 0:
+            allowed = ndarray.min() >= dtype.min() and ndarray.max() <= dtype.max()
+            assert allowed, "This value is not permitted by chosen dtype."
+        return ndarray.astype(np.uint64) & mask
+    ndarray = np.asarray(ndarray, dtype=np.float32)
+    if dtype == DataType["BIPOLAR"]:
+        # convert bipolar values to binary
+        ndarray = (ndarray + 1) / 2
+        dtype = DataType["BINARY"]
+    elif dtype.is_fixed_point():
+        # rescale, then pack as integers
+        ndarray = ndarray / dtype.scale_factor()
+        dtype = DataType["INT" + str(bw)]
+    if not dtype.is_integer():
+        assert bw == 32, "Only 32-bit floats are supported for packing."
+        return ndarray.view(np.uint32).astype(np.uint64)
+    # ensure that all values are permitted by chosen dtype
+    as_float64 = ndarray.astype(np.float64)
+    allowed = (as_float64 >= dtype.min()) & (as_float64 <= dtype.max())
+    allowed &= as_float64 == np.floor(as_float64)
+    assert allowed.all(), "This value is not permitted by chosen dtype."
+    # negative values wrap around to their two's complement representation
+    ret = ndarray.astype(np.int64).astype(np.uint64)
+    return ret & mask
+
+
+def _uint_to_finnpy(uint_array, dtype, out=None):
+    """Inverse of _finnpy_to_uint: interpret a uint64 array of bit patterns as
+    values of FINN DataType dtype and return them as a float32 array, which is
+    written into out if specified."""
+    bw = dtype.bitwidth()
+    if dtype.is_fixed_point():
+        # convert fixed point as signed integer
+        conv_dtype = DataType["INT" + str(bw)]
+    else:
+        conv_dtype = dtype
+    if conv_dtype == DataType["FLOAT32"]:
+        ret = uint_array.astype(np.uint32).view(np.float32)
+    elif conv_dtype.is_integer():
+        if conv_dtype == DataType["BIPOLAR"]:
+            ret = 2 * uint_array.astype(np.int64) - 1
+        elif conv_dtype.signed():
+            # sign-extend, relying on modulo 2^64 arithmetic for the wide types
+            sign_bit = uint_array & np.uint64(1 << (bw - 1))
+            ret = (uint_array - (sign_bit << np.uint64(1))).view(np.int64)
+        else:
+            ret = uint_array
+    else:
+        raise Exception("Not implemented for conv_dtype " + conv_dtype.name)
+    if dtype.is_fixed_point():
+        # convert signed integer to fixed point by applying scale
+        ret = ret.astype(np.float32) * dtype.scale_factor()
+    elif out is None:
+        ret = ret.astype(np.float32)
+    if out is None:
+        return ret
+    np.copyto(out, ret.reshape(out.shape), casting="unsafe")
+    return out
+
+
+def _rows_view(ndarray):
+    """Return a 2D view of ndarray with all outer dimensions flattened into
+    rows, or None if this is not possible without copying."""
+    rows = ndarray.view()
+    try:
+        rows.shape = (-1, ndarray.shape[-1])
+    except AttributeError:
+        return None
+    return rows
+
+
+# number of elements (un)packed at a time when writing into a preallocated
+# out array, which bounds the size of the temporary arrays
+_OUT_BLOCK_ELEMS = 1 << 14
+
+
+def _row_blocks(n_rows, row_elems):
+    """Yield the slices of n_rows rows of row_elems elements each that are
+    (un)packed at a time when writing into a preallocated out array."""
+    block_rows = max(1, _OUT_BLOCK_ELEMS // max(1, row_elems))
+    for start in range(0, n_rows, block_rows):
+        yield slice(start, min(start + block_rows, n_rows))
+
+
+def _pack_uint_innermost_dim(uint_array, bitwidth, pad_to_nbits, out=None):
+    """Pack the innermost dimension of a uint64 array of bitwidth-bit elements
+    into big-endian bytes, with the first element in the most significant
+    position and zero padding prepended up to pad_to_nbits, which must be a
+    multiple of 8. Returns an ndarray of uint8 whose innermost dimension has
+    pad_to_nbits // 8 elements, which is written into out if specified."""
+    assert pad_to_nbits % 8 == 0, "pad_to_nbits must be a multiple of 8"
+    outer_shape = uint_array.shape[:-1]
+    n_elems = uint_array.shape[-1]
+    n_bits = n_elems * bitwidth
+    if n_bits > pad_to_nbits:
+        raise Exception("Number of bits is greater than pad_to_nbits")
+    container_bits = _packing_container_bits(bitwidth)
+    container_bytes = container_bits // 8
+    out_shape = outer_shape + (pad_to_nbits // 8,)
+    if out is not None:
+        assert out.shape == out_shape, "Shape of out does not match packed shape"
+    if out is not None and bitwidth == container_bits and n_bits == pad_to_nbits:
+        # byte-aligned elements without padding, cast straight into out
+        out_elems = _container_view(out, container_bytes)
+        if out_elems is not None:
+            np.copyto(out_elems, uint_array, casting="unsafe")
+            return out
+    as_bytes = uint_array.astype(">u%d" % container_bytes).view(np.uint8)
+    if bitwidth == container_bits and n_bits == pad_to_nbits:
+        # byte-aligned elements without padding, no bit shuffling needed
+        ret = as_bytes.reshape(out_shape)
+    else:
+        # (un)packing flattened arrays is much faster than along a short axis
+        bits = np.unpackbits(as_bytes.reshape(-1)).reshape(uint_array.shape + (container_bits,))
+        bits = bits[..., container_bits - bitwidth :].reshape(outer_shape + (n_bits,))
+        padded_bits = np.zeros(outer_shape + (pad_to_nbits,), dtype=np.uint8)
+        padded_bits[..., pad_to_nbits - n_bits :] = bits
+        ret = np.packbits(padded_bits.reshape(-1)).reshape(out_shape)
+    if out is None:
+        return ret
+    np.copyto(out, ret)
+    return out
+
+
+def _container_view(packed, container_bytes):
+    """Return a view of the uint8 ndarray packed with every container_bytes
+    bytes of the innermost dimension as one big-endian unsigned integer, or
+    None if packed is not contiguous in its innermost dimension. A reversed
+    innermost dimension is viewed as little-endian integers in reverse order."""
+    if packed.strides[-1] == 1:
+        rows = packed
+        byteorder = ">"
+    elif packed.strides[-1] == -1:
+        rows = np.flip(packed, axis=-1)
+        byteorder = "<"
+    else:
+        return None
+    try:
+        ret = rows.view(byteorder + "u%d" % container_bytes)
+    except ValueError:
+        return None
+    return ret if byteorder == ">" else np.flip(ret, axis=-1)
+
+
+def _unpack_uint_innermost_dim(packed_bytearray, bitwidth, n_elems):
+    """Inverse of _pack_uint_innermost_dim: extract the n_elems least significant
+    bitwidth-bit elements from the innermost dimension of a big-endian uint8
+    ndarray, returned as a uint64 array with the most significant element
+    first. Any padding in the upper bits is discarded."""
+    outer_shape = packed_bytearray.shape[:-1]
+    n_bits = n_elems * bitwidth
+    container_bits = _packing_container_bits(bitwidth)
+    container_bytes = container_bits // 8
+    packed_bytearray = np.ascontiguousarray(packed_bytearray, dtype=np.uint8)
+    if bitwidth == container_bits and packed_bytearray.shape[-1] * 8 == n_bits:
+        # byte-aligned elements without padding, no bit shuffling needed
+        ret = packed_bytearray.view(">u%d" % container_bytes)
+        return ret.astype(np.uint64).reshape(outer_shape + (n_elems,))
+    # (un)packing flattened arrays is much faster than along a short axis
+    bits = np.unpackbits(packed_bytearray.reshape(-1))
+    bits = bits.reshape(outer_shape + (packed_bytearray.shape[-1] * 8,))
+    if bits.shape[-1] < n_bits:
+        # missing upper bits are treated as zeroes
+        pad_shape = outer_shape + (n_bits - bits.shape[-1],)
+        bits = np.concatenate([np.zeros(pad_shape, dtype=np.uint8), bits], axis=-1)
+    bits = bits[..., bits.shape[-1] - n_bits :].reshape(outer_shape + (n_elems, bitwidth))
+    container = np.zeros(outer_shape + (n_elems, container_bits), dtype=np.uint8)
+    container[..., container_bits - bitwidth :] = bits
+    ret = np.packbits(container.reshape(-1)).view(">u%d" % container_bytes)
+    return ret.astype(np.uint64).reshape(outer_shape + (n_elems,))
+
+
+def pack_innermost_dim_as_limbs(ndarray, dtype, pad_to_nbits, reverse_inner=False):
+    """Pack the innermost dimension of the given numpy ndarray with FINN
+    DataType dtype into wide words represented as uint64 limbs. The returned
+    ndarray has the innermost dimension replaced by ceil(pad_to_nbits / 64)
+    limbs, with the least significant limb first. The packed word has the same
+    value as the corresponding hex string from pack_innermost_dim_as_hex_string.
+
+    Example:
+
+    A = [[1, 1, 1, 0], [0, 1, 1, 0]]
+
+    pack_innermost_dim_as_limbs(A, DataType["BINARY"], 8) == [[14], [6]]
+    """
+
+    if type(ndarray) != np.ndarray or ndarray.dtype != np.float32:
+        # try to convert to a float numpy array (container dtype is float)
+        ndarray = np.asarray(ndarray, dtype=np.float32)
+    bitwidth = dtype.bitwidth()
+    if ndarray.shape[-1] * bitwidth > pad_to_nbits:
+        raise Exception("Number of bits is greater than pad_to_nbits")
+    n_limbs = max(1, roundup_to_integer_multiple(pad_to_nbits, 64) // 64)
+    uint_array = _finnpy_to_uint(ndarray, dtype)
+    if reverse_inner:
+        uint_array = np.flip(uint_array, axis=-1)
+    packed = _pack_uint_innermost_dim(uint_array, bitwidth, n_limbs * 64)
+    # big-endian bytes -> least significant limb first
+    packed = packed.view(">u8").astype(np.uint64)
+    return np.ascontiguousarray(np.flip(packed, axis=-1))
+
+
+def unpack_innermost_dim_from_limbs(limbs, dtype, out_shape, reverse_inner=False):
+    """Convert a NumPy array of uint64 limbs (least significant limb first, as
+    produced by pack_innermost_dim_as_limbs) into a FINN NumPy array by
+    unpacking the packed words into the specified data type. out_shape can be
+    specified such that any padding in the packing dimension is removed. If
+    reverse_inner is set, the innermost unpacked dimension will be reversed."""
+
+    limbs = np.asarray(limbs, dtype=np.uint64)
+    # least significant limb first -> big-endian bytes
+    packed = np.flip(limbs, axis=-1).astype(">u8").view(np.uint8)
+    packed = packed.reshape(limbs.shape[:-1] + (limbs.shape[-1] * 8,))
+    uint_array = _unpack_uint_innermost_dim(packed, dtype.bitwidth(), out_shape[-1])
+    if reverse_inner:
+        uint_array = np.flip(uint_array, axis=-1)
+    return _uint_to_finnpy(uint_array, dtype).reshape(out_shape)
+
+
+def limbs_to_ints(limbs):
+    """Convert a NumPy array of uint64 limbs (least significant limb first)
+    into a flat list of Python arbitrary-precision integers, one per packed
+    word. Used at the boundary to simulators that consume Python ints."""
+
+    limbs = np.asarray(limbs, dtype=np.uint64)
+    n_limbs = limbs.shape[-1]
+    if n_limbs == 1:
+        return limbs.reshape(-1).tolist()
+    word_nbytes = n_limbs * 8
+    word_bytes = np.flip(limbs, axis=-1).astype(">u8").tobytes()
+    return [
+        int.from_bytes(word_bytes[i : i + word_nbytes], "big")
+        for i in range(0, len(word_bytes), word_nbytes)
+    ]
+
+
+def ints_to_limbs(values, n_limbs):
+    """Convert a sequence of non-negative Python arbitrary-precision integers
+    into a NumPy uint64 array of shape (len(values), n_limbs), with the least
+    significant limb first. Inverse of limbs_to_ints."""
+
+    if n_limbs == 1:
+        return np.asarray([int(x) for x in values], dtype=np.uint64).reshape(-1, 1)
+    word_nbytes = n_limbs * 8
+    word_bytes = b"".join(int(x).to_bytes(word_nbytes, "big") for x in values)
+    ret = np.frombuffer(word_bytes, dtype=">u8").reshape(-1, n_limbs)
+    return np.ascontiguousarray(np.flip(ret, axis=-1), dtype=np.uint64)
+
+
 def finnpy_to_packed_bytearray(
-    ndarray, dtype, reverse_inner=False, reverse_endian=False, fast_mode=False
+    ndarray, dtype, reverse_inner=False, reverse_endian=False, fast_mode=False, out=None
 ):
     """Given a numpy ndarray with FINN DataType dtype, pack the innermost
     dimension and return the packed representation as an ndarray of uint8.
@@ -335,10 +854,17 @@ def finnpy_to_packed_bytearray(
     of 8 bits. The returned ndarray has the same number of dimensions as the
     input.
 
+    Packing is vectorized with NumPy shifts and masks for all DataTypes of up
+    to 64 bits, and produces the same bytes as packing each element with
+    array2hexstring.
+
+    If out is specified, the packed bytes are written into this preallocated
+    uint8 ndarray (e.g. a PYNQ device buffer) of the packed shape, which is
+    also returned.
+
     If fast_mode is enabled, will attempt to use shortcuts  to save
     on runtime for certain cases:
-    * 8-bit ndarray -> 8-bit
-    * ndarray -> 1-bit and total bits % 8 == 0
+    * 8-bit ndarray -> 8-bit, returned as a view without copying
     This mode is currently not well-tested, use at your own risk!
     """
 
@@ -349,43 +875,55 @@ def finnpy_to_packed_bytearray(
         double_reverse = reverse_inner and reverse_endian
         # fast mode case: byte -> byte: cast
         if inp_is_byte and out_is_byte and double_reverse:
-            return ndarray.view(np.uint8)
-        # fast mode case: xxx -> bit with nbits % 8 == 0: np.packbits
-        out_is_bit = dtype.bitwidth() == 1
-        bits = dtype.bitwidth() * ndarray.shape[-1]
-        bits_padded = roundup_to_integer_multiple(bits, 8)
-        no_pad = bits_padded == bits
-        if out_is_bit and no_pad and double_reverse:
-            in_as_int8 = ndarray.astype(np.int8)
-            # bipolar -> binary if needed
-            if dtype == DataType["BIPOLAR"]:
-                in_as_int8 = (in_as_int8 + 1) // 2
-            # reverse inner
-            in_as_int8 = np.flip(in_as_int8, axis=-1)
-            # pack with numpy
-            packed_data = np.packbits(in_as_int8, axis=-1)
-            # reverse endianness and return
-            return np.flip(packed_data, axis=-1)
-
-    if (not issubclass(type(ndarray), np.ndarray)) or ndarray.dtype != np.float32:
+            if out is None:
+                return ndarray.view(np.uint8)
+            np.copyto(out, ndarray.view(np.uint8))
+            return out
+
+    if out is not None and reverse_endian:
+        # write through a reversed view, so that no flip is needed afterwards
+        out_flipped = np.flip(out, axis=-1)
+        finnpy_to_packed_bytearray(ndarray, dtype, reverse_inner, False, fast_mode, out_flipped)
+        return out
+
+    if (not issubclass(type(ndarray), np.ndarray)) or (
+        ndarray.dtype != np.float32 and ndarray.dtype.kind not in "iu"
+    ):
         # try to convert to a float numpy array (container dtype is float)
         ndarray = np.asarray(ndarray, dtype=np.float32)
-    # pack innermost dim to hex strings padded to 8 bits
+    # pack innermost dim padded to 8 bits
     bits = dtype.bitwidth() * ndarray.shape[-1]
     bits_padded = roundup_to_integer_multiple(bits, 8)
-    packed_hexstring = pack_innermost_dim_as_hex_string(
-        ndarray, dtype, bits_padded, reverse_inner=reverse_inner
-    )
+    if dtype.bitwidth() > 64:
+        # too wide for the vectorized path, go through hex strings
+        packed_hexstring = pack_innermost_dim_as_hex_string(
+            ndarray, dtype, bits_padded, reverse_inner=reverse_inner
+        )
 
-    def fn(x):
-        return np.asarray(list(map(hexstring2npbytearray, x)))
+        def fn(x):
+            return np.asarray(list(map(hexstring2npbytearray, x)))
 
-    if packed_hexstring.ndim == 0:
-        # scalar, call hexstring2npbytearray directly
-        ret = hexstring2npbytearray(np.asscalar(packed_hexstring))
-    else:
-        # convert ndarray of hex strings to byte array
         ret = np.apply_along_axis(fn, packed_hexstring.ndim - 1, packed_hexstring)
+        if out is not None:
+            np.copyto(out, ret)
+            ret = out
+    elif out is not None and _rows_view(out) is not None:
+        # pack block by block straight into out, without any full-size
+        # temporary arrays
+        assert out.shape == ndarray.shape[:-1] + (bits_padded // 8,), "Shape of out mismatch"
+        in_rows = ndarray.reshape(-1, ndarray.shape[-1])
+        out_rows = _rows_view(out)
+        for rows in _row_blocks(in_rows.shape[0], in_rows.shape[1]):
+            uint_array = _finnpy_to_uint(in_rows[rows], dtype)
+            if reverse_inner:
+                uint_array = np.flip(uint_array, axis=-1)
+            _pack_uint_innermost_dim(uint_array, dtype.bitwidth(), bits_padded, out_rows[rows])
+        ret = out
+    else:
+        uint_array = _finnpy_to_uint(ndarray, dtype)
+        if reverse_inner:
+            uint_array = np.flip(uint_array, axis=-1)
+        ret = _pack_uint_innermost_dim(uint_array, dtype.bitwidth(), bits_padded, out)
     if reverse_endian:
         # reverse the endianness of packing dimension
         ret = np.flip(ret, axis=-1)
@@ -399,6 +937,7 @@ def packed_bytearray_to_finnpy(
     reverse_inner=False,
     reverse_endian=False,
     fast_mode=False,
+    out=None,
 ):
     """Given a packed numpy uint8 ndarray, unpack it into a FINN array of
     given DataType.
@@ -410,6 +949,9 @@ def packed_bytearray_to_finnpy(
     on runtime for certain cases.
     This mode is currently not well-tested, use at your own risk.
 
+    If out is specified, the unpacked values are written into this
+    preallocated ndarray of shape output_shape, which is also returned.
+
     """
 
     if (not issubclass(type(packed_bytearray), np.ndarray)) or packed_bytearray.dtype != np.uint8:
@@ -434,13 +976,36 @@ def packed_bytearray_to_finnpy(
         no_unpad = np.prod(packed_bytearray.shape) == np.prod(output_shape)
         if no_unpad:
             as_np_type = packed_bytearray.view(dtype.to_numpy_dt())
+            if out is not None:
+                np.copyto(out, as_np_type.reshape(output_shape))
+                return out
             return as_np_type.reshape(output_shape).astype(np.float32)
     if reverse_endian:
         packed_bytearray = np.flip(packed_bytearray, axis=-1)
-    # convert innermost dim of byte array to hex strings
-    packed_hexstring = np.apply_along_axis(npbytearray2hexstring, packed_dim, packed_bytearray)
-    ret = unpack_innermost_dim_from_hex_string(
-        packed_hexstring, dtype, output_shape, packed_bits, reverse_inner
-    )
-
-    return ret
+    if target_bits <= 64 and out is not None and _rows_view(out) is not None:
+        # unpack block by block straight into out, without any full-size
+        # temporary arrays
+        assert out.shape == tuple(output_shape), "Shape of out does not match output_shape"
+        in_rows = packed_bytearray.reshape(-1, packed_bytearray.shape[-1])
+        out_rows = _rows_view(out)
+        for rows in _row_blocks(in_rows.shape[0], out_rows.shape[1]):
+            uint_array = _unpack_uint_innermost_dim(in_rows[rows], target_bits, output_shape[-1])
+            if reverse_inner:
+                uint_array = np.flip(uint_array, axis=-1)
+            _uint_to_finnpy(uint_array, dtype, out_rows[rows])
+        return out
+    if target_bits > 64:
+        # too wide for the vectorized path, go through hex strings
+        packed_hexstring = np.apply_along_axis(npbytearray2hexstring, packed_dim, packed_bytearray)
+        ret = unpack_innermost_dim_from_hex_string(
+            packed_hexstring, dtype, output_shape, packed_bits, reverse_inner
+        )
+    else:
+        uint_array = _unpack_uint_innermost_dim(packed_bytearray, target_bits, output_shape[-1])
+        if reverse_inner:
+            uint_array = np.flip(uint_array, axis=-1)
+        ret = _uint_to_finnpy(uint_array, dtype).reshape(output_shape)
+    if out is None:
+        return ret
+    np.copyto(out, ret)
+    return out
@@ -26,6 +26,8 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import numpy as np
+from qonnx.core.datatype import DataType
 from qonnx.util.basic import get_by_name, is_finn_op
 
 
@@ -41,3 +43,103 @@ def is_fpgadataflow_node(node):
                     is_node = True
 
     return is_node
+
+
+def thresholds_activation(x, thresholds, act_val, odt):
+    """NumPy model of the finn-hlslib ThresholdsActivation with comp::less_equal,
+    as used with exec_mode python. Returns the number of thresholds each element
+    of x is greater than or equal to, plus act_val. x has the channels as its
+    innermost dimension, thresholds has the shape (channels or 1, steps).
+    BIPOLAR outputs are returned as {-1, +1} like cppsim does."""
+    ret = np.full(x.shape, act_val, dtype=np.int64)
+    for t in range(thresholds.shape[-1]):
+        ret += x >= thresholds[:, t]
+    if odt == DataType["BIPOLAR"]:
+        ret = 2 * ret - 1
+    return ret.astype(np.float32)
+
+
+def sliding_window_nhwc(x, kernel, stride, dilation, depthwise_simd=0):
+    """NumPy model of the FINN sliding window generators, as used with
+    exec_mode python. Returns the (N, OFMDim_h, OFMDim_w, K_h * K_w * C)
+    windows of the unpadded (N, IFMDim_h, IFMDim_w, C) input x, ordered with
+    the kernel positions outer and the channels inner. If depthwise_simd is
+    set, the channels are folded by depthwise_simd and all kernel positions of
+    a fold precede the next fold, which is the order the depthwise generators
+    produce."""
+    (k_h, k_w) = kernel
+    (stride_h, stride_w) = stride
+    (dilation_h, dilation_w) = dilation
+    window_shape = ((k_h - 1) * dilation_h + 1, (k_w - 1) * dilation_w + 1)
+    # (N, H', W', C, window_h, window_w) view on x, no copies made yet
+    ret = np.lib.stride_tricks.sliding_window_view(x, window_shape, axis=(1, 2))
+    ret = ret[:, ::stride_h, ::stride_w, :, ::dilation_h, ::dilation_w]
+    (n, ofm_dim_h, ofm_dim_w, ch) = ret.shape[:4]
+    ret = ret.transpose(0, 1, 2, 4, 5, 3)
+    if depthwise_simd:
+        ret = ret.reshape(n, ofm_dim_h, ofm_dim_w, k_h * k_w, ch // depthwise_simd, -1)
+        ret = ret.transpose(0, 1, 2, 4, 3, 5)
+    return ret.reshape(n, ofm_dim_h, ofm_dim_w, k_h * k_w * ch)
+
+
+def encode_chrc(txns_per_stream):
+    """Encode the per-cycle transaction traces (1 if a transaction happens in
+    a cycle of the period, 0 otherwise) of the streams of a node into the
+    compact form stored in the io_chrc_in and io_chrc_out node attributes.
+    For each stream, this holds the number of runs, followed by the lengths of
+    the alternating runs of cycles without and with transactions, starting
+    with a (possibly empty) run without."""
+    ret = []
+    for txns in txns_per_stream:
+        txns = np.asarray(txns, dtype=np.int8)
+        # run boundaries are where the trace changes, starting from 0
+        changes = np.flatnonzero(np.diff(txns, prepend=0))
+        runs = np.diff(np.concatenate([[0], changes, [len(txns)]]))
+        ret += [len(runs)] + runs.tolist()
+    return ret
+
+
+def legacy_chrc_to_txns(chrc, period):
+    """Convert the dense characteristic functions stored in the io_chrc_in and
+    io_chrc_out node attributes by older FINN versions (the accumulated number
+    of transactions at each cycle over two periods, one row per stream) back
+    into per-cycle transaction traces over one period, as taken by
+    encode_chrc."""
+    chrc = np.asarray(chrc, dtype=np.int64)
+    assert chrc.ndim == 2 and chrc.shape[1] == 2 * period, (
+        "Legacy characteristic functions of shape %s do not match the period %d, "
+        "please re-run the characterization" % (str(chrc.shape), period)
+    )
+    return np.diff(chrc[:, :period], axis=1, prepend=0)
+
+
+def decode_chrc(chrc, period):
+    """Decode the compact characteristic functions from the io_chrc_in or
+    io_chrc_out node attribute (see encode_chrc) of a node characterized over
+    the given period. Returns a list with the (sorted) cycles at which a
+    transaction happens for each stream. The dense form of older FINN
+    versions is accepted as well, see legacy_chrc_to_txns."""
+    if isinstance(chrc, np.ndarray) and chrc.ndim == 2:
+        return [np.flatnonzero(txns) for txns in legacy_chrc_to_txns(chrc, period)]
+    ret = []
+    pos = 0
+    while pos < len(chrc):
+        runs = np.asarray(chrc[pos + 1 : pos + 1 + chrc[pos]], dtype=np.int64)
+        pos += 1 + chrc[pos]
+        assert runs.sum() == period, "Found unexpected characterization attribute"
+        # odd runs have a transaction in every cycle
+        txn_starts = (np.cumsum(runs) - runs)[1::2]
+        txn_runs = runs[1::2]
+        txn_offsets = np.cumsum(txn_runs) - txn_runs
+        txn_cycles = np.repeat(txn_starts - txn_offsets, txn_runs) + np.arange(txn_runs.sum())
+        ret.append(txn_cycles)
+    return ret
+
+
+def cumulative_chrc(txn_cycles, period):
+    """Return the dense characteristic function of a stream from the cycles at
+    which its transactions happen: the accumulated number of transactions at
+    each cycle over two periods."""
+    txns = np.zeros(period, dtype=np.int32)
+    txns[txn_cycles] = 1
+    return np.cumsum(np.tile(txns, 2)).astype(np.int32)
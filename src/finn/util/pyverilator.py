@@ -26,6 +26,8 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import itertools
+import json
 import numpy as np
 import os
 import shutil
@@ -37,6 +39,113 @@ from finn.util.basic import (
     launch_process_helper,
     make_build_dir,
 )
+from finn.util.verilator_cache import (
+    get_cached_verilator_build,
+    store_verilator_build,
+    verilator_cache_key,
+)
+
+
+class CyclicStream:
+    """Read-only sequence of reps back-to-back repetitions of the given list of
+    stream words, computed on demand instead of materializing all of them.
+    Useful for the weight streams of decoupled layers, which are replayed once
+    for every input vector. Supports what the rtlsim functions do with their
+    input streams (len, indexing and slicing words off the front) in constant
+    memory, so it can be used in place of a list in the rtlsim io_dict."""
+
+    def __init__(self, words, reps, offset=0):
+        self.words = words
+        self.reps = int(reps)
+        self.offset = offset
+        self.length = max(0, len(words) * self.reps - offset)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            if step == 1 and stop == self.length:
+                return CyclicStream(self.words, self.reps, self.offset + start)
+            return [self[i] for i in range(start, stop, step)]
+        if key < 0:
+            key += self.length
+        if key < 0 or key >= self.length:
+            raise IndexError("CyclicStream index out of range")
+        return self.words[(self.offset + key) % len(self.words)]
+
+    def __iter__(self):
+        if self.length == 0:
+            return iter([])
+        start = self.offset % len(self.words)
+        return itertools.islice(itertools.cycle(self.words), start, start + self.length)
+
+
+class IterableStream:
+    """Input stream for rtlsim fed by an arbitrary iterable or generator, whose
+    words are only produced as the simulation consumes them. Slicing words off
+    the front advances the underlying iterator and returns the same object, so
+    unlike lists this is a single-pass stream. If length is not given, len()
+    only tells whether words remain (1) or not (0), which is all the rtlsim
+    functions need."""
+
+    _end = object()
+
+    def __init__(self, iterable, length=None):
+        self.iterator = iter(iterable)
+        self.length = length
+        self.head = next(self.iterator, self._end)
+
+    def __len__(self):
+        if self.head is self._end:
+            return 0
+        return 1 if self.length is None else self.length
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            assert key.stop is None and key.step is None, "IterableStream only drops words"
+            for i in range(key.start or 0):
+                self._advance()
+            return self
+        if key != 0 or self.head is self._end:
+            raise IndexError("IterableStream can only access its first word")
+        return self.head
+
+    def __iter__(self):
+        while self.head is not self._end:
+            yield self.head
+            self._advance()
+
+    def _advance(self):
+        if self.head is not self._end:
+            self.head = next(self.iterator, self._end)
+            if self.length is not None:
+                self.length -= 1
+
+
+def as_rtlsim_stream(words):
+    """Return the given rtlsim input stream words in a form the rtlsim functions
+    accept: lists and other sequences are returned as they are, any other
+    iterable (e.g. a generator) is wrapped in an IterableStream."""
+
+    if hasattr(words, "__len__") and hasattr(words, "__getitem__"):
+        return words
+    return IterableStream(words)
+
+
+def concat_rtlsim_streams(streams):
+    """Concatenate the given rtlsim input streams into one, e.g. the streams of
+    several samples. Repetitions of the same CyclicStream are merged into one
+    CyclicStream with the summed number of repetitions, everything else is
+    concatenated into a list."""
+
+    first = streams[0]
+    if isinstance(first, CyclicStream) and all(
+        [isinstance(x, CyclicStream) and x.offset == 0 and x.words == first.words for x in streams]
+    ):
+        return CyclicStream(first.words, sum([x.reps for x in streams]))
+    return list(itertools.chain(*streams))
 
 
 def make_single_source_file(filtered_verilog_files, target_file):
@@ -121,10 +230,99 @@ def prepare_stitched_ip_for_verilator(model):
     return vivado_stitch_proj_dir
 
 
-def verilator_fifosim(model, n_inputs, max_iters=100000000):
+def verilator_source_files(vivado_stitch_proj_dir, verilog_files):
+    """Return the list of all source files that go into the Verilator build
+    of stitched IP prepared by prepare_stitched_ip_for_verilator, given the
+    Verilog files passed to Verilator, for use as verilator_cache_key."""
+
+    # files given by name only are found in the stitched IP project dir, this
+    # includes the single source file with all Verilog code of the design
+    ret = [x if os.path.isabs(x) else vivado_stitch_proj_dir + "/" + x for x in verilog_files]
+    verilog_header_dir = vivado_stitch_proj_dir + "/pyverilator_vh"
+    ret += [os.path.join(verilog_header_dir, x) for x in sorted(os.listdir(verilog_header_dir))]
+    return ret
+
+
+def fifosim_traffic_pattern(spec):
+    """Return the C++ constructor arguments of the TrafficPattern in
+    verilator_fifosim.cpp for the given traffic pattern specification, which
+    is one of:
+
+    - None or "always": active in every cycle
+    - "rate:<r>": active in a fraction 0 < r <= 1 of the cycles, evenly spread
+    - "burst:<on>:<off>": <on> active cycles followed by <off> inactive ones
+    - "trace:<file>": active or inactive cycles given as whitespace-separated
+      1/0 values in a text file, replayed cyclically
+
+    For input streams, active cycles are those in which the source makes a new
+    word available; for output streams, those in which the sink accepts one."""
+
+    if spec is None or spec == "always":
+        return 'TrafficPattern::ALWAYS, 1.0, 0, 0, ""'
+    kind, _, args = spec.partition(":")
+    if kind == "rate":
+        rate = float(args)
+        assert 0 < rate <= 1, "Traffic rate must be in (0, 1]: " + spec
+        return 'TrafficPattern::FIXED_RATE, %r, 0, 0, ""' % rate
+    elif kind == "burst":
+        on_cycles, off_cycles = [int(x) for x in args.split(":")]
+        assert on_cycles > 0 and off_cycles >= 0, "Invalid burst traffic pattern: " + spec
+        return 'TrafficPattern::BURST, 1.0, %d, %d, ""' % (on_cycles, off_cycles)
+    elif kind == "trace":
+        trace_file = os.path.abspath(args)
+        assert os.path.isfile(trace_file), "Traffic trace file not found: " + trace_file
+        return "TrafficPattern::TRACE, 1.0, 0, 0, %s" % json.dumps(trace_file)
+    else:
+        raise Exception("Unknown traffic pattern: " + spec)
+
+
+def get_fifo_occupancy(model, sim_dict):
+    """Collect the per-FIFO results of verilator_fifosim for the FIFOs with
+    depth monitoring into a dict indexed by FIFO node name, containing the
+    depth, maximum observed count, number of cycles spent full and the
+    occupancy histogram (number of cycles per bin of equal width over
+    [0, depth]). The per-FIFO entries are removed from sim_dict."""
+
+    ret = {}
+    fifo_ind = 0
+    for fifo_node in model.get_nodes_by_op_type("StreamingFIFO"):
+        fifo_inst = getCustomOp(fifo_node)
+        if fifo_inst.get_nodeattr("depth_monitor") != 1:
+            continue
+        suffix = "" if fifo_ind == 0 else "_%d" % fifo_ind
+        fifo_ind += 1
+        hist = []
+        while "occupancy%s_bin%d" % (suffix, len(hist)) in sim_dict:
+            hist.append(sim_dict.pop("occupancy%s_bin%d" % (suffix, len(hist))))
+        ret[fifo_node.name] = {
+            "depth": fifo_inst.get_nodeattr("depth"),
+            "maxcount": sim_dict.pop("maxcount" + suffix, None),
+            "cycles_full": sim_dict.pop("fullcycles" + suffix, None),
+            "occupancy_histogram": hist,
+        }
+    return ret
+
+
+def verilator_fifosim(
+    model,
+    n_inputs,
+    max_iters=100000000,
+    input_traffic=None,
+    output_traffic=None,
+    n_occupancy_bins=16,
+):
     """Create a Verilator model of stitched IP and use a simple C++
-    driver to drive the input stream. Useful for FIFO sizing, latency
-    and throughput measurement."""
+    driver to drive the input streams. Useful for FIFO sizing, latency
+    and throughput measurement. Models with multiple input and output
+    streams are supported, the returned dict also contains the number of
+    transactions and the latency/throughput cycles of each stream.
+
+    input_traffic and output_traffic set the pattern in which words are
+    offered to the input streams and accepted from the output streams, see
+    fifosim_traffic_pattern. By default, inputs are always valid and outputs
+    always ready. For FIFOs with depth monitoring, the maximum count, the
+    cycles spent full and an occupancy histogram with n_occupancy_bins bins
+    are returned, see get_fifo_occupancy."""
 
     vivado_stitch_proj_dir = prepare_stitched_ip_for_verilator(model)
     verilog_header_dir = vivado_stitch_proj_dir + "/pyverilator_vh"
@@ -132,21 +330,44 @@ def verilator_fifosim(model, n_inputs, max_iters=100000000):
     fifosim_cpp_fname = os.environ["FINN_ROOT"] + "/src/finn/qnn-data/cpp/verilator_fifosim.cpp"
     with open(fifosim_cpp_fname, "r") as f:
         fifosim_cpp_template = f.read()
-    assert len(model.graph.input) == 1, "Only a single input stream is supported"
-    assert len(model.graph.output) == 1, "Only a single output stream is supported"
-    iname = model.graph.input[0].name
-    first_node = model.find_consumer(iname)
-    oname = model.graph.output[0].name
-    last_node = model.find_producer(oname)
-    assert (first_node is not None) and (last_node is not None), "Failed to find first/last nodes"
-    fnode_inst = getCustomOp(first_node)
-    lnode_inst = getCustomOp(last_node)
-    ishape_folded = fnode_inst.get_folded_input_shape()
-    oshape_folded = lnode_inst.get_folded_output_shape()
+    # the stitched IP has one s_axis_<i> stream per top-level input and one
+    # m_axis_<o> stream per top-level output, in graph order
+    iters_per_input = []
+    for i_vi in model.graph.input:
+        first_node = model.find_consumer(i_vi.name)
+        assert first_node is not None, "Failed to find consumer of " + i_vi.name
+        node_inp_ind = list(first_node.input).index(i_vi.name)
+        if node_inp_ind == 0:
+            ishape_folded = getCustomOp(first_node).get_folded_input_shape()
+        else:
+            ishape_folded = getCustomOp(first_node).get_folded_input_shape(node_inp_ind)
+        iters_per_input.append(np.prod(ishape_folded[:-1]))
+    iters_per_output = []
+    for o_vi in model.graph.output:
+        last_node = model.find_producer(o_vi.name)
+        assert last_node is not None, "Failed to find producer of " + o_vi.name
+        node_out_ind = list(last_node.output).index(o_vi.name)
+        if node_out_ind == 0:
+            oshape_folded = getCustomOp(last_node).get_folded_output_shape()
+        else:
+            oshape_folded = getCustomOp(last_node).get_folded_output_shape(node_out_ind)
+        iters_per_output.append(np.prod(oshape_folded[:-1]))
+
+    stream_signals = []
+    stream_signal_templ = "    %s_axis_t%s[%d] = &top->%s_axis_%d_t%s;"
+    for i in range(len(iters_per_input)):
+        for sig in ["valid", "ready"]:
+            stream_signals.append(stream_signal_templ % ("s", sig, i, "s", i, sig))
+    for o in range(len(iters_per_output)):
+        for sig in ["valid", "ready"]:
+            stream_signals.append(stream_signal_templ % ("m", sig, o, "m", o, sig))
+    stream_signals = "\n".join(stream_signals)
 
     fifo_log = []
     fifo_log_templ = '    results_file << "maxcount%s" << "\\t" '
     fifo_log_templ += "<< to_string(top->maxcount%s) << endl;"
+    fifo_monitors = []
+    fifo_monitor_samples = []
     fifo_nodes = model.get_nodes_by_op_type("StreamingFIFO")
     fifo_ind = 0
     for fifo_node in fifo_nodes:
@@ -154,15 +375,30 @@ def verilator_fifosim(model, n_inputs, max_iters=100000000):
         if fifo_node.get_nodeattr("depth_monitor") == 1:
             suffix = "" if fifo_ind == 0 else "_%d" % fifo_ind
             fifo_log.append(fifo_log_templ % (suffix, suffix))
+            fifo_log.append('    fifo_monitors[%d].log(results_file, "%s");' % (fifo_ind, suffix))
+            fifo_monitors.append(
+                "    fifo_monitors.push_back(FifoMonitor(%d));" % fifo_node.get_nodeattr("depth")
+            )
+            fifo_monitor_samples.append(
+                "        fifo_monitors[%d].sample(top->count%s);" % (fifo_ind, suffix)
+            )
             fifo_ind += 1
     fifo_log = "\n".join(fifo_log)
 
     template_dict = {
-        "ITERS_PER_INPUT": np.prod(ishape_folded[:-1]),
-        "ITERS_PER_OUTPUT": np.prod(oshape_folded[:-1]),
+        "N_IN_STREAMS": len(iters_per_input),
+        "N_OUT_STREAMS": len(iters_per_output),
+        "ITERS_PER_INPUT": ", ".join([str(x) for x in iters_per_input]),
+        "ITERS_PER_OUTPUT": ", ".join([str(x) for x in iters_per_output]),
+        "STREAM_SIGNALS": stream_signals,
         "N_INPUTS": n_inputs,
         "MAX_ITERS": max_iters,
         "FIFO_DEPTH_LOGGING": fifo_log,
+        "FIFO_MONITORS": "\n".join(fifo_monitors),
+        "FIFO_MONITOR_SAMPLES": "\n".join(fifo_monitor_samples),
+        "N_OCC_BINS": n_occupancy_bins,
+        "INPUT_TRAFFIC": fifosim_traffic_pattern(input_traffic),
+        "OUTPUT_TRAFFIC": fifosim_traffic_pattern(output_traffic),
     }
 
     for key, val in template_dict.items():
@@ -237,8 +473,17 @@ def verilator_fifosim(model, n_inputs, max_iters=100000000):
         f.write(" ".join(verilator_args) + "\n")
         f.write(" ".join(make_args) + "\n")
 
-    launch_process_helper(verilator_args, cwd=build_dir)
-    launch_process_helper(make_args, proc_env=proc_env, cwd=build_dir)
+    # reuse a previously compiled simulation of the same design if available
+    cache_key = verilator_cache_key(
+        [build_dir + "/verilator_fifosim.cpp"]
+        + verilator_source_files(vivado_stitch_proj_dir, verilog_file_arg),
+        verilator_args + make_args + [gcc_args],
+        {build_dir: "$BUILD_DIR", vivado_stitch_proj_dir: "$STITCH_PROJ_DIR"},
+    )
+    if get_cached_verilator_build(cache_key, build_dir) is None:
+        launch_process_helper(verilator_args, cwd=build_dir)
+        launch_process_helper(make_args, proc_env=proc_env, cwd=build_dir)
+        store_verilator_build(cache_key, [build_dir + "/Vfinn_design_wrapper"])
 
     sim_launch_args = ["./Vfinn_design_wrapper"]
     launch_process_helper(sim_launch_args, cwd=build_dir)
@@ -308,8 +553,21 @@ def pyverilate_stitched_ip(
 
     swg_pkg = os.environ["FINN_ROOT"] + "/finn-rtllib/swg/swg_pkg.sv"
 
+    verilog_files = [swg_pkg, top_module_file_name, xpm_fifo, xpm_memory, xpm_cdc]
+    # reuse a previously compiled simulation of the same design if available
+    cache_key = verilator_cache_key(
+        verilator_source_files(vivado_stitch_proj_dir, verilog_files),
+        ["pyverilator", top_module_name, get_rtlsim_trace_depth(), read_internal_signals]
+        + verilator_args
+        + extra_verilator_args,
+        {vivado_stitch_proj_dir: "$STITCH_PROJ_DIR"},
+    )
+    cached_files = get_cached_verilator_build(cache_key, build_dir)
+    if cached_files is not None:
+        return PyVerilator(cached_files[0], auto_eval=False)
+
     sim = PyVerilator.build(
-        [swg_pkg, top_module_file_name, xpm_fifo, xpm_memory, xpm_cdc],
+        verilog_files,
         verilog_path=[vivado_stitch_proj_dir, verilog_header_dir],
         build_dir=build_dir,
         trace_depth=get_rtlsim_trace_depth(),
@@ -318,4 +576,5 @@ def pyverilate_stitched_ip(
         read_internal_signals=read_internal_signals,
         extra_args=verilator_args + extra_verilator_args,
     )
+    store_verilator_build(cache_key, [sim.lib._name])
     return sim
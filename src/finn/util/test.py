@@ -40,7 +40,7 @@ from pkgutil import get_data
 from qonnx.core.modelwrapper import ModelWrapper
 from qonnx.custom_op.registry import getCustomOp
 
-from finn.core.onnx_exec import execute_onnx
+from finn.core.onnx_exec import execute_onnx, execute_onnx_batch
 from finn.transformation.fpgadataflow.make_zynq_proj import ZynqBuild
 from finn.transformation.fpgadataflow.vitis_build import VitisBuild, VitisOptStrategy
 from finn.util.basic import alveo_default_platform, alveo_part_map, pynq_part_map
@@ -175,6 +175,26 @@ def execute_parent(parent_path, child_path, input_tensor_npy, return_full_ctx=Fa
         return ret[oname]
 
 
+def execute_parent_batch(parent_path, child_path, input_tensors_npy, return_full_ctx=False):
+    """Execute parent model containing a single StreamingDataflowPartition by
+    replacing it with the model at child_path, for a list of input tensors
+    (one per sample) at once. Returns the list of results."""
+
+    parent_model = load_test_checkpoint_or_skip(parent_path)
+    iname = parent_model.graph.input[0].name
+    oname = parent_model.graph.output[0].name
+    sdp_node = parent_model.get_nodes_by_op_type("StreamingDataflowPartition")[0]
+    sdp_node = getCustomOp(sdp_node)
+    sdp_node.set_nodeattr("model", child_path)
+    sdp_node.set_nodeattr("return_full_exec_context", 1 if return_full_ctx else 0)
+    input_dicts = [{iname: x} for x in input_tensors_npy]
+    ret = execute_onnx_batch(parent_model, input_dicts, True)
+    if return_full_ctx:
+        return ret
+    else:
+        return [x[oname] for x in ret]
+
+
 def resize_smaller_side(target_pixels, img):
     """Resizes smallest side of image to target pixels and resizes larger side with
     same ratio. Expects a PIL image."""
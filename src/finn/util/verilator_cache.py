@@ -0,0 +1,152 @@
+# Copyright (c) 2023, Xilinx
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of FINN nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+# Content-addressed cache of compiled Verilator models. A compiled model (the
+# PyVerilator shared library or the fifosim executable) is stored under a key
+# that hashes the contents of all source files that go into the compilation
+# together with the command line arguments and top module name, so that an
+# unchanged design is not verilated and compiled again. The cache directory is
+# set by the FINN_VERILATOR_CACHE_DIR environment variable and bounded in size
+# by FINN_VERILATOR_CACHE_SIZE_MB, evicting the least recently used entries.
+
+
+def get_verilator_cache_dir():
+    """Return the directory of the Verilator model cache, as set by the
+    FINN_VERILATOR_CACHE_DIR environment variable. If the env.var. is
+    undefined, a directory under FINN_BUILD_DIR is used."""
+
+    default_dir = os.path.join(
+        os.getenv("FINN_BUILD_DIR", tempfile.gettempdir()), "verilator_cache"
+    )
+    return os.getenv("FINN_VERILATOR_CACHE_DIR", default_dir)
+
+
+def get_verilator_cache_size_mb():
+    """Return the maximum size of the Verilator model cache in MB, as set by
+    the FINN_VERILATOR_CACHE_SIZE_MB environment variable (default 4096). A
+    size of 0 disables the cache."""
+
+    return int(os.getenv("FINN_VERILATOR_CACHE_SIZE_MB", 4096))
+
+
+def verilator_cache_key(source_files, args, path_aliases=None):
+    """Return the cache key for a Verilator compilation of the given source
+    files (whose contents are hashed, in the given order) with the given list
+    of arguments (strings). Paths in the arguments that depend on the build,
+    such as the build directory, are replaced by their alias from the
+    path_aliases dict so that the key only depends on the design."""
+
+    if path_aliases is None:
+        path_aliases = {}
+    h = hashlib.sha256()
+    for fname in source_files:
+        h.update(os.path.basename(fname).encode())
+        with open(fname, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    for arg in args:
+        arg = str(arg)
+        for path, alias in path_aliases.items():
+            arg = arg.replace(path, alias)
+        h.update(b"\0" + arg.encode())
+    return h.hexdigest()
+
+
+def get_cached_verilator_build(key, build_dir):
+    """Copy the files of the cached compiled model with the given key into
+    build_dir and return their paths, or None if the key is not cached."""
+
+    if get_verilator_cache_size_mb() <= 0:
+        return None
+    entry_dir = os.path.join(get_verilator_cache_dir(), key)
+    try:
+        fnames = sorted(os.listdir(entry_dir))
+        ret = []
+        for fname in fnames:
+            ret.append(shutil.copy2(os.path.join(entry_dir, fname), build_dir))
+        # mark as recently used for eviction
+        os.utime(entry_dir)
+    except OSError:
+        # not cached, or evicted meanwhile
+        return None
+    return ret
+
+
+def store_verilator_build(key, files):
+    """Store the given files of a compiled model in the cache under the given
+    key, then evict the least recently used entries until the cache fits into
+    its size limit."""
+
+    max_size = get_verilator_cache_size_mb() * 2**20
+    if max_size <= 0:
+        return
+    cache_dir = get_verilator_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    entry_dir = os.path.join(cache_dir, key)
+    if os.path.isdir(entry_dir):
+        return
+    # fill a temporary dir and rename it, so that an entry is either
+    # complete or absent for concurrent builds
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp_", dir=cache_dir)
+    for fname in files:
+        shutil.copy2(fname, tmp_dir)
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # stored by a concurrent build in the meantime
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    evict_verilator_cache(max_size)
+
+
+def evict_verilator_cache(max_size):
+    """Remove the least recently used entries of the Verilator model cache
+    until its total size is at most max_size bytes."""
+
+    cache_dir = get_verilator_cache_dir()
+    entries = []
+    total_size = 0
+    for key in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir, key)
+        if key.startswith(".") or not os.path.isdir(entry_dir):
+            continue
+        try:
+            size = sum([os.path.getsize(os.path.join(entry_dir, x)) for x in os.listdir(entry_dir)])
+            entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+        except OSError:
+            continue
+        total_size += size
+    for mtime, size, entry_dir in sorted(entries):
+        if total_size <= max_size:
+            break
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total_size -= size
@@ -0,0 +1,345 @@
+# Copyright (c) 2023, Xilinx
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of FINN nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import pytest
+
+import copy
+import numpy as np
+import time
+from onnx import TensorProto, helper, numpy_helper
+from qonnx.core.datatype import DataType
+from qonnx.core.modelwrapper import ModelWrapper
+from qonnx.custom_op.registry import getCustomOp
+from qonnx.transformation.general import GiveUniqueNodeNames
+from qonnx.transformation.infer_shapes import InferShapes
+from qonnx.util.basic import qonnx_make_model
+
+from finn.analysis.fpgadataflow.dataflow_tokensim import node_txn_schedule
+from finn.transformation.fpgadataflow.derive_characteristic import (
+    DeriveFIFOSizes,
+    DeriveFIFOSizesIncremental,
+    chrc_fifo_depth,
+    get_changed_nodes,
+    min_phase_shift,
+)
+from finn.transformation.fpgadataflow.prepare_ip import PrepareIP
+from finn.util.basic import make_build_dir
+from finn.util.chrc_cache import CHRC_CACHE_STORED_ATTRS, chrc_cache_key, store_chrc
+from finn.util.fpgadataflow import cumulative_chrc, decode_chrc, encode_chrc
+
+
+def min_phase_shift_reference(prod_chrc, cons_chrc, period):
+    # the original search in DeriveFIFOSizes on the dense cumulative
+    # characteristic functions, trying every shift in turn
+    pshift_min = period - 1
+    for pshift_cand in range(period):
+        prod_chrc_part = prod_chrc[pshift_cand:period]
+        cons_chrc_part = cons_chrc[: period - pshift_cand]
+        if (prod_chrc_part >= cons_chrc_part).all():
+            pshift_min = pshift_cand
+            break
+    return pshift_min
+
+
+def chrc_fifo_depth_reference(prod_chrc, cons_chrc, period, pshift):
+    prod_chrc_part = prod_chrc[pshift : (pshift + period)]
+    cons_chrc_part = cons_chrc[:period]
+    return int((prod_chrc_part - cons_chrc_part).max())
+
+
+def make_stream_txns(period, n_txns, latency):
+    # n_txns transactions spread evenly after the given latency
+    txns = np.zeros(period, dtype=np.int32)
+    txns[latency + np.arange(n_txns) * (period - latency) // n_txns] = 1
+    return txns
+
+
+def check_fifo_sizing(prod_txns, cons_txns, period):
+    # compare the compact against the dense computation, returns both results
+    prod = decode_chrc(encode_chrc([prod_txns]), period)[0]
+    cons = decode_chrc(encode_chrc([cons_txns]), period)[0]
+    prod_chrc = cumulative_chrc(prod, period)
+    cons_chrc = cumulative_chrc(cons, period)
+    pshift = min_phase_shift(prod, cons, period)
+    assert pshift == min_phase_shift_reference(prod_chrc, cons_chrc, period)
+    depth = chrc_fifo_depth(prod, cons, period, pshift)
+    assert depth == chrc_fifo_depth_reference(prod_chrc, cons_chrc, period, pshift)
+    return (pshift, depth)
+
+
+def make_mvau_chain(n_layers, ch, idt):
+    # a chain of MVAUs, each folded to one channel per cycle
+    tensors = ["inp"] + ["act%d" % i for i in range(n_layers - 1)] + ["outp"]
+    nodes = []
+    for i in range(n_layers):
+        nodes.append(
+            helper.make_node(
+                "MatrixVectorActivation",
+                [tensors[i], "weights%d" % i],
+                [tensors[i + 1]],
+                domain="finn.custom_op.fpgadataflow",
+                backend="fpgadataflow",
+                MW=ch,
+                MH=ch,
+                SIMD=1,
+                PE=1,
+                inputDataType=idt.name,
+                weightDataType=idt.name,
+                outputDataType=idt.name,
+                ActVal=0,
+                binaryXnorMode=0,
+                noActivation=1,
+            )
+        )
+    inp = helper.make_tensor_value_info("inp", TensorProto.FLOAT, [1, ch])
+    outp = helper.make_tensor_value_info("outp", TensorProto.FLOAT, [1, ch])
+    graph = helper.make_graph(nodes, "mvau_chain", [inp], [outp])
+    model = ModelWrapper(qonnx_make_model(graph, producer_name="mvau-chain"))
+    for i, tensor_name in enumerate(tensors):
+        model.set_tensor_datatype(tensor_name, idt)
+    for i in range(n_layers):
+        model.set_initializer("weights%d" % i, np.ones((ch, ch), dtype=np.float32))
+        model.set_tensor_datatype("weights%d" % i, idt)
+    model = model.transform(InferShapes())
+    model = model.transform(GiveUniqueNodeNames())
+    return model
+
+
+def set_chrc_from_schedule(model, node, period):
+    # stands in for DeriveCharacteristic, takes the characteristic functions
+    # from the expected transaction schedule of the node instead of rtlsim
+    (in_cycles, out_cycles, ii) = node_txn_schedule(model, node)
+    txns_in = []
+    for cycles in in_cycles.values():
+        txns_in.append(np.zeros(period, dtype=np.int32))
+        txns_in[-1][cycles] = 1
+    txns_out = []
+    for cycles in out_cycles:
+        txns_out.append(np.zeros(period, dtype=np.int32))
+        txns_out[-1][cycles] = 1
+    inst = getCustomOp(node)
+    inst.set_nodeattr("io_chrc_period", period)
+    inst.set_nodeattr("io_chrc_in", encode_chrc(txns_in))
+    inst.set_nodeattr("io_chrc_out", encode_chrc(txns_out))
+
+
+def get_hw_config(model):
+    # the contents of the final_hw_config.json written by step_set_fifo_depths
+    hw_config = {"Defaults": {}}
+    for node in model.graph.node:
+        inst = getCustomOp(node)
+        hw_config[node.name] = {}
+        for attr_name in ["PE", "SIMD", "ram_style", "mem_mode", "inFIFODepths", "outFIFODepths"]:
+            hw_config[node.name][attr_name] = inst.get_nodeattr(attr_name)
+    return hw_config
+
+
+@pytest.mark.fpgadataflow
+def test_fifo_sizing_incremental(monkeypatch):
+    # no characteristic functions from the cache, MVAU_3 would need rtlsim
+    monkeypatch.setenv("FINN_CHRC_CACHE_SIZE_MB", "0")
+    ch = 8
+    period = 100
+    model = make_mvau_chain(4, ch, DataType["INT4"])
+    ref_model = copy.deepcopy(model)
+    for node in ref_model.graph.node:
+        set_chrc_from_schedule(ref_model, node, period)
+    ref_model = ref_model.transform(DeriveFIFOSizes())
+    ref_config = get_hw_config(ref_model)
+    # depths of the previous build on streams that are not affected
+    ref_config["MatrixVectorActivation_0"]["inFIFODepths"] = [77]
+    ref_config["MatrixVectorActivation_2"]["outFIFODepths"] = [123]
+    ref_config["MatrixVectorActivation_3"]["outFIFODepths"] = [45]
+    # FIFOs of the previous build are ignored
+    ref_config["StreamingFIFO_0"] = {"depth": 77}
+    assert get_changed_nodes(model, ref_config) == []
+
+    # change the folding of one layer, only it and its neighbours are
+    # characterized
+    getCustomOp(model.graph.node[1]).set_nodeattr("PE", 2)
+    assert get_changed_nodes(model, ref_config) == ["MatrixVectorActivation_1"]
+    for node in model.graph.node[:3]:
+        set_chrc_from_schedule(model, node, period)
+    incremental = DeriveFIFOSizesIncremental(ref_config, period)
+    model = model.transform(incremental)
+    assert incremental.changed_nodes == ["MatrixVectorActivation_1"]
+
+    # streams of the changed node are sized from the characteristic functions
+    expected = []
+    for i in range(2):
+        prod = getCustomOp(model.graph.node[i])
+        cons = getCustomOp(model.graph.node[i + 1])
+        prod_chrc = decode_chrc(prod.get_nodeattr("io_chrc_out"), period)[0]
+        cons_chrc = decode_chrc(cons.get_nodeattr("io_chrc_in"), period)[0]
+        pshift = min_phase_shift(prod_chrc, cons_chrc, period)
+        expected.append(chrc_fifo_depth(prod_chrc, cons_chrc, period, pshift))
+    assert expected[1] > 0
+    insts = [getCustomOp(x) for x in model.graph.node]
+    assert [x.get_nodeattr("inFIFODepths") for x in insts] == [
+        [77],
+        [expected[0]],
+        [expected[1]],
+        [123],
+    ]
+    assert [x.get_nodeattr("outFIFODepths") for x in insts] == [
+        [expected[0]],
+        [expected[1]],
+        [123],
+        [45],
+    ]
+
+    # a different graph cannot be sized incrementally
+    del ref_config["MatrixVectorActivation_3"]
+    assert get_changed_nodes(model, ref_config) is None
+    with pytest.raises(AssertionError):
+        model.transform(DeriveFIFOSizesIncremental(ref_config, period))
+
+
+@pytest.mark.fpgadataflow
+def test_fifo_sizing_incremental_ipgen(monkeypatch):
+    monkeypatch.setenv("FINN_CHRC_CACHE_DIR", make_build_dir("test_fifo_sizing_incremental_"))
+    monkeypatch.setenv("FINN_CHRC_CACHE_SIZE_MB", "1")
+    fpgapart = "xc7z020clg400-1"
+    clk = 10.0
+    period = 100
+    model = make_mvau_chain(4, 8, DataType["INT4"])
+    ref_config = get_hw_config(model)
+    getCustomOp(model.graph.node[1]).set_nodeattr("PE", 2)
+    for i in [0, 2]:
+        set_chrc_from_schedule(model, model.graph.node[i], period)
+    # the changed node is characterized already, for this FPGA part and clock
+    cached_model = copy.deepcopy(model)
+    set_chrc_from_schedule(cached_model, cached_model.graph.node[1], period)
+    cached_model = cached_model.transform(PrepareIP(fpgapart, clk))
+    cached_inst = getCustomOp(cached_model.graph.node[1])
+    store_chrc(
+        chrc_cache_key(cached_inst, period),
+        {x: cached_inst.get_nodeattr(x) for x in CHRC_CACHE_STORED_ATTRS},
+    )
+
+    model = model.transform(
+        DeriveFIFOSizesIncremental(ref_config, period, fpgapart=fpgapart, clk=clk)
+    )
+    insts = [getCustomOp(x) for x in model.graph.node]
+    # code is only generated for the changed node, which needs no HLS
+    # synthesis or rtlsim on a cache hit
+    assert insts[1].get_nodeattr("code_gen_dir_ipgen") != ""
+    assert insts[1].get_nodeattr("ipgen_path") == ""
+    assert insts[1].get_nodeattr("rtlsim_so") == ""
+    for i in [0, 2, 3]:
+        assert insts[i].get_nodeattr("code_gen_dir_ipgen") == ""
+    for attr_name in CHRC_CACHE_STORED_ATTRS:
+        assert insts[1].get_nodeattr(attr_name) == cached_inst.get_nodeattr(attr_name)
+
+
+@pytest.mark.fpgadataflow
+@pytest.mark.parametrize("period", [1, 2, 17, 100, 1000])
+@pytest.mark.parametrize("density", [0.0, 0.1, 0.5, 1.0])
+def test_fifo_sizing_chrc(period, density):
+    rng = np.random.default_rng(period)
+    for i in range(20):
+        prod_txns = (rng.random(period) < density).astype(np.int32)
+        cons_txns = (rng.random(period) < density).astype(np.int32)
+        check_fifo_sizing(prod_txns, cons_txns, period)
+
+
+@pytest.mark.fpgadataflow
+def test_fifo_sizing_chrc_examples():
+    period = 10
+    # producer outputs 5 tokens from cycle 3 on, consumer takes them from 0 on
+    prod_txns = np.asarray([0, 0, 0, 1, 1, 1, 1, 1, 0, 0])
+    cons_txns = np.asarray([1, 1, 1, 1, 1, 0, 0, 0, 0, 0])
+    # so that each token is consumed in the cycle it is produced
+    assert check_fifo_sizing(prod_txns, cons_txns, period) == (3, 0)
+    # the other way round, the tokens have to wait for the consumer
+    assert check_fifo_sizing(cons_txns, prod_txns, period) == (0, 3)
+    # consumer takes all tokens from the start, producer delivers them too late
+    prod_txns = np.asarray([0, 0, 0, 0, 0, 0, 0, 0, 0, 1])
+    assert check_fifo_sizing(prod_txns, cons_txns, period)[0] == 9
+    # producer never delivers anything
+    prod_txns = np.zeros(period, dtype=np.int32)
+    assert check_fifo_sizing(prod_txns, cons_txns, period)[0] == period - 1
+
+
+@pytest.mark.fpgadataflow
+def test_encode_chrc():
+    txns = [[1, 1, 0, 0, 1], [0, 0, 0, 0, 0], [0, 1, 1, 1, 1]]
+    chrc = encode_chrc(txns)
+    assert chrc == [4, 0, 2, 2, 1, 1, 5, 2, 1, 4]
+    decoded = decode_chrc(chrc, 5)
+    assert [x.tolist() for x in decoded] == [[0, 1, 4], [], [1, 2, 3, 4]]
+    assert cumulative_chrc(decoded[0], 5).tolist() == [1, 2, 2, 2, 3, 4, 5, 5, 5, 6]
+    with pytest.raises(AssertionError):
+        decode_chrc(chrc, 6)
+
+
+@pytest.mark.fpgadataflow
+def test_legacy_chrc():
+    # models characterized by older FINN versions store the dense cumulative
+    # characteristic functions over two periods as a tensor attribute
+    period = 5
+    txns = [[1, 1, 0, 0, 1], [0, 1, 1, 1, 1]]
+    legacy = np.stack([cumulative_chrc(np.flatnonzero(x), period) for x in txns])
+    decoded = decode_chrc(legacy, period)
+    assert [x.tolist() for x in decoded] == [[0, 1, 4], [1, 2, 3, 4]]
+    with pytest.raises(AssertionError):
+        decode_chrc(legacy, 6)
+    model = make_mvau_chain(1, 4, DataType["UINT4"])
+    node = model.graph.node[0]
+    node.attribute.append(helper.make_attribute("io_chrc_in", numpy_helper.from_array(legacy)))
+    inst = getCustomOp(node)
+    inst.set_nodeattr("io_chrc_period", period)
+    assert inst.get_nodeattr("io_chrc_in") == encode_chrc(txns)
+    assert inst.get_nodeattr("io_chrc_out") == []
+    # overwriting replaces the legacy tensor attribute
+    inst.set_nodeattr("io_chrc_in", encode_chrc(txns[:1]))
+    assert inst.get_nodeattr("io_chrc_in") == encode_chrc(txns[:1])
+
+
+@pytest.mark.slow
+@pytest.mark.fpgadataflow
+@pytest.mark.parametrize("period", [10**5, 10**6])
+def test_min_phase_shift_benchmark(period):
+    # a producer with some latency in front of a consumer with the same rate,
+    # so that the original search has to go through period // 100 shifts
+    prod = np.flatnonzero(make_stream_txns(period, period // 4, period // 100))
+    cons = np.flatnonzero(make_stream_txns(period, period // 4, 0))
+    start = time.perf_counter()
+    pshift = min_phase_shift(prod, cons, period)
+    depth = chrc_fifo_depth(prod, cons, period, pshift)
+    t_new = time.perf_counter() - start
+    prod_chrc = cumulative_chrc(prod, period)
+    cons_chrc = cumulative_chrc(cons, period)
+    start = time.perf_counter()
+    pshift_ref = min_phase_shift_reference(prod_chrc, cons_chrc, period)
+    depth_ref = chrc_fifo_depth_reference(prod_chrc, cons_chrc, period, pshift_ref)
+    t_ref = time.perf_counter() - start
+    assert (pshift, depth) == (pshift_ref, depth_ref)
+    # the search over all shifts grows quadratically with the period, the
+    # closed form linearly
+    assert t_new * 4 < t_ref
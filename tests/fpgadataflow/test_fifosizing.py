@@ -30,15 +30,34 @@
 import pytest
 
 import json
+import numpy as np
 import shutil
 import torch
 from brevitas.export import export_qonnx
+from onnx import TensorProto, helper
+from qonnx.core.datatype import DataType
 from qonnx.core.modelwrapper import ModelWrapper
 from qonnx.custom_op.registry import getCustomOp
+from qonnx.transformation.general import GiveUniqueNodeNames
+from qonnx.transformation.infer_shapes import InferShapes
+from qonnx.util.basic import qonnx_make_model
 
 import finn.builder.build_dataflow as build
 import finn.builder.build_dataflow_config as build_cfg
+from finn.analysis.fpgadataflow.dataflow_tokensim import (
+    dataflow_tokensim,
+    node_txn_schedule,
+)
+from finn.transformation.fpgadataflow.create_stitched_ip import CreateStitchedIP
+from finn.transformation.fpgadataflow.derive_characteristic import (
+    DeriveFIFOSizesTokenSim,
+)
+from finn.transformation.fpgadataflow.hlssynth_ip import HLSSynthIP
+from finn.transformation.fpgadataflow.insert_fifo import InsertFIFO
+from finn.transformation.fpgadataflow.prepare_ip import PrepareIP
 from finn.util.basic import make_build_dir
+from finn.util.fpgadataflow import encode_chrc
+from finn.util.pyverilator import verilator_fifosim
 from finn.util.test import get_trained_network_and_ishape
 
 
@@ -112,3 +131,175 @@ def test_fifosizing_linear(method, topology):
 
     shutil.rmtree(tmp_output_dir)
     shutil.rmtree(tmp_output_dir_cmp)
+
+
+def make_multi_io_model(ch, pe, idt):
+    # two input and two output streams:
+    # in0 -> DuplicateStreams -> (out0, dup1), AddStreams(dup1, in1) -> out1
+    in0 = helper.make_tensor_value_info("in0", TensorProto.FLOAT, [1, ch])
+    in1 = helper.make_tensor_value_info("in1", TensorProto.FLOAT, [1, ch])
+    out0 = helper.make_tensor_value_info("out0", TensorProto.FLOAT, [1, ch])
+    dup1 = helper.make_tensor_value_info("dup1", TensorProto.FLOAT, [1, ch])
+    out1 = helper.make_tensor_value_info("out1", TensorProto.FLOAT, [1, ch])
+    nodes = [
+        helper.make_node(
+            "DuplicateStreams_Batch",
+            ["in0"],
+            ["out0", "dup1"],
+            domain="finn.custom_op.fpgadataflow",
+            backend="fpgadataflow",
+            NumChannels=ch,
+            NumOutputStreams=2,
+            PE=pe,
+            inputDataType=idt.name,
+            numInputVectors=[1],
+        ),
+        helper.make_node(
+            "AddStreams_Batch",
+            ["dup1", "in1"],
+            ["out1"],
+            domain="finn.custom_op.fpgadataflow",
+            backend="fpgadataflow",
+            NumChannels=ch,
+            PE=pe,
+            inputDataType=idt.name,
+            numInputVectors=[1],
+        ),
+    ]
+    graph = helper.make_graph(nodes, "multi_io_graph", [in0, in1], [out0, out1], value_info=[dup1])
+    model = ModelWrapper(qonnx_make_model(graph, producer_name="multi-io-model"))
+    for tensor_name in ["in0", "in1", "out0", "dup1"]:
+        model.set_tensor_datatype(tensor_name, idt)
+    model.set_tensor_datatype("out1", DataType.get_smallest_possible(2 * idt.min()))
+    model = model.transform(InferShapes())
+    return model
+
+
+@pytest.mark.vivado
+@pytest.mark.fpgadataflow
+def test_verilator_fifosim_multi_io():
+    ch = 16
+    pe = 4
+    n_inputs = 5
+    model = make_multi_io_model(ch, pe, DataType["INT4"])
+    model = model.transform(InsertFIFO(create_shallow_fifos=True))
+    model = model.transform(GiveUniqueNodeNames())
+    model = model.transform(PrepareIP("xc7z020clg400-1", 5))
+    model = model.transform(HLSSynthIP())
+    model = model.transform(CreateStitchedIP("xc7z020clg400-1", 5))
+    sim = verilator_fifosim(model, n_inputs)
+    # every stream transfers ch / pe words per input sample
+    n_txns = (ch // pe) * n_inputs
+    for i in range(2):
+        assert sim["N_IN_TXNS_s_axis_%d" % i] == n_txns
+        assert 0 < sim["input_done_cycles_s_axis_%d" % i] <= sim["cycles"]
+    for o in range(2):
+        assert sim["N_OUT_TXNS_m_axis_%d" % o] == n_txns
+        assert 0 < sim["latency_cycles_m_axis_%d" % o] <= sim["cycles_m_axis_%d" % o]
+        assert sim["cycles_m_axis_%d" % o] <= sim["cycles"]
+    assert sim["N_IN_TXNS"] == 2 * n_txns
+    assert sim["N_OUT_TXNS"] == 2 * n_txns
+    assert sim["latency_cycles"] == max(sim["latency_cycles_m_axis_%d" % o] for o in range(2))
+
+
+def make_residual_model(ch, idt):
+    # DuplicateStreams -> (MVAU -> AddStreams, bypass -> AddStreams)
+    # with everything folded to one channel per cycle
+    inp = helper.make_tensor_value_info("inp", TensorProto.FLOAT, [1, ch])
+    outp = helper.make_tensor_value_info("outp", TensorProto.FLOAT, [1, ch])
+    value_info = [
+        helper.make_tensor_value_info(x, TensorProto.FLOAT, [1, ch])
+        for x in ["branch_in", "bypass", "branch_out"]
+    ]
+    nodes = [
+        helper.make_node(
+            "DuplicateStreams_Batch",
+            ["inp"],
+            ["branch_in", "bypass"],
+            domain="finn.custom_op.fpgadataflow",
+            backend="fpgadataflow",
+            NumChannels=ch,
+            NumOutputStreams=2,
+            PE=1,
+            inputDataType=idt.name,
+            numInputVectors=[1],
+        ),
+        helper.make_node(
+            "MatrixVectorActivation",
+            ["branch_in", "weights"],
+            ["branch_out"],
+            domain="finn.custom_op.fpgadataflow",
+            backend="fpgadataflow",
+            MW=ch,
+            MH=ch,
+            SIMD=1,
+            PE=1,
+            inputDataType=idt.name,
+            weightDataType=idt.name,
+            outputDataType=idt.name,
+            ActVal=0,
+            binaryXnorMode=0,
+            noActivation=1,
+        ),
+        helper.make_node(
+            "AddStreams_Batch",
+            ["branch_out", "bypass"],
+            ["outp"],
+            domain="finn.custom_op.fpgadataflow",
+            backend="fpgadataflow",
+            NumChannels=ch,
+            PE=1,
+            inputDataType=idt.name,
+            numInputVectors=[1],
+        ),
+    ]
+    graph = helper.make_graph(nodes, "residual_graph", [inp], [outp], value_info=value_info)
+    model = ModelWrapper(qonnx_make_model(graph, producer_name="residual-model"))
+    for tensor_name in ["inp", "branch_in", "bypass", "branch_out", "weights"]:
+        model.set_tensor_datatype(tensor_name, idt)
+    model.set_tensor_datatype("outp", DataType.get_smallest_possible(2 * idt.min()))
+    model.set_initializer("weights", np.ones((ch, ch), dtype=np.float32))
+    model = model.transform(InferShapes())
+    model = model.transform(GiveUniqueNodeNames())
+    return model
+
+
+@pytest.mark.fpgadataflow
+def test_fifosizing_tokensim():
+    ch = 16
+    model = make_residual_model(ch, DataType["INT4"])
+    sim = dataflow_tokensim(model, n_samples=3)
+    # the MVAU takes ch cycles per input token and ch * ch cycles per sample,
+    # the bypass needs to hold a whole sample until the MVAU outputs arrive
+    assert sim["fifo_depths"] == {"branch_in": ch - 1, "bypass": ch, "branch_out": 1}
+    assert sim["interval_cycles"] == ch * ch
+    assert sim["latency_cycles"] == ch * ch + 2
+    assert sim["cycles"] == 3 * ch * ch + 2
+    model = model.transform(DeriveFIFOSizesTokenSim(n_samples=3))
+    dup, mvau, add = [getCustomOp(x) for x in model.graph.node]
+    assert dup.get_nodeattr("outFIFODepths") == [ch - 1, ch]
+    assert dup.get_nodeattr("inFIFODepths") == [32]
+    assert mvau.get_nodeattr("outFIFODepths") == [1]
+    assert add.get_nodeattr("outFIFODepths") == [32]
+    # a stored characteristic function replaces the exp_cycles model,
+    # here the MVAU outputs come out 20 cycles later
+    model = make_residual_model(ch, DataType["INT4"])
+    mvau = getCustomOp(model.graph.node[1])
+    period = ch * ch + 30
+    txns_in = np.zeros(period, dtype=np.int32)
+    txns_in[np.arange(ch) * ch] = 1
+    txns_out = np.zeros(period, dtype=np.int32)
+    txns_out[np.arange(ch) * ch + ch - 1 + 20] = 1
+    mvau.set_nodeattr("io_chrc_period", period)
+    mvau.set_nodeattr("io_chrc_in", encode_chrc([txns_in]))
+    mvau.set_nodeattr("io_chrc_out", encode_chrc([txns_out]))
+    (in_cycles, out_cycles, ii) = node_txn_schedule(model, model.graph.node[1])
+    assert list(in_cycles.keys()) == [0]
+    assert (in_cycles[0] == np.arange(ch) * ch).all()
+    assert (out_cycles[0] == np.arange(ch) * ch + ch - 1 + 20).all()
+    assert ii == ch * ch
+    sim = dataflow_tokensim(model, n_samples=3)
+    assert sim["latency_cycles"] == ch * ch + 2 + 20
+    # the last token of a sample now leaves the bypass after the next sample
+    # started to arrive
+    assert sim["fifo_depths"]["bypass"] == ch + 1
@@ -0,0 +1,192 @@
+# Copyright (c) 2020, Xilinx
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of FINN nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import pytest
+
+import numpy as np
+from onnx import TensorProto, helper
+from qonnx.core.datatype import DataType
+from qonnx.core.modelwrapper import ModelWrapper
+from qonnx.custom_op.registry import getCustomOp
+from qonnx.transformation.general import GiveUniqueNodeNames
+from qonnx.transformation.infer_datatypes import InferDataTypes
+from qonnx.transformation.infer_shapes import InferShapes
+from qonnx.util.basic import gen_finn_dt_tensor, qonnx_make_model
+
+import finn.core.onnx_exec as oxe
+from finn.transformation.fpgadataflow.compile_cppsim import CompileCppSim
+from finn.transformation.fpgadataflow.hlssynth_ip import HLSSynthIP
+from finn.transformation.fpgadataflow.prepare_cppsim import PrepareCppSim
+from finn.transformation.fpgadataflow.prepare_ip import PrepareIP
+from finn.transformation.fpgadataflow.prepare_rtlsim import PrepareRTLSim
+from finn.transformation.fpgadataflow.set_exec_mode import SetExecMode
+from finn.util.cppsim import close_cppsim_workers
+
+
+def make_batch_test_model(ch, mh, pe, simd, idt, wdt):
+    # DuplicateStreams -> AddStreams -> MVAU (decoupled weights) -> LabelSelect,
+    # covering multi-input, multi-output and weight stream rtlsim
+    add_odt = DataType.get_smallest_possible(2 * idt.min())
+    acc_dt = DataType["INT32"]
+    label_dt = DataType.get_smallest_possible(mh - 1)
+    inp = helper.make_tensor_value_info("inp", TensorProto.FLOAT, [1, ch])
+    dup0 = helper.make_tensor_value_info("dup0", TensorProto.FLOAT, [1, ch])
+    dup1 = helper.make_tensor_value_info("dup1", TensorProto.FLOAT, [1, ch])
+    added = helper.make_tensor_value_info("added", TensorProto.FLOAT, [1, ch])
+    acc = helper.make_tensor_value_info("acc", TensorProto.FLOAT, [1, mh])
+    outp = helper.make_tensor_value_info("outp", TensorProto.INT64, [1, 3])
+    nodes = [
+        helper.make_node(
+            "DuplicateStreams_Batch",
+            ["inp"],
+            ["dup0", "dup1"],
+            domain="finn.custom_op.fpgadataflow",
+            backend="fpgadataflow",
+            NumChannels=ch,
+            NumOutputStreams=2,
+            PE=pe,
+            inputDataType=idt.name,
+            numInputVectors=[1],
+        ),
+        helper.make_node(
+            "AddStreams_Batch",
+            ["dup0", "dup1"],
+            ["added"],
+            domain="finn.custom_op.fpgadataflow",
+            backend="fpgadataflow",
+            NumChannels=ch,
+            PE=pe,
+            inputDataType=idt.name,
+            numInputVectors=[1],
+        ),
+        helper.make_node(
+            "MatrixVectorActivation",
+            ["added", "W"],
+            ["acc"],
+            domain="finn.custom_op.fpgadataflow",
+            backend="fpgadataflow",
+            MW=ch,
+            MH=mh,
+            SIMD=simd,
+            PE=pe,
+            inputDataType=add_odt.name,
+            weightDataType=wdt.name,
+            outputDataType=acc_dt.name,
+            noActivation=1,
+            binaryXnorMode=0,
+            mem_mode="decoupled",
+        ),
+        helper.make_node(
+            "LabelSelect_Batch",
+            ["acc"],
+            ["outp"],
+            domain="finn.custom_op.fpgadataflow",
+            backend="fpgadataflow",
+            Labels=mh,
+            PE=1,
+            K=3,
+            inputDataType=acc_dt.name,
+            outputDataType=label_dt.name,
+        ),
+    ]
+    graph = helper.make_graph(
+        nodes, "batch_graph", [inp], [outp], value_info=[dup0, dup1, added, acc]
+    )
+    model = ModelWrapper(qonnx_make_model(graph, producer_name="batch-model"))
+    model.set_tensor_datatype("inp", idt)
+    model.set_tensor_datatype("W", wdt)
+    model.set_initializer("W", gen_finn_dt_tensor(wdt, (ch, mh)))
+    model = model.transform(InferShapes())
+    model = model.transform(InferDataTypes())
+    model = model.transform(GiveUniqueNodeNames())
+    return model
+
+
+@pytest.mark.parametrize("exec_mode", ["python", "cppsim", "rtlsim"])
+@pytest.mark.parametrize("n_samples", [1, 4])
+@pytest.mark.fpgadataflow
+@pytest.mark.vivado
+def test_fpgadataflow_execute_batch(exec_mode, n_samples):
+    ch = 8
+    mh = 6
+    idt = DataType["INT4"]
+    wdt = DataType["INT2"]
+    model = make_batch_test_model(ch, mh, 2, 4, idt, wdt)
+    if exec_mode == "cppsim":
+        model = model.transform(PrepareCppSim())
+        model = model.transform(CompileCppSim())
+    elif exec_mode == "rtlsim":
+        model = model.transform(PrepareIP("xc7z020clg400-1", 5))
+        model = model.transform(HLSSynthIP())
+        model = model.transform(PrepareRTLSim())
+    model = model.transform(SetExecMode(exec_mode))
+    xs = [gen_finn_dt_tensor(idt, (1, ch)) for i in range(n_samples)]
+    # one execution for all samples must match executing them one by one
+    y_batch = oxe.execute_onnx_batch(model, [{"inp": x} for x in xs])
+    assert len(y_batch) == n_samples
+    if exec_mode == "rtlsim":
+        insts = [getCustomOp(node) for node in model.graph.node]
+        batch_cycles = [inst.get_nodeattr("cycles_rtlsim") for inst in insts]
+        total_cycles = [inst.get_nodeattr("cycles_rtlsim_batch") for inst in insts]
+        assert all([c > 0 for c in batch_cycles])
+        assert all([t >= c for t, c in zip(total_cycles, batch_cycles)])
+    W = model.get_initializer("W")
+    for x, y in zip(xs, y_batch):
+        y_single = oxe.execute_onnx(model, {"inp": x})["outp"]
+        assert (y["outp"] == y_single).all()
+        # LabelSelect breaks ties by the smaller index
+        acc = np.matmul(2 * x, W)
+        y_expected = np.argsort(-acc.flatten(), kind="stable")[:3]
+        assert (y["outp"].flatten() == y_expected).all()
+    if exec_mode == "rtlsim":
+        # cycles_rtlsim keeps the count of a single sample in batched rtlsim
+        oxe.execute_onnx(model, {"inp": xs[0]})
+        assert [inst.get_nodeattr("cycles_rtlsim") for inst in insts] == batch_cycles
+
+
+@pytest.mark.fpgadataflow
+@pytest.mark.vivado
+def test_fpgadataflow_cppsim_workers(monkeypatch):
+    # the MVAU with decoupled weights reads weights.npy from its code generation
+    # dir, while the worker exchanges the inputs and outputs in its I/O dir
+    ch = 8
+    idt = DataType["INT4"]
+    model = make_batch_test_model(ch, 6, 2, 4, idt, DataType["INT2"])
+    model = model.transform(PrepareCppSim())
+    model = model.transform(CompileCppSim())
+    model = model.transform(SetExecMode("cppsim"))
+    xs = [gen_finn_dt_tensor(idt, (1, ch)) for i in range(3)]
+    monkeypatch.delenv("FINN_CPPSIM_WORKERS", raising=False)
+    ys = [oxe.execute_onnx(model, {"inp": x})["outp"] for x in xs]
+    monkeypatch.setenv("FINN_CPPSIM_WORKERS", "1")
+    for x, y in zip(xs, ys):
+        assert (oxe.execute_onnx(model, {"inp": x})["outp"] == y).all()
+    y_batch = oxe.execute_onnx_batch(model, [{"inp": x} for x in xs])
+    for y_b, y in zip(y_batch, ys):
+        assert (y_b["outp"] == y).all()
+    close_cppsim_workers()
@@ -52,6 +52,7 @@ from finn.transformation.fpgadataflow.prepare_cppsim import PrepareCppSim
 from finn.transformation.fpgadataflow.prepare_ip import PrepareIP
 from finn.transformation.fpgadataflow.prepare_rtlsim import PrepareRTLSim
 from finn.transformation.fpgadataflow.set_exec_mode import SetExecMode
+from finn.util.fpgadataflow import cumulative_chrc, decode_chrc
 
 
 def make_single_fclayer_modelwrapper(W, pe, simd, wdt, idt, odt, T=None, tdt=None):
@@ -478,11 +479,13 @@ def test_fclayer_fifocharacterize_rtlsim(mem_mode, idt, wdt, act, nf, sf, mw, mh
     node_inst = getCustomOp(model.graph.node[0])
     period_attr = node_inst.get_nodeattr("io_chrc_period")
     assert period_attr == exp_total_cycles
-    chrc_in = node_inst.get_nodeattr("io_chrc_in")
-    chrc_out = node_inst.get_nodeattr("io_chrc_out")
-    assert chrc_in.shape == (1, 2 * exp_total_cycles)
-    assert chrc_out.shape == (1, 2 * exp_total_cycles)
+    chrc_in = decode_chrc(node_inst.get_nodeattr("io_chrc_in"), exp_total_cycles)
+    chrc_out = decode_chrc(node_inst.get_nodeattr("io_chrc_out"), exp_total_cycles)
+    assert len(chrc_in) == 1
+    assert len(chrc_out) == 1
+    chrc_in = cumulative_chrc(chrc_in[0], exp_total_cycles)
+    chrc_out = cumulative_chrc(chrc_out[0], exp_total_cycles)
     # first sf cycles should read input continuously
-    assert (chrc_in[0, :sf] == range(1, sf + 1)).all()
+    assert (chrc_in[:sf] == range(1, sf + 1)).all()
     # all outputs should be produced within the exp n of cycles
-    assert chrc_out[0, exp_total_cycles] == nf
+    assert chrc_out[exp_total_cycles] == nf
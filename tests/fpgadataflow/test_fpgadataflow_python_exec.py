@@ -0,0 +1,875 @@
+# Copyright (c) 2020, Xilinx
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of FINN nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import pytest
+
+import numpy as np
+import os
+import qonnx.core.data_layout as DataLayout
+from onnx import TensorProto, helper
+from qonnx.core.datatype import DataType
+from qonnx.core.modelwrapper import ModelWrapper
+from qonnx.custom_op.general.im2col import compute_conv_output_dim
+from qonnx.custom_op.general.maxpoolnhwc import compute_pool_output_dim
+from qonnx.custom_op.registry import getCustomOp
+from qonnx.transformation.bipolar_to_xnor import ConvertBipolarMatMulToXnorPopcount
+from qonnx.transformation.general import GiveUniqueNodeNames
+from qonnx.transformation.infer_datatypes import InferDataTypes
+from qonnx.transformation.infer_shapes import InferShapes
+from qonnx.util.basic import (
+    calculate_signed_dot_prod_range,
+    gen_finn_dt_tensor,
+    qonnx_make_model,
+)
+
+import finn.core.onnx_exec as oxe
+from finn.transformation.fpgadataflow.compile_cppsim import CompileCppSim
+from finn.transformation.fpgadataflow.convert_to_hls_layers import (
+    InferAddStreamsLayer,
+    InferBinaryMatrixVectorActivation,
+    InferChannelwiseLinearLayer,
+    InferConcatLayer,
+    InferConvInpGen,
+    InferDuplicateStreamsLayer,
+    InferLabelSelectLayer,
+    InferLookupLayer,
+    InferPool_Batch,
+    InferQuantizedMatrixVectorActivation,
+    InferStreamingEltwise,
+    InferStreamingMaxPool,
+    InferThresholdingLayer,
+    InferUpsample,
+    InferVectorVectorActivation,
+)
+from finn.transformation.fpgadataflow.insert_dwc import InsertDWC
+from finn.transformation.fpgadataflow.insert_fifo import InsertFIFO
+from finn.transformation.fpgadataflow.prepare_cppsim import PrepareCppSim
+from finn.transformation.fpgadataflow.set_exec_mode import SetExecMode
+from finn.transformation.streamline import Streamline
+
+# The golden models below are the same reference graphs the cppsim/rtlsim
+# tests of the individual layers compare against, converted to HLS layers
+# and executed with exec_mode python.
+
+
+def make_conv_reference_model(idt, wdt, act, k, ifm_dim, ifm_ch, ofm_ch, stride, pad, dw):
+    # Im2Col + MatMul (+ MultiThreshold), as produced by LowerConvsToMatMul
+    ofm_dim = compute_conv_output_dim(ifm_dim, k, stride, total_pad=2 * pad)
+    if dw:
+        ofm_ch = ifm_ch
+    inp = helper.make_tensor_value_info("inp", TensorProto.FLOAT, [1, ifm_dim, ifm_dim, ifm_ch])
+    outp = helper.make_tensor_value_info("outp", TensorProto.FLOAT, [1, ofm_dim, ofm_dim, ofm_ch])
+    nodes = [
+        helper.make_node(
+            "Im2Col",
+            ["inp"],
+            ["im2col_out"],
+            domain="qonnx.custom_op.general",
+            kernel_size=[k, k],
+            stride=[stride, stride],
+            pad_amount=[pad, pad, pad, pad],
+            input_shape="(1, {}, {}, {})".format(ifm_dim, ifm_dim, ifm_ch),
+            depthwise=dw,
+        ),
+        helper.make_node("MatMul", ["im2col_out", "W"], ["acc" if act else "outp"]),
+    ]
+    if act is not None:
+        nodes.append(
+            helper.make_node(
+                "MultiThreshold",
+                ["acc", "T"],
+                ["outp"],
+                domain="qonnx.custom_op.general",
+                data_layout="NHWC",
+                out_dtype=act.name,
+                out_bias=float(act.min()),
+            )
+        )
+    graph = helper.make_graph(nodes, "conv_graph", [inp], [outp])
+    model = ModelWrapper(qonnx_make_model(graph, producer_name="conv-model"))
+    model.set_tensor_datatype("inp", idt)
+    model.set_tensor_datatype("W", wdt)
+    if dw:
+        # sparse weight matrix with a single nonzero input channel per output
+        w_tensor = gen_finn_dt_tensor(wdt, [ofm_ch, 1, k, k])
+        W = np.zeros((ofm_ch, ifm_ch, k, k), dtype=np.float32)
+        for ch in range(ifm_ch):
+            W[ch][ch] = w_tensor[ch][0]
+        W = W.transpose(0, 2, 3, 1).reshape(ofm_ch, -1).T
+        model.set_initializer("W", W)
+        model.set_tensor_sparsity("W", {"dw": {"kernel_shape": [k, k]}})
+    else:
+        model.set_initializer("W", gen_finn_dt_tensor(wdt, [k * k * ifm_ch, ofm_ch]))
+    if act is not None:
+        (min_v, max_v) = calculate_signed_dot_prod_range(idt, wdt, k * k * ifm_ch)
+        n_steps = act.get_num_possible_values() - 1
+        T = np.random.randint(min_v, max_v - 1, (ofm_ch, n_steps)).astype(np.float32)
+        model.set_initializer("T", np.sort(T, axis=1))
+        model.set_tensor_datatype("T", DataType["INT32"])
+    model = model.transform(InferShapes())
+    model = model.transform(InferDataTypes())
+    return model
+
+
+def set_folding(model, simd, pe):
+    for node in model.graph.node:
+        inst = getCustomOp(node)
+        if node.op_type.startswith("ConvolutionInputGenerator"):
+            inst.set_nodeattr("SIMD", simd)
+        elif node.op_type in ["MatrixVectorActivation", "Pool_Batch", "VectorVectorActivation"]:
+            inst.set_nodeattr("PE", pe)
+            if node.op_type == "MatrixVectorActivation":
+                inst.set_nodeattr("SIMD", simd)
+
+
+def make_input_dict(model, x):
+    # x is the input for a single-input graph, or a list with one per input
+    xs = x if isinstance(x, list) else [x]
+    return {inp.name: xi for (inp, xi) in zip(model.graph.input, xs)}
+
+
+def check_python_exec(golden, model, x, x_model=None):
+    out_name = golden.graph.output[0].name
+    y_expected = oxe.execute_onnx(golden, make_input_dict(golden, x))[out_name]
+    model = model.transform(GiveUniqueNodeNames())
+    model = model.transform(SetExecMode("python"))
+    assert all([n.domain == "finn.custom_op.fpgadataflow" for n in model.graph.node])
+    input_dict = make_input_dict(model, x if x_model is None else x_model)
+    y_produced = oxe.execute_onnx(model, input_dict)[model.graph.output[0].name]
+    assert y_produced.shape == y_expected.shape
+    assert (y_produced == y_expected).all()
+
+
+@pytest.mark.parametrize("act", [None, DataType["BIPOLAR"], DataType["INT4"]])
+@pytest.mark.parametrize("wdt", [DataType["BIPOLAR"], DataType["INT4"]])
+@pytest.mark.parametrize("idt", [DataType["BIPOLAR"], DataType["INT4"]])
+@pytest.mark.fpgadataflow
+def test_fpgadataflow_python_exec_mvau(idt, wdt, act):
+    binary_xnor = idt == wdt == DataType["BIPOLAR"]
+    if binary_xnor and act is None:
+        pytest.skip("XnorPopcountMatMul without thresholds is not converted to MVAU")
+    mw = 12
+    mh = 8
+    vecs = 5
+    inp = helper.make_tensor_value_info("inp", TensorProto.FLOAT, [vecs, mw])
+    outp = helper.make_tensor_value_info("outp", TensorProto.FLOAT, [vecs, mh])
+    nodes = [helper.make_node("MatMul", ["inp", "W"], ["acc" if act else "outp"])]
+    if act is not None:
+        if act == DataType["BIPOLAR"]:
+            (out_scale, out_bias) = (2.0, -1.0)
+        else:
+            (out_scale, out_bias) = (1.0, float(act.min()))
+        nodes.append(
+            helper.make_node(
+                "MultiThreshold",
+                ["acc", "T"],
+                ["outp"],
+                domain="qonnx.custom_op.general",
+                out_dtype=act.name,
+                out_scale=out_scale,
+                out_bias=out_bias,
+            )
+        )
+    graph = helper.make_graph(nodes, "fc_graph", [inp], [outp])
+    golden = ModelWrapper(qonnx_make_model(graph, producer_name="fc-model"))
+    golden.set_tensor_datatype("inp", idt)
+    golden.set_tensor_datatype("W", wdt)
+    golden.set_initializer("W", gen_finn_dt_tensor(wdt, (mw, mh)))
+    if act is not None:
+        (min_v, max_v) = calculate_signed_dot_prod_range(idt, wdt, mw)
+        n_steps = act.get_num_possible_values() - 1
+        T = np.random.randint(min_v, max_v - 1, (mh, n_steps)).astype(np.float32)
+        golden.set_initializer("T", np.sort(T, axis=1))
+        golden.set_tensor_datatype("T", DataType["INT32"])
+    golden = golden.transform(InferShapes())
+    golden = golden.transform(InferDataTypes())
+    x = gen_finn_dt_tensor(idt, (vecs, mw))
+    if binary_xnor:
+        # binary inputs and weights, xnor-popcount with adjusted thresholds
+        model = golden.transform(ConvertBipolarMatMulToXnorPopcount())
+        model = model.transform(Streamline())
+        model = model.transform(InferBinaryMatrixVectorActivation())
+        set_folding(model, 3, 2)
+        check_python_exec(golden, model, x, (x + 1) / 2)
+    else:
+        model = golden.transform(InferQuantizedMatrixVectorActivation())
+        set_folding(model, 3, 2)
+        check_python_exec(golden, model, x)
+
+
+@pytest.mark.parametrize("act", [None, DataType["UINT4"]])
+@pytest.mark.parametrize("k", [1, 3])
+@pytest.mark.parametrize("stride", [1, 2])
+@pytest.mark.parametrize("pad", [0, 1])
+@pytest.mark.parametrize("dw", [0, 1])
+@pytest.mark.parametrize("simd_pe", [(1, 1), (2, 4), (4, 2)])
+@pytest.mark.parametrize("use_rtl_swg", [False, True])
+@pytest.mark.fpgadataflow
+def test_fpgadataflow_python_exec_conv(act, k, stride, pad, dw, simd_pe, use_rtl_swg):
+    idt = wdt = DataType["INT4"]
+    ifm_dim = 7
+    ifm_ch = 4
+    ofm_ch = 8
+    (simd, pe) = simd_pe
+    if dw:
+        # the sliding window generator has to match the VVAU channel folding
+        simd = pe
+    golden = make_conv_reference_model(idt, wdt, act, k, ifm_dim, ifm_ch, ofm_ch, stride, pad, dw)
+    model = golden.transform(InferConvInpGen(use_rtl_variant=use_rtl_swg))
+    if dw:
+        model = model.transform(InferVectorVectorActivation())
+    else:
+        model = model.transform(InferQuantizedMatrixVectorActivation())
+    set_folding(model, simd, pe)
+    check_python_exec(golden, model, gen_finn_dt_tensor(idt, (1, ifm_dim, ifm_dim, ifm_ch)))
+
+
+@pytest.mark.parametrize("idt", [DataType["BIPOLAR"], DataType["INT4"]])
+@pytest.mark.parametrize("k", [2, 3])
+@pytest.mark.parametrize("ifm_dim", [6, 7])
+@pytest.mark.parametrize("dim_1d", [False, True])
+@pytest.mark.parametrize("use_pool_batch", [False, True])
+@pytest.mark.fpgadataflow
+def test_fpgadataflow_python_exec_maxpool(idt, k, ifm_dim, dim_1d, use_pool_batch):
+    ifm_ch = 4
+    ceil_mode = 1 if dim_1d else 0
+    if not dim_1d and ifm_dim % k != 0:
+        pytest.skip("StreamingMaxPool_2d needs ImgDim % PoolDim == 0")
+    if (use_pool_batch or dim_1d) and idt == DataType["BIPOLAR"]:
+        pytest.skip("BIPOLAR is only converted for 2D StreamingMaxPool")
+    if use_pool_batch and dim_1d:
+        pytest.skip("Pool_Batch is not inferred for 1D pooling")
+    (ifm_dim_h, ifm_dim_w) = (ifm_dim, 1) if dim_1d else (ifm_dim, ifm_dim)
+    (k_h, k_w) = (k, 1) if dim_1d else (k, k)
+    ofm_dim_h = compute_pool_output_dim(ifm_dim_h, k_h, k_h, 0, ceil_mode)
+    ofm_dim_w = compute_pool_output_dim(ifm_dim_w, k_w, k_w, 0, ceil_mode)
+    inp = helper.make_tensor_value_info("inp", TensorProto.FLOAT, [1, ifm_dim_h, ifm_dim_w, ifm_ch])
+    outp = helper.make_tensor_value_info(
+        "outp", TensorProto.FLOAT, [1, ofm_dim_h, ofm_dim_w, ifm_ch]
+    )
+    mp_node = helper.make_node(
+        "MaxPoolNHWC",
+        ["inp"],
+        ["outp"],
+        domain="qonnx.custom_op.general",
+        kernel_shape=[k_h, k_w],
+        strides=[k_h, k_w],
+        ceil_mode=ceil_mode,
+        pads=[0, 0, 0, 0],
+    )
+    graph = helper.make_graph([mp_node], "mp_graph", [inp], [outp])
+    golden = ModelWrapper(qonnx_make_model(graph, producer_name="mp-model"))
+    golden.set_tensor_datatype("inp", idt)
+    golden.set_tensor_datatype("outp", idt)
+    if use_pool_batch:
+        model = golden.transform(InferPool_Batch())
+        model = model.transform(InferConvInpGen())
+        set_folding(model, 2, 2)
+    else:
+        model = golden.transform(InferStreamingMaxPool())
+    model = model.transform(InferShapes())
+    check_python_exec(golden, model, gen_finn_dt_tensor(idt, (1, ifm_dim_h, ifm_dim_w, ifm_ch)))
+
+
+@pytest.mark.parametrize("labels", [10, 24])
+@pytest.mark.parametrize("k", [1, 5])
+@pytest.mark.fpgadataflow
+def test_fpgadataflow_python_exec_labelselect(labels, k):
+    idt = DataType["UINT4"]
+    inp = helper.make_tensor_value_info("inp", TensorProto.FLOAT, [1, labels])
+    outp = helper.make_tensor_value_info("outp", TensorProto.INT64, [1, k])
+    topk_node = helper.make_node("TopK", ["inp", "k"], ["values", "outp"], axis=-1)
+    graph = helper.make_graph([topk_node], "topk_graph", [inp], [outp])
+    golden = ModelWrapper(qonnx_make_model(graph, producer_name="topk-model"))
+    golden.set_tensor_datatype("inp", idt)
+    golden.set_initializer("k", np.asarray([k], dtype=np.int64))
+    golden = golden.transform(InferShapes())
+    model = golden.transform(InferLabelSelectLayer())
+    model = model.transform(InferShapes())
+    # few distinct values, so ties have to be broken like TopK does
+    check_python_exec(golden, model, gen_finn_dt_tensor(idt, (1, labels)))
+
+
+@pytest.mark.parametrize("idt", [DataType["INT4"], DataType["UINT8"]])
+@pytest.mark.parametrize("act", [DataType["INT3"], DataType["UINT2"]])
+@pytest.mark.parametrize("global_thresholds", [False, True])
+@pytest.mark.fpgadataflow
+def test_fpgadataflow_python_exec_thresholding(idt, act, global_thresholds):
+    ch = 6
+    vecs = 4
+    inp = helper.make_tensor_value_info("inp", TensorProto.FLOAT, [vecs, ch])
+    outp = helper.make_tensor_value_info("outp", TensorProto.FLOAT, [vecs, ch])
+    mt_node = helper.make_node(
+        "MultiThreshold",
+        ["inp", "T"],
+        ["outp"],
+        domain="qonnx.custom_op.general",
+        out_dtype=act.name,
+        out_bias=float(act.min()),
+    )
+    graph = helper.make_graph([mt_node], "mt_graph", [inp], [outp])
+    golden = ModelWrapper(qonnx_make_model(graph, producer_name="mt-model"))
+    golden.set_tensor_datatype("inp", idt)
+    n_steps = act.get_num_possible_values() - 1
+    T = gen_finn_dt_tensor(idt, (1 if global_thresholds else ch, n_steps))
+    golden.set_initializer("T", np.sort(T, axis=1))
+    golden.set_tensor_datatype("T", idt)
+    golden = golden.transform(InferShapes())
+    golden = golden.transform(InferDataTypes())
+    model = golden.transform(InferThresholdingLayer())
+    getCustomOp(model.graph.node[0]).set_nodeattr("PE", 2)
+    check_python_exec(golden, model, gen_finn_dt_tensor(idt, (vecs, ch)))
+
+
+def make_hls_model(golden, nodes):
+    # a graph of hand-made HLS layers with the same inputs and outputs as the
+    # golden model, for layers that no conversion transformation produces
+    outputs = []
+    for outp in golden.graph.output:
+        oshape = golden.get_tensor_shape(outp.name)
+        outputs.append(helper.make_tensor_value_info(outp.name, TensorProto.FLOAT, oshape))
+    graph = helper.make_graph(nodes, "hls_graph", golden.graph.input, outputs)
+    model = ModelWrapper(qonnx_make_model(graph, producer_name="hls-model"))
+    for inp in golden.graph.input:
+        model.set_tensor_datatype(inp.name, golden.get_tensor_datatype(inp.name))
+    model = model.transform(InferShapes())
+    model = model.transform(InferDataTypes())
+    return model
+
+
+def make_im2col_model(idt, ifm_dim, ch, k, stride, pad):
+    # a single Im2Col node, as produced by LowerConvsToMatMul
+    (ifm_dim_h, ifm_dim_w) = ifm_dim
+    (k_h, k_w) = k
+    (stride_h, stride_w) = stride
+    ofm_dim_h = compute_conv_output_dim(ifm_dim_h, k_h, stride_h, total_pad=pad[0] + pad[2])
+    ofm_dim_w = compute_conv_output_dim(ifm_dim_w, k_w, stride_w, total_pad=pad[1] + pad[3])
+    inp = helper.make_tensor_value_info("inp", TensorProto.FLOAT, [1, ifm_dim_h, ifm_dim_w, ch])
+    outp = helper.make_tensor_value_info(
+        "outp", TensorProto.FLOAT, [1, ofm_dim_h, ofm_dim_w, k_h * k_w * ch]
+    )
+    im2col_node = helper.make_node(
+        "Im2Col",
+        ["inp"],
+        ["outp"],
+        domain="qonnx.custom_op.general",
+        kernel_size=[k_h, k_w],
+        stride=[stride_h, stride_w],
+        pad_amount=list(pad),
+        input_shape="(1, {}, {}, {})".format(ifm_dim_h, ifm_dim_w, ch),
+    )
+    graph = helper.make_graph([im2col_node], "im2col_graph", [inp], [outp])
+    model = ModelWrapper(qonnx_make_model(graph, producer_name="im2col-model"))
+    model.set_tensor_datatype("inp", idt)
+    model = model.transform(InferShapes())
+    model = model.transform(InferDataTypes())
+    return model
+
+
+def make_downsampler_models(ifm_dim, stride, dim_mode):
+    # a pointwise strided Im2Col is converted into a DownSampler, 1D along H
+    # (unit W) or along W (unit H)
+    idt = DataType["INT4"]
+    ch = 4
+    (ifm_dim_h, ifm_dim_w) = {"2d": (ifm_dim, ifm_dim), "1d": (ifm_dim, 1), "1d_w": (1, ifm_dim)}[
+        dim_mode
+    ]
+    stride_h = stride if ifm_dim_h > 1 else 1
+    stride_w = stride if ifm_dim_w > 1 else 1
+    golden = make_im2col_model(
+        idt, (ifm_dim_h, ifm_dim_w), ch, (1, 1), (stride_h, stride_w), (0, 0, 0, 0)
+    )
+    model = golden.transform(InferConvInpGen())
+    assert [n.op_type for n in model.graph.node] == ["DownSampler"]
+    getCustomOp(model.graph.node[0]).set_nodeattr("SIMD", 2)
+    return (golden, model, gen_finn_dt_tensor(idt, (1, ifm_dim_h, ifm_dim_w, ch)))
+
+
+def make_upsampler_models(ifm_dim, scale, is_1d):
+    # nearest neighbour Resize on NHWC data, 1D upsampling only along H
+    idt = DataType["INT8"]
+    ch = 3
+    ifm_dim_w = 1 if is_1d else ifm_dim
+    ofm_dim_w = 1 if is_1d else ifm_dim * scale
+    inp = helper.make_tensor_value_info("inp", TensorProto.FLOAT, [1, ifm_dim, ifm_dim_w, ch])
+    outp = helper.make_tensor_value_info(
+        "outp", TensorProto.FLOAT, [1, ifm_dim * scale, ofm_dim_w, ch]
+    )
+    resize_node = helper.make_node(
+        "Resize",
+        ["inp", "roi", "scales"],
+        ["outp"],
+        mode="nearest",
+        coordinate_transformation_mode="asymmetric",
+        nearest_mode="floor",
+    )
+    graph = helper.make_graph([resize_node], "resize_graph", [inp], [outp])
+    golden = ModelWrapper(qonnx_make_model(graph, producer_name="resize-model"))
+    golden.set_tensor_datatype("inp", idt)
+    golden.set_tensor_layout("inp", DataLayout.NHWC)
+    golden.set_initializer("roi", np.zeros((0,), dtype=np.float32))
+    scales = [1, scale, 1 if is_1d else scale, 1]
+    golden.set_initializer("scales", np.asarray(scales, dtype=np.float32))
+    model = golden.transform(InferUpsample())
+    assert [n.op_type for n in model.graph.node] == ["UpsampleNearestNeighbour_Batch"]
+    return (golden, model, gen_finn_dt_tensor(idt, (1, ifm_dim, ifm_dim_w, ch)))
+
+
+def make_fmpadding_models(ifm_dim, padding, optype):
+    # constant zero Pad on NHWC data, padding given as [top, left, bottom, right]
+    # like FMPadding and Im2Col
+    idt = DataType["INT4"]
+    ch = 4
+    (ifm_dim_h, ifm_dim_w) = ifm_dim
+    (pad_t, pad_l, pad_b, pad_r) = padding
+    ofm_dim_h = ifm_dim_h + pad_t + pad_b
+    ofm_dim_w = ifm_dim_w + pad_l + pad_r
+    inp = helper.make_tensor_value_info("inp", TensorProto.FLOAT, [1, ifm_dim_h, ifm_dim_w, ch])
+    outp = helper.make_tensor_value_info("outp", TensorProto.FLOAT, [1, ofm_dim_h, ofm_dim_w, ch])
+    pad_node = helper.make_node("Pad", ["inp", "pads"], ["outp"], mode="constant")
+    graph = helper.make_graph([pad_node], "pad_graph", [inp], [outp])
+    golden = ModelWrapper(qonnx_make_model(graph, producer_name="pad-model"))
+    golden.set_tensor_datatype("inp", idt)
+    pads = [0, pad_t, pad_l, 0, 0, pad_b, pad_r, 0]
+    golden.set_initializer("pads", np.asarray(pads, dtype=np.int64))
+    # same attributes as set by InferConvInpGen
+    padding_node = helper.make_node(
+        optype,
+        ["inp"],
+        ["outp"],
+        domain="finn.custom_op.fpgadataflow",
+        backend="fpgadataflow",
+        ImgDim=[ifm_dim_h, ifm_dim_w],
+        Padding=list(padding),
+        NumChannels=ch,
+        inputDataType=idt.name,
+        SIMD=2,
+    )
+    model = make_hls_model(golden, [padding_node])
+    return (golden, model, gen_finn_dt_tensor(idt, (1, ifm_dim_h, ifm_dim_w, ch)))
+
+
+def make_channelwise_models(func, idt):
+    # per-channel Add/Mul converted by InferChannelwiseLinearLayer, the
+    # comparisons as hand-made layers against LessOrEqual/GreaterOrEqual
+    ch = 6
+    ishape = [1, 3, 3, ch]
+    params = gen_finn_dt_tensor(idt, (ch,))
+    inp = helper.make_tensor_value_info("inp", TensorProto.FLOAT, ishape)
+    if func in ["add", "mul"]:
+        outp = helper.make_tensor_value_info("outp", TensorProto.FLOAT, ishape)
+        op_type = {"add": "Add", "mul": "Mul"}[func]
+        lin_node = helper.make_node(op_type, ["inp", "params"], ["outp"])
+        graph = helper.make_graph([lin_node], "lin_graph", [inp], [outp])
+        golden = ModelWrapper(qonnx_make_model(graph, producer_name="lin-model"))
+        golden.set_tensor_datatype("inp", idt)
+        golden.set_tensor_layout("inp", DataLayout.NHWC)
+        golden.set_initializer("params", params)
+        golden = golden.transform(InferShapes())
+        model = golden.transform(InferChannelwiseLinearLayer())
+        assert [n.op_type for n in model.graph.node] == ["ChannelwiseOp_Batch"]
+    else:
+        # func(parameter, input) in hlslib
+        outp = helper.make_tensor_value_info("outp", TensorProto.BOOL, ishape)
+        op_type = {"cmp_le": "LessOrEqual", "cmp_ge": "GreaterOrEqual"}[func]
+        cmp_node = helper.make_node(op_type, ["params", "inp"], ["outp"])
+        graph = helper.make_graph([cmp_node], "cmp_graph", [inp], [outp])
+        golden = ModelWrapper(
+            qonnx_make_model(
+                graph, producer_name="cmp-model", opset_imports=[helper.make_opsetid("", 13)]
+            )
+        )
+        golden.set_tensor_datatype("inp", idt)
+        golden.set_initializer("params", params)
+        cw_node = helper.make_node(
+            "ChannelwiseOp_Batch",
+            ["inp", "params"],
+            ["outp"],
+            domain="finn.custom_op.fpgadataflow",
+            backend="fpgadataflow",
+            Func=func,
+            NumChannels=ch,
+            PE=1,
+            inputDataType=idt.name,
+            paramDataType=idt.name,
+            outputDataType="BINARY",
+            numInputVectors=ishape[:-1],
+        )
+        model = make_hls_model(golden, [cw_node])
+        model.set_initializer("params", params)
+    getCustomOp(model.graph.node[0]).set_nodeattr("PE", 3)
+    return (golden, model, gen_finn_dt_tensor(idt, ishape))
+
+
+def make_globalaccpool_models(ifm_dim):
+    # sum over all pixels, GlobalAveragePool is converted into this layer and
+    # a scalar Mul by InferGlobalAccPoolLayer
+    idt = DataType["UINT4"]
+    ch = 4
+    inp = helper.make_tensor_value_info("inp", TensorProto.FLOAT, [1, ifm_dim, ifm_dim, ch])
+    outp = helper.make_tensor_value_info("outp", TensorProto.FLOAT, [1, 1, 1, ch])
+    sum_node = helper.make_node("ReduceSum", ["inp"], ["outp"], axes=[1, 2], keepdims=1)
+    graph = helper.make_graph([sum_node], "sum_graph", [inp], [outp])
+    golden = ModelWrapper(qonnx_make_model(graph, producer_name="sum-model"))
+    golden.set_tensor_datatype("inp", idt)
+    # same attributes as set by InferGlobalAccPoolLayer
+    pool_node = helper.make_node(
+        "GlobalAccPool_Batch",
+        ["inp"],
+        ["outp"],
+        domain="finn.custom_op.fpgadataflow",
+        backend="fpgadataflow",
+        NumChannels=ch,
+        PE=2,
+        inputDataType=idt.name,
+        numInputVectors=[1, ifm_dim, ifm_dim],
+    )
+    model = make_hls_model(golden, [pool_node])
+    return (golden, model, gen_finn_dt_tensor(idt, (1, ifm_dim, ifm_dim, ch)))
+
+
+def make_lookup_models(ishape, edt, emb_dim, mem_mode, ext_mem_width=32):
+    idt = DataType["UINT8"]
+    num_embeddings = 100
+    inp = helper.make_tensor_value_info("inp", TensorProto.INT64, list(ishape))
+    outp = helper.make_tensor_value_info("outp", TensorProto.FLOAT, list(ishape) + [emb_dim])
+    gather_node = helper.make_node("Gather", ["embeddings", "inp"], ["outp"], axis=0)
+    graph = helper.make_graph([gather_node], "gather_graph", [inp], [outp])
+    golden = ModelWrapper(qonnx_make_model(graph, producer_name="gather-model"))
+    golden.set_tensor_datatype("inp", idt)
+    golden.set_initializer("embeddings", gen_finn_dt_tensor(edt, (num_embeddings, emb_dim)))
+    golden.set_tensor_datatype("embeddings", edt)
+    golden = golden.transform(InferShapes())
+    model = golden.transform(InferLookupLayer())
+    assert [n.op_type for n in model.graph.node] == ["Lookup"]
+    inst = getCustomOp(model.graph.node[0])
+    inst.set_nodeattr("mem_mode", mem_mode)
+    inst.set_nodeattr("ext_mem_width", ext_mem_width)
+    x = np.random.randint(0, num_embeddings, ishape).astype(np.int64)
+    return (golden, model, x)
+
+
+def make_eltwise_models(eltwise_op, idt0, idt1):
+    # Sub and Sub -> Abs are converted by InferStreamingEltwise, Add as a
+    # hand-made layer
+    ishape = [1, 3, 3, 6]
+    inp0 = helper.make_tensor_value_info("inp0", TensorProto.FLOAT, ishape)
+    inp1 = helper.make_tensor_value_info("inp1", TensorProto.FLOAT, ishape)
+    outp = helper.make_tensor_value_info("outp", TensorProto.FLOAT, ishape)
+    if eltwise_op == "AbsDiff":
+        nodes = [
+            helper.make_node("Sub", ["inp0", "inp1"], ["diff"]),
+            helper.make_node("Abs", ["diff"], ["outp"]),
+        ]
+    else:
+        nodes = [helper.make_node(eltwise_op, ["inp0", "inp1"], ["outp"])]
+    graph = helper.make_graph(nodes, "eltwise_graph", [inp0, inp1], [outp])
+    golden = ModelWrapper(qonnx_make_model(graph, producer_name="eltwise-model"))
+    golden.set_tensor_datatype("inp0", idt0)
+    golden.set_tensor_datatype("inp1", idt1)
+    golden = golden.transform(InferShapes())
+    if eltwise_op == "Add":
+        eltwise_node = helper.make_node(
+            "StreamingEltwise",
+            ["inp0", "inp1"],
+            ["outp"],
+            domain="finn.custom_op.fpgadataflow",
+            backend="fpgadataflow",
+            NumChannels=ishape[-1],
+            PE=1,
+            inputDataType0=idt0.name,
+            inputDataType1=idt1.name,
+            eltwiseOp=eltwise_op,
+            numInputVectors=ishape[:-1],
+        )
+        model = make_hls_model(golden, [eltwise_node])
+    else:
+        model = golden.transform(InferStreamingEltwise())
+        model = model.transform(InferShapes())
+        model = model.transform(InferDataTypes())
+    assert [n.op_type for n in model.graph.node] == ["StreamingEltwise"]
+    getCustomOp(model.graph.node[0]).set_nodeattr("PE", 2)
+    x = [gen_finn_dt_tensor(idt0, ishape), gen_finn_dt_tensor(idt1, ishape)]
+    return (golden, model, x)
+
+
+def make_concat_models(elems_per_stream):
+    idt = DataType["INT4"]
+    vecs = [1, 2, 3]
+    inps = []
+    for i, elems in enumerate(elems_per_stream):
+        inps.append(helper.make_tensor_value_info("inp%d" % i, TensorProto.FLOAT, vecs + [elems]))
+    oshape = vecs + [sum(elems_per_stream)]
+    outp = helper.make_tensor_value_info("outp", TensorProto.FLOAT, oshape)
+    concat_node = helper.make_node("Concat", [x.name for x in inps], ["outp"], axis=-1)
+    graph = helper.make_graph([concat_node], "concat_graph", inps, [outp])
+    golden = ModelWrapper(qonnx_make_model(graph, producer_name="concat-model"))
+    for x in inps:
+        golden.set_tensor_datatype(x.name, idt)
+    model = golden.transform(InferConcatLayer())
+    assert [n.op_type for n in model.graph.node] == ["StreamingConcat"]
+    x = [gen_finn_dt_tensor(idt, vecs + [elems]) for elems in elems_per_stream]
+    return (golden, model, x)
+
+
+def make_addstreams_models(pe):
+    idt = DataType["INT4"]
+    ishape = [1, 2, 2, 6]
+    inp0 = helper.make_tensor_value_info("inp0", TensorProto.FLOAT, ishape)
+    inp1 = helper.make_tensor_value_info("inp1", TensorProto.FLOAT, ishape)
+    outp = helper.make_tensor_value_info("outp", TensorProto.FLOAT, ishape)
+    add_node = helper.make_node("Add", ["inp0", "inp1"], ["outp"])
+    graph = helper.make_graph([add_node], "add_graph", [inp0, inp1], [outp])
+    golden = ModelWrapper(qonnx_make_model(graph, producer_name="add-model"))
+    golden.set_tensor_datatype("inp0", idt)
+    golden.set_tensor_datatype("inp1", idt)
+    golden = golden.transform(InferShapes())
+    model = golden.transform(InferAddStreamsLayer())
+    assert [n.op_type for n in model.graph.node] == ["AddStreams_Batch"]
+    getCustomOp(model.graph.node[0]).set_nodeattr("PE", pe)
+    return (golden, model, [gen_finn_dt_tensor(idt, ishape) for i in range(2)])
+
+
+def make_multithreshold_node(inp, outp, thresholds, act):
+    return helper.make_node(
+        "MultiThreshold",
+        [inp, thresholds],
+        [outp],
+        domain="qonnx.custom_op.general",
+        out_dtype=act.name,
+        out_bias=float(act.min()),
+    )
+
+
+def set_random_thresholds(model, name, idt, act, ch):
+    n_steps = act.get_num_possible_values() - 1
+    T = gen_finn_dt_tensor(idt, (ch, n_steps))
+    model.set_initializer(name, np.sort(T, axis=1))
+    model.set_tensor_datatype(name, idt)
+
+
+def make_fork_join_models(n_branches):
+    # a thresholded tensor that is consumed by n_branches thresholding layers,
+    # joined again by an Add (two branches) or a Concat, so that
+    # InferDuplicateStreamsLayer inserts a DuplicateStreams layer
+    idt = DataType["INT4"]
+    act = DataType["INT4"]
+    ch = 4
+    vecs = 3
+    inp = helper.make_tensor_value_info("inp", TensorProto.FLOAT, [vecs, ch])
+    oshape = [vecs, ch if n_branches == 2 else n_branches * ch]
+    outp = helper.make_tensor_value_info("outp", TensorProto.FLOAT, oshape)
+    nodes = [make_multithreshold_node("inp", "fork", "T_fork", act)]
+    branches = ["branch%d" % i for i in range(n_branches)]
+    for i, branch in enumerate(branches):
+        nodes.append(make_multithreshold_node("fork", branch, "T%d" % i, act))
+    if n_branches == 2:
+        nodes.append(helper.make_node("Add", branches, ["outp"]))
+    else:
+        nodes.append(helper.make_node("Concat", branches, ["outp"], axis=-1))
+    graph = helper.make_graph(nodes, "fork_join_graph", [inp], [outp])
+    golden = ModelWrapper(qonnx_make_model(graph, producer_name="fork-join-model"))
+    golden.set_tensor_datatype("inp", idt)
+    set_random_thresholds(golden, "T_fork", idt, act, ch)
+    for i in range(n_branches):
+        set_random_thresholds(golden, "T%d" % i, act, act, ch)
+    golden = golden.transform(InferShapes())
+    golden = golden.transform(InferDataTypes())
+    model = golden.transform(InferThresholdingLayer())
+    model = model.transform(InferAddStreamsLayer())
+    model = model.transform(InferConcatLayer())
+    model = model.transform(InferDuplicateStreamsLayer())
+    op_types = [n.op_type for n in model.graph.node]
+    assert op_types.count("DuplicateStreams_Batch") == 1
+    dup_inst = getCustomOp(model.get_nodes_by_op_type("DuplicateStreams_Batch")[0])
+    dup_inst.set_nodeattr("PE", 2)
+    return (golden, model, gen_finn_dt_tensor(idt, (vecs, ch)))
+
+
+def make_dwc_fifo_models(pe_in, pe_out):
+    # two thresholding layers with different folding, connected through a
+    # data width converter, with FIFOs on all streams
+    idt = DataType["INT4"]
+    act = DataType["UINT3"]
+    ch = 12
+    vecs = 2
+    inp = helper.make_tensor_value_info("inp", TensorProto.FLOAT, [vecs, ch])
+    outp = helper.make_tensor_value_info("outp", TensorProto.FLOAT, [vecs, ch])
+    nodes = [
+        make_multithreshold_node("inp", "act0", "T0", act),
+        make_multithreshold_node("act0", "outp", "T1", act),
+    ]
+    graph = helper.make_graph(nodes, "dwc_graph", [inp], [outp])
+    golden = ModelWrapper(qonnx_make_model(graph, producer_name="dwc-model"))
+    golden.set_tensor_datatype("inp", idt)
+    set_random_thresholds(golden, "T0", idt, act, ch)
+    set_random_thresholds(golden, "T1", act, act, ch)
+    golden = golden.transform(InferShapes())
+    golden = golden.transform(InferDataTypes())
+    model = golden.transform(InferThresholdingLayer())
+    getCustomOp(model.graph.node[0]).set_nodeattr("PE", pe_in)
+    getCustomOp(model.graph.node[1]).set_nodeattr("PE", pe_out)
+    model = model.transform(InsertDWC())
+    model = model.transform(InsertFIFO(create_shallow_fifos=True))
+    op_types = [n.op_type for n in model.graph.node]
+    assert op_types.count("StreamingDataWidthConverter_Batch") == 1
+    assert op_types.count("StreamingFIFO") == 4
+    return (golden, model, gen_finn_dt_tensor(idt, (vecs, ch)))
+
+
+@pytest.mark.parametrize("ifm_dim", [7, 8])
+@pytest.mark.parametrize("stride", [2, 3])
+@pytest.mark.parametrize("dim_mode", ["2d", "1d", "1d_w"])
+@pytest.mark.fpgadataflow
+def test_fpgadataflow_python_exec_downsampler(ifm_dim, stride, dim_mode):
+    check_python_exec(*make_downsampler_models(ifm_dim, stride, dim_mode))
+
+
+@pytest.mark.parametrize("ifm_dim", [3, 4])
+@pytest.mark.parametrize("scale", [2, 3])
+@pytest.mark.parametrize("is_1d", [False, True])
+@pytest.mark.fpgadataflow
+def test_fpgadataflow_python_exec_upsampler(ifm_dim, scale, is_1d):
+    check_python_exec(*make_upsampler_models(ifm_dim, scale, is_1d))
+
+
+@pytest.mark.parametrize("ifm_dim", [(5, 5), (4, 7), (1, 6)])
+@pytest.mark.parametrize("padding", [(1, 1, 1, 1), (0, 2, 1, 0), (2, 0, 0, 3)])
+@pytest.mark.parametrize("optype", ["FMPadding_Batch", "FMPadding_rtl"])
+@pytest.mark.fpgadataflow
+def test_fpgadataflow_python_exec_fmpadding(ifm_dim, padding, optype):
+    check_python_exec(*make_fmpadding_models(ifm_dim, padding, optype))
+
+
+@pytest.mark.parametrize("func", ["add", "mul", "cmp_le", "cmp_ge"])
+@pytest.mark.parametrize("idt", [DataType["INT4"], DataType["UINT3"]])
+@pytest.mark.fpgadataflow
+def test_fpgadataflow_python_exec_channelwise(func, idt):
+    check_python_exec(*make_channelwise_models(func, idt))
+
+
+@pytest.mark.parametrize("ifm_dim", [1, 4, 5])
+@pytest.mark.fpgadataflow
+def test_fpgadataflow_python_exec_globalaccpool(ifm_dim):
+    check_python_exec(*make_globalaccpool_models(ifm_dim))
+
+
+@pytest.mark.parametrize("ishape", [(1, 10), (2, 3, 4)])
+@pytest.mark.parametrize("edt", [DataType["FIXED<8,2>"], DataType["INT3"]])
+@pytest.mark.fpgadataflow
+def test_fpgadataflow_python_exec_lookup(ishape, edt):
+    check_python_exec(*make_lookup_models(ishape, edt, 5, "const"))
+
+
+@pytest.mark.parametrize("emb_dim", [8, 24])
+@pytest.mark.parametrize("ext_mem_width", [32, 64])
+@pytest.mark.fpgadataflow
+def test_fpgadataflow_python_exec_lookup_external(emb_dim, ext_mem_width):
+    # external embeddings are 8-bit and read in ext_mem_width words
+    (golden, model, x) = make_lookup_models(
+        (1, 10), DataType["INT8"], emb_dim, "external", ext_mem_width
+    )
+    inst = getCustomOp(model.graph.node[0])
+    assert inst.get_folded_output_shape()[-2:] == (emb_dim * 8 // ext_mem_width, ext_mem_width // 8)
+    check_python_exec(golden, model, x)
+
+
+@pytest.mark.parametrize("eltwise_op", ["Add", "Sub", "AbsDiff"])
+@pytest.mark.parametrize(
+    "idts",
+    [
+        (DataType["INT4"], DataType["INT4"]),
+        (DataType["INT4"], DataType["INT3"]),
+        (DataType["UINT4"], DataType["UINT2"]),
+    ],
+)
+@pytest.mark.fpgadataflow
+def test_fpgadataflow_python_exec_eltwise(eltwise_op, idts):
+    check_python_exec(*make_eltwise_models(eltwise_op, *idts))
+
+
+@pytest.mark.parametrize("elems_per_stream", [[2, 2], [2, 3, 5]])
+@pytest.mark.fpgadataflow
+def test_fpgadataflow_python_exec_concat(elems_per_stream):
+    check_python_exec(*make_concat_models(elems_per_stream))
+
+
+@pytest.mark.parametrize("pe", [1, 3, 6])
+@pytest.mark.fpgadataflow
+def test_fpgadataflow_python_exec_addstreams(pe):
+    check_python_exec(*make_addstreams_models(pe))
+
+
+@pytest.mark.parametrize("n_branches", [2, 3])
+@pytest.mark.fpgadataflow
+def test_fpgadataflow_python_exec_duplicatestreams(n_branches):
+    check_python_exec(*make_fork_join_models(n_branches))
+
+
+@pytest.mark.parametrize("pe", [(2, 3), (4, 12), (6, 2)])
+@pytest.mark.fpgadataflow
+def test_fpgadataflow_python_exec_dwc_fifo(pe):
+    check_python_exec(*make_dwc_fifo_models(*pe))
+
+
+# one configuration of each layer with an HLS cppsim implementation,
+# FMPadding_rtl and Lookup with external embeddings have none
+CPPSIM_CASES = {
+    "downsampler_1d": lambda: make_downsampler_models(7, 2, "1d"),
+    "downsampler_2d": lambda: make_downsampler_models(7, 3, "2d"),
+    "upsampler_1d": lambda: make_upsampler_models(3, 3, True),
+    "upsampler_2d": lambda: make_upsampler_models(4, 2, False),
+    "fmpadding": lambda: make_fmpadding_models((4, 7), (2, 0, 0, 3), "FMPadding_Batch"),
+    "channelwise_mul": lambda: make_channelwise_models("mul", DataType["INT4"]),
+    "channelwise_cmp_le": lambda: make_channelwise_models("cmp_le", DataType["INT4"]),
+    "globalaccpool": lambda: make_globalaccpool_models(5),
+    "lookup": lambda: make_lookup_models((2, 3, 4), DataType["FIXED<8,2>"], 5, "const"),
+    "eltwise": lambda: make_eltwise_models("AbsDiff", DataType["UINT4"], DataType["UINT2"]),
+    "concat": lambda: make_concat_models([2, 3, 5]),
+    "addstreams": lambda: make_addstreams_models(3),
+    "duplicatestreams": lambda: make_fork_join_models(3),
+    "dwc_fifo": lambda: make_dwc_fifo_models(2, 3),
+}
+
+
+@pytest.mark.parametrize("case", CPPSIM_CASES.keys())
+@pytest.mark.slow
+@pytest.mark.vivado
+@pytest.mark.fpgadataflow
+def test_fpgadataflow_python_exec_vs_cppsim(case):
+    if "HLS_PATH" not in os.environ:
+        pytest.skip("HLS_PATH not set, cppsim is not available")
+    (golden, model, x) = CPPSIM_CASES[case]()
+    model = model.transform(GiveUniqueNodeNames())
+    input_dict = make_input_dict(model, x)
+    out_name = model.graph.output[0].name
+    y_python = oxe.execute_onnx(model.transform(SetExecMode("python")), input_dict)[out_name]
+    model = model.transform(SetExecMode("cppsim"))
+    model = model.transform(PrepareCppSim())
+    model = model.transform(CompileCppSim())
+    y_cppsim = oxe.execute_onnx(model, input_dict)[out_name]
+    assert (y_python == y_cppsim).all()
@@ -0,0 +1,148 @@
+# Copyright (c) 2023, Xilinx
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of FINN nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import pytest
+
+import json
+import os
+from onnx import helper
+from qonnx.custom_op.registry import getCustomOp
+
+from finn.custom_op.fpgadataflow import templates
+from finn.util.basic import make_build_dir
+from finn.util.chrc_cache import (
+    chrc_cache_key,
+    get_cached_chrc,
+    get_hls_ipgen_config,
+    store_chrc,
+)
+from finn.util.fpgadataflow import encode_chrc
+
+
+def make_mvau_node(name, pe, **kwargs):
+    node = helper.make_node(
+        "MatrixVectorActivation",
+        ["inp", "weights"],
+        ["outp"],
+        name=name,
+        domain="finn.custom_op.fpgadataflow",
+        backend="fpgadataflow",
+        MW=16,
+        MH=16,
+        SIMD=4,
+        PE=pe,
+        inputDataType="INT4",
+        weightDataType="INT4",
+        outputDataType="INT32",
+        ActVal=0,
+        binaryXnorMode=0,
+        noActivation=1,
+        **kwargs
+    )
+    return getCustomOp(node)
+
+
+@pytest.mark.util
+def test_chrc_cache_key():
+    key0 = chrc_cache_key(make_mvau_node("MVAU_0", 4), 100)
+    # the node name, build products and FIFO depths do not matter
+    inst = make_mvau_node("MVAU_7", 4, code_gen_dir_ipgen="/tmp/x", outFIFODepths=[64])
+    inst.set_nodeattr("rtlsim_so", "/tmp/x/node.so")
+    assert chrc_cache_key(inst, 100) == key0
+    # setting an attribute to its default does not change the key either
+    assert chrc_cache_key(make_mvau_node("MVAU_0", 4, mem_mode="const"), 100) == key0
+    # but the folding, other hardware attributes and the period do
+    assert chrc_cache_key(make_mvau_node("MVAU_0", 2), 100) != key0
+    assert chrc_cache_key(make_mvau_node("MVAU_0", 4, mem_mode="decoupled"), 100) != key0
+    assert chrc_cache_key(make_mvau_node("MVAU_0", 4), 101) != key0
+
+
+@pytest.mark.util
+def test_chrc_cache_key_hls(monkeypatch):
+    monkeypatch.setenv("HLS_PATH", "/tools/Xilinx/Vitis_HLS/2022.2")
+    inst = make_mvau_node("MVAU_0", 4)
+    key0 = chrc_cache_key(inst, 100)
+    # the HLS tool version is taken from the HLS installation path
+    monkeypatch.setenv("HLS_PATH", "/tools/Xilinx/Vitis_HLS/2023.1")
+    assert chrc_cache_key(inst, 100) != key0
+    monkeypatch.setenv("HLS_PATH", "/tools/Xilinx/Vitis_HLS/2022.2")
+    # FPGA part and clock period come from the HLS synthesis script
+    keys = set()
+    for fpgapart, clk in [("xc7z020clg400-1", 10.0), ("xc7z020clg400-1", 5.0), ("xczu3eg", 5.0)]:
+        code_gen_dir = make_build_dir("test_chrc_cache_key_hls_")
+        inst = make_mvau_node("MVAU_%d" % len(keys), 4, code_gen_dir_ipgen=code_gen_dir)
+        tcl = templates.ipgentcl_template.replace("$FPGAPART$", fpgapart)
+        tcl = tcl.replace("$CLKPERIOD$", str(clk))
+        with open(code_gen_dir + "/hls_syn_MVAU_%d.tcl" % len(keys), "w") as f:
+            f.write(tcl)
+        assert get_hls_ipgen_config(inst) == (fpgapart, str(clk))
+        keys.add(chrc_cache_key(inst, 100))
+    assert len(keys) == 3 and key0 not in keys
+
+
+@pytest.mark.util
+def test_chrc_cache(monkeypatch):
+    cache_dir = make_build_dir("test_chrc_cache_")
+    monkeypatch.setenv("FINN_CHRC_CACHE_DIR", cache_dir)
+    monkeypatch.setenv("FINN_CHRC_CACHE_SIZE_MB", "1")
+    period = 100
+    chrc_attrs = {
+        "io_chrc_in": encode_chrc([[1] * 16 + [0] * (period - 16)]),
+        "io_chrc_out": encode_chrc([[0] * 20 + [1] * 4 + [0] * (period - 24)]),
+        "io_chrc_period": period,
+        "io_chrc_pads_in": [60],
+        "io_chrc_pads_out": [60],
+    }
+    inst = make_mvau_node("MVAU_0", 4)
+    key = chrc_cache_key(inst, period)
+    assert get_cached_chrc(key) is None
+    store_chrc(key, chrc_attrs)
+    assert get_cached_chrc(key) == chrc_attrs
+    # a cached node gets its characteristic without any rtlsim
+    assert inst.get_nodeattr("rtlsim_so") == ""
+    inst.derive_characteristic_fxns(period)
+    for attr_name, value in chrc_attrs.items():
+        assert inst.get_nodeattr(attr_name) == value
+    # store more than fits into 1 MB
+    big_attrs = dict(chrc_attrs, io_chrc_in=[1, period] * 50000)
+    entry_size = len(json.dumps(big_attrs))
+    assert 2**20 // 3 < entry_size < 2**20 // 2
+    store_chrc("key0", big_attrs)
+    store_chrc("key1", big_attrs)
+    os.utime(cache_dir + "/key0.json", (1, 1))
+    os.utime(cache_dir + "/key1.json", (0, 0))
+    os.utime(cache_dir + "/%s.json" % key, (0, 0))
+    assert get_cached_chrc("key0") is not None
+    store_chrc("key2", big_attrs)
+    # the least recently used entries are evicted
+    assert sorted(os.listdir(cache_dir)) == ["key0.json", "key2.json"]
+    # a size of 0 disables the cache
+    monkeypatch.setenv("FINN_CHRC_CACHE_SIZE_MB", "0")
+    assert get_cached_chrc("key0") is None
+    store_chrc("key3", chrc_attrs)
+    assert not os.path.exists(cache_dir + "/key3.json")
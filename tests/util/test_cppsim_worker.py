@@ -0,0 +1,179 @@
+# Copyright (c) 2023, Xilinx
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of FINN nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import pytest
+
+import numpy as np
+import os
+import stat
+from onnx import TensorProto, helper
+from qonnx.core.modelwrapper import ModelWrapper
+from qonnx.custom_op.registry import getCustomOp
+from qonnx.util.basic import qonnx_make_model
+
+from finn.core.onnx_exec import execute_onnx_batch
+from finn.util.basic import make_build_dir
+from finn.util.cppsim import (
+    close_cppsim_workers,
+    cppsim_supports_workers,
+    get_cppsim_worker,
+    redirect_npy_paths,
+)
+
+# stands in for a cppsim executable built from templates.docompute_template,
+# copies input_0.npy to output.npy for each sample on every "run <n>" and
+# prints some noise
+fake_worker_script = """#!/bin/sh
+[ "$1" = "--worker" ] || exit 1
+while read cmd n; do
+  [ "$cmd" = "run" ] || exit 0
+  i=0
+  while [ $i -lt $n ]; do
+    echo "some output of the node"
+    cp "$FINN_CPPSIM_IO_DIR/$i/input_0.npy" "$FINN_CPPSIM_IO_DIR/$i/output.npy" || exit 2
+    i=$((i + 1))
+  done
+  echo "done"
+done
+"""
+
+
+def make_fake_executable(code_gen_dir, script=fake_worker_script):
+    executable_path = os.path.join(code_gen_dir, "node_model")
+    with open(executable_path, "w") as f:
+        f.write(script)
+    os.chmod(executable_path, os.stat(executable_path).st_mode | stat.S_IEXEC)
+    return executable_path
+
+
+@pytest.mark.util
+def test_redirect_npy_paths():
+    code_gen_dir = "/tmp/finn_dev/code_gen_cppsim_x"
+    code = """npy2apintstream<ap_uint<8>, float, 8, float>("%s/input_0.npy", in0_V);
+npy2apintstream<ap_uint<8>, float, 8, float>("%s/weights.npy", weights_V, false, 1);
+#include "%s/params.h"
+cnpy::npy_save("%s/output_checksum.npy",&checksum[0],{1},"w");""" % (
+        (code_gen_dir,) * 4
+    )
+    # static parameter files such as weights.npy are not redirected
+    expected = """npy2apintstream<ap_uint<8>, float, 8, float>(npy_io_path("%s", "input_0.npy").c_str(), in0_V);
+npy2apintstream<ap_uint<8>, float, 8, float>("%s/weights.npy", weights_V, false, 1);
+#include "%s/params.h"
+cnpy::npy_save(npy_io_path("%s", "output_checksum.npy").c_str(),&checksum[0],{1},"w");""" % (  # noqa
+        (code_gen_dir,) * 4
+    )
+    assert redirect_npy_paths(code, code_gen_dir) == expected
+
+
+@pytest.mark.util
+def test_cppsim_worker():
+    code_gen_dir = make_build_dir("test_cppsim_worker_")
+    executable_path = make_fake_executable(code_gen_dir)
+    worker = get_cppsim_worker(executable_path)
+    assert get_cppsim_worker(executable_path) is worker
+    pid = worker.proc.pid
+    for i in range(5):
+        x = np.random.rand(2, 3).astype(np.float32)
+        np.save(os.path.join(worker.get_sample_io_dir(), "input_0.npy"), x)
+        worker.run()
+        assert (np.load(os.path.join(worker.get_sample_io_dir(), "output.npy")) == x).all()
+    # a batch of samples is executed in one run
+    xs = [np.random.rand(2, 3).astype(np.float32) for i in range(3)]
+    for i, x in enumerate(xs):
+        np.save(os.path.join(worker.get_sample_io_dir(i), "input_0.npy"), x)
+    worker.run(len(xs))
+    for i, x in enumerate(xs):
+        assert (np.load(os.path.join(worker.get_sample_io_dir(i), "output.npy")) == x).all()
+    # still the same process, nothing written to the code generation dir
+    assert worker.proc.pid == pid
+    assert os.listdir(code_gen_dir) == ["node_model"]
+    # a rebuilt executable replaces the worker
+    make_fake_executable(code_gen_dir)
+    os.utime(executable_path, (worker.mtime + 1, worker.mtime + 1))
+    new_worker = get_cppsim_worker(executable_path)
+    assert new_worker is not worker
+    assert worker.proc.poll() is not None
+    assert not os.path.isdir(worker.io_dir)
+    # a failing execution (no input_0.npy in the new I/O dir) is reported and
+    # the worker gets restarted
+    with pytest.raises(Exception, match="exited with code 2"):
+        new_worker.run()
+    assert get_cppsim_worker(executable_path) is not new_worker
+    close_cppsim_workers()
+    assert new_worker.proc.poll() is not None
+
+
+@pytest.mark.util
+def test_cppsim_worker_execute_batch():
+    # a single MVAU with MW == MH, whose fake executable copies its input to
+    # its output and logs every run command
+    ch = 8
+    inp = helper.make_tensor_value_info("inp", TensorProto.FLOAT, [1, ch])
+    outp = helper.make_tensor_value_info("outp", TensorProto.FLOAT, [1, ch])
+    node = helper.make_node(
+        "MatrixVectorActivation",
+        ["inp", "W"],
+        ["outp"],
+        domain="finn.custom_op.fpgadataflow",
+        backend="fpgadataflow",
+        MW=ch,
+        MH=ch,
+        SIMD=2,
+        PE=2,
+        inputDataType="INT4",
+        weightDataType="INT4",
+        outputDataType="INT4",
+        noActivation=1,
+        binaryXnorMode=0,
+        mem_mode="decoupled",
+        exec_mode="cppsim",
+    )
+    graph = helper.make_graph([node], "mvau_graph", [inp], [outp])
+    model = ModelWrapper(qonnx_make_model(graph, producer_name="mvau-model"))
+    model.set_initializer("W", np.ones((ch, ch), dtype=np.float32))
+    code_gen_dir = make_build_dir("test_cppsim_worker_batch_")
+    script = fake_worker_script.replace(
+        "while read cmd n; do\n",
+        'while read cmd n; do\n  echo "$cmd $n" >> %s/runs.log\n' % code_gen_dir,
+    )
+    executable_path = make_fake_executable(code_gen_dir, script)
+    inst = getCustomOp(model.graph.node[0])
+    inst.set_nodeattr("code_gen_dir_cppsim", code_gen_dir)
+    inst.set_nodeattr("executable_path", executable_path)
+    xs = [np.random.randint(-8, 8, (1, ch)).astype(np.float32) for i in range(4)]
+    # without worker support in the generated code, no worker is started
+    assert not cppsim_supports_workers(code_gen_dir)
+    with open(os.path.join(code_gen_dir, "execute_MatrixVectorActivation.cpp"), "w") as f:
+        f.write("npy_io_dir() = std::string(io_dir);\n")
+    assert cppsim_supports_workers(code_gen_dir)
+    ys = execute_onnx_batch(model, [{"inp": x} for x in xs])
+    assert all([(y["outp"] == x).all() for (x, y) in zip(xs, ys)])
+    # all samples were executed in a single run
+    with open(os.path.join(code_gen_dir, "runs.log"), "r") as f:
+        assert f.read() == "run 4\n"
+    close_cppsim_workers()
@@ -0,0 +1,240 @@
+# Copyright (c) 2020, Xilinx
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of FINN nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import pytest
+
+import io
+import math
+import numpy as np
+import tracemalloc
+from qonnx.core.datatype import DataType
+from qonnx.util.basic import gen_finn_dt_tensor
+
+from finn.util.data_packing import (
+    finnpy_to_packed_bytearray,
+    hexstring2npbytearray,
+    ints_to_limbs,
+    limbs_to_ints,
+    npbytearray2hexstring,
+    npy_to_rtlsim_input,
+    pack_innermost_dim_as_hex_string,
+    pack_innermost_dim_as_limbs,
+    pack_runtime_weight_words,
+    packed_bytearray_to_finnpy,
+    rtlsim_output_to_npy,
+    unpack_innermost_dim_from_hex_string,
+    unpack_innermost_dim_from_limbs,
+    write_weight_stream,
+)
+
+
+@pytest.mark.util
+@pytest.mark.parametrize(
+    "dtype",
+    [
+        DataType["BINARY"],
+        DataType["BIPOLAR"],
+        DataType["TERNARY"],
+        DataType["UINT3"],
+        DataType["INT4"],
+        DataType["UINT8"],
+        DataType["INT9"],
+        DataType["INT16"],
+        DataType["UINT17"],
+        DataType["FIXED<9,6>"],
+        DataType["FLOAT32"],
+    ],
+)
+@pytest.mark.parametrize("test_shape", [(1, 1), (2, 7), (3, 2, 16)])
+@pytest.mark.parametrize("reverse_inner", [False, True])
+@pytest.mark.parametrize("reverse_endian", [False, True])
+def test_finnpy_to_packed_bytearray(test_shape, dtype, reverse_inner, reverse_endian):
+    ndarray = gen_finn_dt_tensor(dtype, test_shape)
+    packed = finnpy_to_packed_bytearray(ndarray, dtype, reverse_inner, reverse_endian)
+    # compare against packing element by element through hex strings
+    bits_padded = ((test_shape[-1] * dtype.bitwidth() + 7) // 8) * 8
+    hexstr = pack_innermost_dim_as_hex_string(ndarray, dtype, bits_padded, reverse_inner)
+    expected = np.asarray([hexstring2npbytearray(x) for x in hexstr.flatten()])
+    expected = expected.reshape(test_shape[:-1] + (bits_padded // 8,))
+    if reverse_endian:
+        expected = np.flip(expected, axis=-1)
+    assert packed.dtype == np.uint8
+    assert (packed == expected).all()
+    unpacked = packed_bytearray_to_finnpy(packed, dtype, test_shape, reverse_inner, reverse_endian)
+    assert unpacked.dtype == np.float32
+    assert (unpacked == ndarray).all()
+    # compare against unpacking through hex strings
+    if reverse_endian:
+        packed = np.flip(packed, axis=-1)
+    hexstr = np.apply_along_axis(npbytearray2hexstring, packed.ndim - 1, packed)
+    expected = unpack_innermost_dim_from_hex_string(
+        hexstr, dtype, test_shape, bits_padded, reverse_inner
+    )
+    assert (unpacked == expected).all()
+
+
+@pytest.mark.util
+def test_finnpy_to_packed_bytearray_examples():
+    A = np.asarray([[1, 1, 1, 0], [0, 1, 1, 0]], dtype=np.float32)
+    eA = np.asarray([[14], [6]], dtype=np.uint8)
+    assert (finnpy_to_packed_bytearray(A, DataType["BINARY"]) == eA).all()
+    B = np.asarray([[-1, 3, -4], [0, 1, -2]], dtype=np.float32)
+    # 3x 3-bit elements padded to 16 bits: 0b0000000 111 011 100
+    eB = np.asarray([[0x01, 0xDC], [0x00, 0x0E]], dtype=np.uint8)
+    assert (finnpy_to_packed_bytearray(B, DataType["INT3"]) == eB).all()
+    assert (
+        finnpy_to_packed_bytearray(B, DataType["INT3"], reverse_endian=True) == eB[:, ::-1]
+    ).all()
+    assert (packed_bytearray_to_finnpy(eB, DataType["INT3"], B.shape) == B).all()
+    with pytest.raises(AssertionError):
+        finnpy_to_packed_bytearray(B, DataType["UINT3"])
+    # integer containers take the same path as float32 ones
+    assert (finnpy_to_packed_bytearray(B.astype(np.int8), DataType["INT3"]) == eB).all()
+    with pytest.raises(AssertionError):
+        finnpy_to_packed_bytearray(B.astype(np.int8), DataType["UINT3"])
+
+
+@pytest.mark.util
+@pytest.mark.parametrize(
+    "dtype",
+    [
+        DataType["BIPOLAR"],
+        DataType["INT4"],
+        DataType["UINT8"],
+        DataType["INT16"],
+        DataType["UINT17"],
+        DataType["FLOAT32"],
+    ],
+)
+@pytest.mark.parametrize("test_shape", [(2, 7), (3, 2, 16)])
+@pytest.mark.parametrize("reverse_endian", [False, True])
+@pytest.mark.parametrize("fast_mode", [False, True])
+def test_packed_bytearray_out(test_shape, dtype, reverse_endian, fast_mode):
+    ndarray = gen_finn_dt_tensor(dtype, test_shape)
+    expected = finnpy_to_packed_bytearray(ndarray, dtype, True, reverse_endian, fast_mode)
+    out = np.zeros_like(expected)
+    ret = finnpy_to_packed_bytearray(ndarray, dtype, True, reverse_endian, fast_mode, out=out)
+    assert ret is out
+    assert (out == expected).all()
+    out_unpacked = np.zeros(test_shape, dtype=np.float32)
+    ret = packed_bytearray_to_finnpy(
+        out, dtype, test_shape, True, reverse_endian, fast_mode, out=out_unpacked
+    )
+    assert ret is out_unpacked
+    assert (out_unpacked == ndarray).all()
+
+
+@pytest.mark.util
+@pytest.mark.parametrize("dtype", [DataType["INT2"], DataType["UINT8"], DataType["INT16"]])
+@pytest.mark.parametrize("reverse_endian", [False, True])
+def test_packed_bytearray_out_no_copy(dtype, reverse_endian):
+    # large enough to be (un)packed in several blocks
+    test_shape = (256, 64, 64)
+    ndarray = gen_finn_dt_tensor(dtype, test_shape)
+    expected = finnpy_to_packed_bytearray(ndarray, dtype, True, reverse_endian)
+    out = np.zeros_like(expected)
+    out_unpacked = np.zeros(test_shape, dtype=np.float32)
+    tracemalloc.start()
+    ret = finnpy_to_packed_bytearray(ndarray, dtype, True, reverse_endian, out=out)
+    pack_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    ret_unpacked = packed_bytearray_to_finnpy(
+        out, dtype, test_shape, True, reverse_endian, out=out_unpacked
+    )
+    unpack_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert np.shares_memory(ret, out) and ret.shape == out.shape
+    assert np.shares_memory(ret_unpacked, out_unpacked)
+    assert (out == expected).all()
+    assert (out_unpacked == ndarray).all()
+    # no temporaries of the full size of the arrays
+    assert pack_peak < ndarray.nbytes / 4
+    assert unpack_peak < ndarray.nbytes / 4
+
+
+@pytest.mark.util
+@pytest.mark.parametrize(
+    "dtype",
+    [
+        DataType["BIPOLAR"],
+        DataType["INT2"],
+        DataType["UINT8"],
+        DataType["INT9"],
+        DataType["FLOAT32"],
+    ],
+)
+@pytest.mark.parametrize("test_shape", [(2, 5), (3, 2, 16), (1, 130)])
+@pytest.mark.parametrize("reverse_inner", [False, True])
+def test_npy_to_rtlsim_input_limbs(test_shape, dtype, reverse_inner):
+    ndarray = gen_finn_dt_tensor(dtype, test_shape)
+    packed_bits = test_shape[-1] * dtype.bitwidth()
+    packed_bits_padded = ((packed_bits + 3) // 4) * 4
+    limbs = pack_innermost_dim_as_limbs(ndarray, dtype, packed_bits, reverse_inner)
+    assert limbs.shape == test_shape[:-1] + ((packed_bits + 63) // 64,)
+    unpacked = unpack_innermost_dim_from_limbs(limbs, dtype, test_shape, reverse_inner)
+    assert (unpacked == ndarray).all()
+    # stream words must match the hex string packing
+    rtlsim_inp = npy_to_rtlsim_input(ndarray, dtype, packed_bits, reverse_inner)
+    hexstr = pack_innermost_dim_as_hex_string(
+        ndarray, dtype, packed_bits_padded, reverse_inner
+    ).flatten()
+    assert rtlsim_inp == [int(x, 16) for x in hexstr]
+    assert (ints_to_limbs(rtlsim_inp, limbs.shape[-1]) == limbs.reshape(-1, limbs.shape[-1])).all()
+    assert limbs_to_ints(limbs) == rtlsim_inp
+    rtlsim_out = rtlsim_output_to_npy(
+        rtlsim_inp, None, dtype, test_shape, packed_bits_padded, dtype.bitwidth(), reverse_inner
+    )
+    assert (rtlsim_out == ndarray).all()
+
+
+@pytest.mark.util
+@pytest.mark.parametrize("dtype", [DataType["BINARY"], DataType["INT3"], DataType["UINT8"]])
+@pytest.mark.parametrize("test_shape", [(1, 5, 4), (1, 3, 24), (1, 7, 35)])
+@pytest.mark.parametrize("weight_file_mode", ["decoupled_verilog_dat", "decoupled_runtime"])
+def test_write_weight_stream(test_shape, dtype, weight_file_mode):
+    ndarray = gen_finn_dt_tensor(dtype, test_shape)
+    weight_width = test_shape[-1] * dtype.bitwidth()
+    f = io.StringIO()
+    write_weight_stream(f, ndarray, dtype, weight_width, weight_file_mode)
+    # compare against writing one hex string at a time
+    if weight_file_mode == "decoupled_verilog_dat":
+        weight_width_padded = ((weight_width + 3) // 4) * 4
+    else:
+        weight_width_padded = max(1, 2 ** math.ceil(math.log2(weight_width / 32))) * 32
+    hexstr = pack_innermost_dim_as_hex_string(ndarray, dtype, weight_width_padded, prefix="")
+    expected = []
+    for val in hexstr.flatten():
+        if weight_file_mode == "decoupled_verilog_dat":
+            expected.append(val)
+        else:
+            expected += reversed([val[i : i + 8] for i in range(0, len(val), 8)])
+    assert f.getvalue() == "".join([x + "\n" for x in expected])
+    if weight_file_mode == "decoupled_runtime":
+        words = pack_runtime_weight_words(ndarray, dtype, weight_width)
+        assert words.dtype == np.uint32
+        assert words.tolist() == [int(x, 16) for x in expected]
@@ -28,15 +28,21 @@
 
 import pytest
 
+import io
 import numpy as np
 import os
 import shutil
 import subprocess
+import sys
 from qonnx.core.datatype import DataType
 from qonnx.util.basic import gen_finn_dt_tensor
 
 from finn.util.basic import make_build_dir
-from finn.util.data_packing import numpy_to_hls_code
+from finn.util.data_packing import (
+    numpy_to_hls_code,
+    pack_innermost_dim_as_hex_string,
+    write_numpy_to_hls_code,
+)
 
 
 @pytest.mark.util
@@ -141,3 +147,39 @@ def test_numpy_to_hls_code():
     eB = """{{ap_uint<4>("0xf", 16), ap_uint<4>("0xf", 16)},
      {ap_uint<4>("0x7", 16), ap_uint<4>("0xd", 16)}};"""
     assert remove_all_whitespace(ret) == remove_all_whitespace(eB)
+
+
+@pytest.mark.util
+@pytest.mark.parametrize(
+    "dtype", [DataType["BIPOLAR"], DataType["INT3"], DataType["FIXED<9,6>"], DataType["FLOAT32"]]
+)
+@pytest.mark.parametrize("test_shape", [(5,), (2, 7), (1, 3, 40), (2, 2, 3, 5)])
+@pytest.mark.parametrize("pack_innermost_dim", [False, True])
+def test_write_numpy_to_hls_code(test_shape, dtype, pack_innermost_dim):
+    ndarray = gen_finn_dt_tensor(dtype, test_shape)
+    # reference: format the whole array at once with np.array2string
+    hls_dtype = dtype.get_hls_datatype_str()
+    ref_array = ndarray
+    if pack_innermost_dim:
+        idimbits = ((test_shape[-1] * dtype.bitwidth() + 3) // 4) * 4
+        hls_dtype = "ap_uint<%d>" % idimbits
+        ref_array = pack_innermost_dim_as_hex_string(ndarray, dtype, idimbits)
+
+    def elem2str(x):
+        if type(x) == str or type(x) == np.str_:
+            return '%s("%s", 16)' % (hls_dtype, x)
+        return str(int(x)) if dtype.is_integer() else str(x)
+
+    expected = np.array2string(
+        ref_array, separator=", ", formatter={"all": elem2str}, threshold=sys.maxsize
+    )
+    expected = expected.replace("[", "{").replace("]", "}")
+    expected = "%s test%s = \n%s;" % (
+        hls_dtype,
+        "".join(["[%d]" % d for d in ref_array.shape]),
+        expected,
+    )
+    f = io.StringIO()
+    write_numpy_to_hls_code(f, ndarray, dtype, "test", pack_innermost_dim)
+    assert f.getvalue() == expected
+    assert numpy_to_hls_code(ndarray, dtype, "test", pack_innermost_dim) == expected
@@ -0,0 +1,200 @@
+# Copyright (c) 2020, Xilinx
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of FINN nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import pytest
+
+import importlib
+import importlib_resources
+import numpy as np
+import sys
+from onnx import TensorProto, helper
+from qonnx.core.datatype import DataType
+from qonnx.core.modelwrapper import ModelWrapper
+from qonnx.util.basic import gen_finn_dt_tensor, qonnx_make_model
+
+from finn.util.basic import make_build_dir
+
+driver_dir = str(importlib_resources.files("finn.qnn-data") / "templates/driver")
+
+# 8 UINT4 inputs with SIMD=4, 8 UINT8 outputs with PE=2
+io_shape_dict = {
+    "idt": [DataType["UINT4"]],
+    "odt": [DataType["UINT8"]],
+    "ishape_normal": [(1, 8)],
+    "oshape_normal": [(1, 8)],
+    "ishape_folded": [(1, 2, 4)],
+    "oshape_folded": [(1, 4, 2)],
+    "ishape_packed": [(1, 2, 2)],
+    "oshape_packed": [(1, 4, 2)],
+    "input_dma_name": ["idma0"],
+    "output_dma_name": ["odma0"],
+    "number_of_external_weights": 0,
+    "num_inputs": 1,
+    "num_outputs": 1,
+}
+
+
+@pytest.fixture
+def driver_base(monkeypatch):
+    monkeypatch.setenv("FINN_DRIVER_EMULATION", "1")
+    monkeypatch.syspath_prepend(driver_dir)
+    monkeypatch.delitem(sys.modules, "driver_base", raising=False)
+    return importlib.import_module("driver_base")
+
+
+def make_add_model():
+    inp = helper.make_tensor_value_info("inp", TensorProto.FLOAT, [1, 8])
+    outp = helper.make_tensor_value_info("outp", TensorProto.FLOAT, [1, 8])
+    node = helper.make_node("Add", ["inp", "addend"], ["outp"])
+    graph = helper.make_graph([node], "emulated_accel", [inp], [outp])
+    model = ModelWrapper(qonnx_make_model(graph, producer_name="emulation-test"))
+    model.set_initializer("addend", np.asarray([3.0], dtype=np.float32))
+    model.set_tensor_datatype("inp", DataType["UINT4"])
+    model.set_tensor_datatype("outp", DataType["UINT8"])
+    model_file = make_build_dir("test_driver_emulation_") + "/model.onnx"
+    model.save(model_file)
+    return model_file
+
+
+@pytest.mark.util
+@pytest.mark.parametrize("platform", ["zynq-iodma", "alveo"])
+def test_driver_emulation_execute(driver_base, platform):
+    accel = driver_base.FINNExampleOverlay(
+        make_add_model(), platform, io_shape_dict, batch_size=3, runtime_weight_dir=""
+    )
+    x = gen_finn_dt_tensor(DataType["UINT4"], (3, 8))
+    assert (accel.execute(x) == x + 3).all()
+    batches = [gen_finn_dt_tensor(DataType["UINT4"], (3, 8)) for i in range(5)]
+    outputs = list(accel.execute_pipelined(batches))
+    assert len(outputs) == len(batches)
+    for x, y in zip(batches, outputs):
+        assert (y == x + 3).all()
+
+
+@pytest.mark.util
+@pytest.mark.parametrize("platform", ["zynq-iodma", "alveo"])
+def test_driver_emulation_zeros(driver_base, platform):
+    weight_dir = make_build_dir("test_driver_emulation_rtw_")
+    layer_w = np.arange(16, dtype=np.uint32)
+    with open(weight_dir + "/0_0_MatrixVectorActivation_0.dat", "w") as f:
+        f.write("\n".join(["%08x" % w for w in layer_w]))
+    accel = driver_base.FINNExampleOverlay(
+        "resizer.bit", platform, io_shape_dict, batch_size=2, runtime_weight_dir=weight_dir
+    )
+    mmio = accel.StreamingDataflowPartition_0.mmio
+    assert (mmio.array == layer_w).all()
+    # binary runtime weights take precedence over the .dat file
+    np.save(weight_dir + "/0_0_MatrixVectorActivation_0.npy", layer_w[::-1])
+    accel.load_runtime_weights()
+    assert (mmio.array == layer_w[::-1]).all()
+    assert (accel.execute(np.ones((2, 8))) == 0).all()
+    res = accel.throughput_test()
+    assert res["batch_size"] == 2
+    for key in ["runtime[ms]", "throughput[images/s]", "pack_input[ms]", "fclk[mhz]"]:
+        assert key in res
+
+
+@pytest.mark.util
+def test_driver_emulation_throughput_sweep(driver_base):
+    accel = driver_base.FINNExampleOverlay(
+        "resizer.bit", "zynq-iodma", io_shape_dict, batch_size=2, runtime_weight_dir=""
+    )
+    res = accel.throughput_test(warmup=2, repetitions=10)
+    assert res["repetitions"] == 10
+    assert res["runtime_p50[ms]"] <= res["runtime_p95[ms]"] <= res["runtime_p99[ms]"]
+    assert res["e2e_throughput[images/s]"] > 0
+    assert "pack_input_cpu[ms]" in res
+    sweep = accel.throughput_sweep([1, 4, 16], repetitions=3)
+    assert [x["batch_size"] for x in sweep["sweep"]] == [1, 4, 16]
+    assert sweep["saturating_batch_size"] in [1, 4, 16]
+    assert "stable_throughput[images/s]" in sweep
+    assert accel.batch_size == 2
+
+
+@pytest.mark.util
+@pytest.mark.parametrize("platform", ["zynq-iodma", "alveo"])
+def test_driver_emulation_infer_stream(driver_base, platform):
+    accel = driver_base.FINNExampleOverlay(
+        make_add_model(), platform, io_shape_dict, batch_size=4, runtime_weight_dir=""
+    )
+    # items of different sizes, including a single sample without batch dim
+    items = [gen_finn_dt_tensor(DataType["UINT4"], (n, 8)) for n in [3, 0, 9, 1, 4]]
+    items.append(gen_finn_dt_tensor(DataType["UINT4"], (8,)))
+    outputs = list(accel.infer_stream(iter(items), max_batch=3))
+    assert len(outputs) == len(items)
+    for x, y in zip(items, outputs):
+        assert (y == x.reshape(-1, 8) + 3).all()
+    # partial batches run without reallocating the buffers
+    assert accel.batch_size == 4
+    x = gen_finn_dt_tensor(DataType["UINT4"], (2, 8))
+    assert (accel.execute(x) == x + 3).all()
+
+
+@pytest.mark.util
+def test_driver_emulation_threads(driver_base):
+    accel = driver_base.FINNExampleOverlay(
+        make_add_model(),
+        "alveo",
+        io_shape_dict,
+        batch_size=7,
+        runtime_weight_dir="",
+        num_threads=3,
+        parallel_batch_threshold=4,
+    )
+    for n in [7, 5, 2]:
+        x = gen_finn_dt_tensor(DataType["UINT4"], (n, 8))
+        ibuf_folded = accel.fold_input(x, batch_size=n)
+        ibuf_packed = accel.pack_input(ibuf_folded)
+        accel.num_threads = 1
+        assert (ibuf_packed == accel.pack_input(ibuf_folded)).all()
+        accel.num_threads = 3
+        assert (accel.execute(x) == x + 3).all()
+
+
+@pytest.mark.util
+@pytest.mark.parametrize("platform", ["zynq-iodma", "alveo"])
+def test_driver_emulation_sharded(driver_base, platform):
+    model_file = make_add_model()
+    accels = [
+        driver_base.FINNExampleOverlay(
+            model_file, platform, io_shape_dict, batch_size=bs, runtime_weight_dir=""
+        )
+        for bs in [4, 2, 3]
+    ]
+    sharded = driver_base.FINNShardedAccelerator(accels)
+    assert sharded.batch_size == 9
+    x = gen_finn_dt_tensor(DataType["UINT4"], (20, 8))
+    assert (sharded.execute(x) == x + 3).all()
+    res = sharded.throughput_report()
+    # two full rounds of 4+2+3, then a partial round of 2
+    assert [x["images"] for x in res["accelerators"]] == [10, 4, 6]
+    assert res["images"] == 20
+    # fewer samples than accelerators and no samples at all
+    assert (sharded.execute(x[:2]) == x[:2] + 3).all()
+    empty_res = sharded.execute(x[:0])
+    assert empty_res.shape == (0, 8)
@@ -0,0 +1,99 @@
+# Copyright (c) 2023, Xilinx
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of FINN nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import pytest
+
+from onnx import TensorProto, helper
+from qonnx.core.modelwrapper import ModelWrapper
+from qonnx.util.basic import qonnx_make_model
+
+from finn.util.basic import make_build_dir
+from finn.util.pyverilator import fifosim_traffic_pattern, get_fifo_occupancy
+
+
+@pytest.mark.util
+def test_fifosim_traffic_pattern():
+    assert fifosim_traffic_pattern(None) == 'TrafficPattern::ALWAYS, 1.0, 0, 0, ""'
+    assert fifosim_traffic_pattern("always") == fifosim_traffic_pattern(None)
+    assert fifosim_traffic_pattern("rate:0.25") == 'TrafficPattern::FIXED_RATE, 0.25, 0, 0, ""'
+    assert fifosim_traffic_pattern("burst:16:48") == 'TrafficPattern::BURST, 1.0, 16, 48, ""'
+    trace_file = make_build_dir("test_fifosim_") + "/trace.txt"
+    with open(trace_file, "w") as f:
+        f.write("1 1 0\n0 1\n")
+    assert fifosim_traffic_pattern("trace:" + trace_file) == (
+        'TrafficPattern::TRACE, 1.0, 0, 0, "%s"' % trace_file
+    )
+    for spec in ["rate:0", "rate:1.5", "burst:0:4", "trace:/nonexistent", "poisson:0.5"]:
+        with pytest.raises(Exception):
+            fifosim_traffic_pattern(spec)
+
+
+@pytest.mark.util
+def test_get_fifo_occupancy():
+    shape = [1, 4, 8]
+    tensors = [helper.make_tensor_value_info("t%d" % i, TensorProto.FLOAT, shape) for i in range(4)]
+    nodes = [
+        helper.make_node(
+            "StreamingFIFO",
+            ["t%d" % i],
+            ["t%d" % (i + 1)],
+            name="StreamingFIFO_%d" % i,
+            domain="finn.custom_op.fpgadataflow",
+            backend="fpgadataflow",
+            depth=depth,
+            depth_monitor=monitor,
+            folded_shape=[1, 4, 8],
+            normal_shape=shape,
+            dataType="INT4",
+        )
+        for i, (depth, monitor) in enumerate([(32, 1), (64, 0), (16, 1)])
+    ]
+    graph = helper.make_graph(nodes, "fifos", [tensors[0]], [tensors[3]], value_info=tensors[1:3])
+    model = ModelWrapper(qonnx_make_model(graph))
+    sim_dict = {"cycles": 100, "maxcount": 20, "fullcycles": 0, "maxcount_1": 16}
+    sim_dict["fullcycles_1"] = 30
+    for b in range(4):
+        sim_dict["occupancy_bin%d" % b] = 25
+        sim_dict["occupancy_1_bin%d" % b] = 10 * b
+    ret = get_fifo_occupancy(model, sim_dict)
+    assert ret == {
+        "StreamingFIFO_0": {
+            "depth": 32,
+            "maxcount": 20,
+            "cycles_full": 0,
+            "occupancy_histogram": [25, 25, 25, 25],
+        },
+        "StreamingFIFO_2": {
+            "depth": 16,
+            "maxcount": 16,
+            "cycles_full": 30,
+            "occupancy_histogram": [0, 10, 20, 30],
+        },
+    }
+    # the per-FIFO entries are moved out of the simulation results
+    assert sim_dict == {"cycles": 100}
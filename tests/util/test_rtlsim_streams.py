@@ -0,0 +1,95 @@
+# Copyright (c) 2023, Xilinx
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of FINN nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import pytest
+
+from finn.util.pyverilator import (
+    CyclicStream,
+    IterableStream,
+    as_rtlsim_stream,
+    concat_rtlsim_streams,
+)
+
+
+def consume(stream):
+    # consume the stream the way the rtlsim functions do: one word per cycle
+    # through len, [0] and [1:]
+    ret = []
+    while len(stream) > 0:
+        ret.append(stream[0])
+        stream = stream[1:]
+    return ret
+
+
+@pytest.mark.util
+@pytest.mark.parametrize("reps", [0, 1, 5])
+def test_cyclic_stream(reps):
+    words = [3, 1, 4, 1, 5]
+    stream = CyclicStream(words, reps)
+    expected = words * reps
+    assert len(stream) == len(expected)
+    assert list(stream) == expected
+    assert consume(stream) == expected
+    # slices off the front are views that share the words
+    tail = stream[7:]
+    assert isinstance(tail, CyclicStream) and tail.words is words
+    assert list(tail) == expected[7:]
+    assert consume(tail) == expected[7:]
+    assert list(stream[2:9]) == expected[2:9]
+    if reps > 1:
+        assert stream[-1] == expected[-1]
+        assert tail[0] == expected[7]
+    with pytest.raises(IndexError):
+        stream[len(expected)]
+
+
+@pytest.mark.util
+@pytest.mark.parametrize("length", [None, 10])
+def test_iterable_stream(length):
+    stream = as_rtlsim_stream(x * x for x in range(10))
+    if length is not None:
+        stream = IterableStream((x * x for x in range(10)), length)
+        assert len(stream) == 10
+    assert isinstance(stream, IterableStream)
+    assert consume(stream) == [x * x for x in range(10)]
+    assert len(stream) == 0
+    assert list(IterableStream(range(4), length)[2:]) == [2, 3]
+    # lists are used as they are
+    words = [1, 2, 3]
+    assert as_rtlsim_stream(words) is words
+
+
+@pytest.mark.util
+def test_concat_rtlsim_streams():
+    words = [7, 8, 9]
+    merged = concat_rtlsim_streams([CyclicStream(words, 2), CyclicStream(list(words), 3)])
+    assert isinstance(merged, CyclicStream)
+    assert list(merged) == words * 5
+    mixed = [CyclicStream(words, 2), CyclicStream([1], 2), [4, 5]]
+    assert concat_rtlsim_streams(mixed) == words * 2 + [1, 1, 4, 5]
+    assert concat_rtlsim_streams([[1, 2], [3]]) == [1, 2, 3]
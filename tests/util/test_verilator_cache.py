@@ -0,0 +1,92 @@
+# Copyright (c) 2023, Xilinx
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of FINN nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import pytest
+
+import os
+
+from finn.util.basic import make_build_dir
+from finn.util.verilator_cache import (
+    get_cached_verilator_build,
+    store_verilator_build,
+    verilator_cache_key,
+)
+
+
+def write_file(fname, content):
+    with open(fname, "w") as f:
+        f.write(content)
+    return fname
+
+
+@pytest.mark.util
+def test_verilator_cache_key():
+    src_dir0 = make_build_dir("test_verilator_cache_src_")
+    src_dir1 = make_build_dir("test_verilator_cache_src_")
+    srcs0 = [write_file(src_dir0 + "/top.v", "module top();\nendmodule\n")]
+    srcs1 = [write_file(src_dir1 + "/top.v", "module top();\nendmodule\n")]
+    args0 = ["-Mdir", src_dir0 + "/obj", "--top-module", "top"]
+    args1 = ["-Mdir", src_dir1 + "/obj", "--top-module", "top"]
+    key0 = verilator_cache_key(srcs0, args0, {src_dir0: "$DIR"})
+    # the same design in another dir has the same key
+    assert verilator_cache_key(srcs1, args1, {src_dir1: "$DIR"}) == key0
+    assert verilator_cache_key(srcs1, args1) != key0
+    # but any change to sources or args gives a new one
+    assert verilator_cache_key(srcs0, args0 + ["-O3"], {src_dir0: "$DIR"}) != key0
+    write_file(srcs1[0], "module top(input clk);\nendmodule\n")
+    assert verilator_cache_key(srcs1, args1, {src_dir1: "$DIR"}) != key0
+
+
+@pytest.mark.util
+def test_verilator_cache(monkeypatch):
+    cache_dir = make_build_dir("test_verilator_cache_")
+    monkeypatch.setenv("FINN_VERILATOR_CACHE_DIR", cache_dir)
+    monkeypatch.setenv("FINN_VERILATOR_CACHE_SIZE_MB", "1")
+    build_dir = make_build_dir("test_verilator_cache_build_")
+    lib = write_file(build_dir + "/model.so", "x" * 300000)
+    assert get_cached_verilator_build("key0", build_dir) is None
+    store_verilator_build("key0", [lib])
+    out_dir = make_build_dir("test_verilator_cache_out_")
+    cached = get_cached_verilator_build("key0", out_dir)
+    assert cached == [out_dir + "/model.so"]
+    with open(cached[0]) as f:
+        assert f.read() == "x" * 300000
+    # store more than fits into 1 MB, after using key0 again
+    store_verilator_build("key1", [lib])
+    store_verilator_build("key2", [lib])
+    os.utime(cache_dir + "/key1", (0, 0))
+    os.utime(cache_dir + "/key0", (1, 1))
+    assert get_cached_verilator_build("key0", out_dir) is not None
+    store_verilator_build("key3", [lib])
+    # the least recently used entry is evicted
+    assert sorted(os.listdir(cache_dir)) == ["key0", "key2", "key3"]
+    # a size of 0 disables the cache
+    monkeypatch.setenv("FINN_VERILATOR_CACHE_SIZE_MB", "0")
+    assert get_cached_verilator_build("key0", out_dir) is None
+    store_verilator_build("key4", [lib])
+    assert not os.path.exists(cache_dir + "/key4")